@@ -0,0 +1,494 @@
+"""MQTT queue publishers driven by a single asyncio event loop.
+
+MQTTQueuePublisher in producer.py uses two threads per publisher: the paho network
+thread and the queue publisher thread. The publishers here have the same
+start_q/append_payload/flush/end_q interface but run every publisher's network I/O
+and queue on one shared event loop, so a process with many streams needs one extra
+thread in total. As with mqttpool, publishers to the same broker share one
+connection.
+
+The paho client is integrated with the event loop through its socket callbacks
+instead of loop_start, so no further dependencies are required.
+"""
+
+import asyncio
+import functools
+import queue
+import threading
+import time
+import warnings
+
+import paho.mqtt.client as mqtt
+
+from mqttpool import ConnectionPool
+from publishqueue import (
+    CONFLATED,
+    DROPPED,
+    FAILED,
+    PUBLISH_SECONDS,
+    PUBLISHED,
+    PUBLISHED_BYTES,
+    QUEUE_DEPTH,
+    PublishQueue,
+)
+from streams import CurrentStream, EQEStream, IVStream, MPPTStream, VoltageStream
+
+_loop = None
+_loop_lock = threading.Lock()
+
+# reconnection backoff in seconds, as in paho's network thread
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 120
+
+# connection pool for each event loop, only used from the loop's thread
+_pools = {}
+
+
+def get_event_loop():
+    """Get the event loop shared by asyncio publishers.
+
+    The loop is started in a daemon thread the first time it's needed.
+
+    Returns
+    -------
+    loop : asyncio.AbstractEventLoop
+        Running event loop.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="asyncio-publisher", daemon=True
+            ).start()
+    return _loop
+
+
+def get_pool(loop):
+    """Get the pool of connections driven by an event loop.
+
+    Must be called from the event loop's thread.
+
+    Parameters
+    ----------
+    loop : asyncio.AbstractEventLoop
+        Event loop the connections run in.
+
+    Returns
+    -------
+    pool : mqttpool.ConnectionPool
+        Pool of AsyncMQTTConnection.
+    """
+    if loop not in _pools:
+        _pools[loop] = ConnectionPool(functools.partial(AsyncMQTTConnection, loop))
+    return _pools[loop]
+
+
+class AsyncMQTTConnection:
+    """MQTT client connection whose network I/O is driven by an asyncio event loop.
+
+    All methods must be called from the event loop's thread.
+    """
+
+    def __init__(self, loop, host, port=1883):
+        """Construct connection.
+
+        Parameters
+        ----------
+        loop : asyncio.AbstractEventLoop
+            Event loop to run the client in.
+        host : str
+            MQTT broker address.
+        port : int
+            MQTT broker port.
+        """
+        self._loop = loop
+        self.host = host
+        self.port = port
+        self._misc = None
+        self._published = {}
+        self.client = mqtt.Client()
+        # each publisher bounds its own in-flight window
+        self.client.max_inflight_messages_set(0)
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self.client.on_publish = self._on_publish
+
+    def open(self):
+        """Start connecting to the broker.
+
+        The connection is made in the background, so messages published before it
+        is up are sent once it is.
+        """
+        self._misc = self._loop.create_task(self._misc_loop())
+
+    def close(self):
+        """Disconnect from the broker."""
+        self.client.disconnect()
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+
+    def publish(self, topic, payload, qos=2):
+        """Publish a message.
+
+        Parameters
+        ----------
+        topic : str
+            MQTT topic to publish to.
+        payload : str or bytes
+            Message payload.
+        qos : int
+            Quality of service level.
+
+        Returns
+        -------
+        published : asyncio.Future
+            Future that completes when publication of the message has completed.
+        """
+        published = self._loop.create_future()
+        info = self.client.publish(topic, payload, qos=qos)
+        if (qos == 0) and (info.rc != mqtt.MQTT_ERR_SUCCESS):
+            # a QoS 0 message that couldn't be sent is never acknowledged
+            published.set_result(info.mid)
+        else:
+            self._published[info.mid] = published
+        return published
+
+    def _on_publish(self, client, userdata, mid):
+        """Complete the future of a published message."""
+        # writes are deferred to the event loop, so this is never called before the
+        # future is registered by publish()
+        published = self._published.pop(mid, None)
+        if (published is not None) and (not published.done()):
+            published.set_result(mid)
+
+    def _call_in_loop(self, callback, *args):
+        """Call a function in the event loop's thread.
+
+        Socket callbacks are also called while connecting in an executor thread.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    # sockets are passed to the event loop by file descriptor, since a socket closed
+    # by paho may already be closed by the time the loop gets to it
+
+    def _on_socket_open(self, client, userdata, sock):
+        """Watch a new socket for incoming data."""
+        self._call_in_loop(self._loop.add_reader, sock.fileno(), client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        """Stop watching a closed socket."""
+        self._call_in_loop(self._loop.remove_reader, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        """Write queued packets when the socket is writable."""
+        self._call_in_loop(self._loop.add_writer, sock.fileno(), client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        """Stop waiting for the socket to become writable."""
+        self._call_in_loop(self._loop.remove_writer, sock.fileno())
+
+    async def _misc_loop(self):
+        """Connect, then handle keepalive and retries, reconnecting when needed.
+
+        Connecting blocks on name lookup and the TCP handshake, so it's done in the
+        loop's default executor to keep other connections on the loop running.
+        Attempts are made with exponential backoff like paho's network thread. The
+        new socket is registered with the event loop by the socket callbacks, and
+        messages awaiting acknowledgement are sent again once reconnected.
+        """
+        connect = functools.partial(self.client.connect, self.host, self.port)
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                await self._loop.run_in_executor(None, connect)
+            except OSError as e:
+                warnings.warn(
+                    f"Failed to connect to {self.host}:{self.port}, retrying in"
+                    + f" {delay} s: {e!r}"
+                )
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, RECONNECT_MAX_DELAY)
+                continue
+            connect = self.client.reconnect
+            delay = RECONNECT_MIN_DELAY
+            while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                await asyncio.sleep(1)
+            await asyncio.sleep(delay)
+
+
+class AsyncMQTTQueuePublisher:
+    """Publish data to a topic from a queue using an asyncio event loop.
+
+    The interface matches MQTTQueuePublisher: payloads can be appended to the queue
+    from any thread without blocking, and are published by a task on the shared event
+    loop with up to `max_inflight` messages awaiting acknowledgement at once.
+
+    The queue is a PublishQueue with the same bounds and overflow policies as
+    MQTTQueuePublisher. The publisher task is woken by an asyncio.Event when payloads
+    are appended. With the "block" policy, payloads must not be appended from the
+    event loop's own thread.
+    """
+
+    def __init__(
+        self,
+        qos=2,
+        max_inflight=20,
+        maxsize=None,
+        maxbytes=None,
+        policy="block",
+        loop=None,
+    ):
+        """Construct queue publisher.
+
+        Parameters
+        ----------
+        qos : int
+            Default quality of service level (0, 1, or 2) for published messages.
+        max_inflight : int
+            Maximum number of published messages awaiting acknowledgement.
+        maxsize : int or None
+            Maximum number of queued payloads. If None, the queue isn't limited.
+        maxbytes : int or None
+            Maximum total size of queued payloads. If None, the size isn't limited.
+        policy : {"block", "drop_oldest", "drop_newest", "conflate"}
+            What to do when a payload is appended to a full queue.
+        loop : asyncio.AbstractEventLoop or None
+            Running event loop to use. If None, use the shared publisher loop.
+        """
+        self._loop = get_event_loop() if loop is None else loop
+        self._topic = None
+        self.qos = qos
+        self.max_inflight = max_inflight
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.policy = policy
+        self._connection = None
+        self._q = None
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def topic(self):
+        """Get topic attribute."""
+        return self._topic
+
+    @property
+    def q_size(self):
+        """Get current length of queue."""
+        return len(self._q)
+
+    @property
+    def dropped(self):
+        """Get number of payloads discarded because the queue was full."""
+        return 0 if self._q is None else self._q.dropped
+
+    @property
+    def conflated(self):
+        """Get number of payloads replaced by a newer one because the queue was full."""
+        return 0 if self._q is None else self._q.conflated
+
+    def _run(self, coro, timeout=None):
+        """Run a coroutine on the event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def connect(self, host, port=1883):
+        """Connect to a broker through the event loop's shared connection pool.
+
+        Parameters
+        ----------
+        host : str
+            MQTT broker address.
+        port : int
+            MQTT broker port.
+        """
+        if self._connection is not None:
+            return
+
+        async def connect():
+            return get_pool(self._loop).acquire(host, port)
+
+        self._connection = self._run(connect())
+
+    def disconnect(self):
+        """Release the connection to the broker."""
+        if self._connection is None:
+            return
+
+        async def disconnect():
+            get_pool(self._loop).release(self._connection)
+
+        self._run(disconnect())
+        self._connection = None
+
+    def start_q(self, topic, qos=None):
+        """Start the queue publisher task.
+
+        topic : str
+            MQTT topic to publish to.
+        qos : int or None
+            Quality of service level for this stream. If None, use the default given
+            at construction.
+        """
+        if self._topic is None:
+            self._topic = topic
+            if qos is not None:
+                self.qos = qos
+            self._q = PublishQueue(self.maxsize, self.maxbytes, self.policy)
+            q = self._q
+            QUEUE_DEPTH.labels(topic).set_function(lambda: len(q))
+            DROPPED.labels(topic).set_function(lambda: q.dropped)
+            CONFLATED.labels(topic).set_function(lambda: q.conflated)
+            self._published = PUBLISHED.labels(topic)
+            self._failed = FAILED.labels(topic)
+            self._published_bytes = PUBLISHED_BYTES.labels(topic)
+            self._publish_seconds = PUBLISH_SECONDS.labels(topic)
+
+            async def start():
+                self._wakeup = asyncio.Event()
+                self._task = asyncio.create_task(self._queue_publisher())
+
+            self._run(start())
+        else:
+            warnings.warn(
+                f"A queue for '{self._topic}' is already running. End that queue first or instantiate a new queue publisher."
+            )
+
+    def end_q(self, timeout=None):
+        """End the task that publishes data to a topic from its own queue.
+
+        timeout : float or None
+            Maximum time in seconds to wait for queued payloads to be published
+            before stopping. If None, wait until the queue is drained. Payloads still
+            queued after the timeout are discarded.
+        """
+        if self._topic is None:
+            return
+        self.flush(timeout)
+
+        async def stop():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        self._run(stop())
+        self._topic = None
+
+    def flush(self, timeout=None):
+        """Block until all queued payloads have been published.
+
+        Must not be called from the event loop's thread.
+
+        timeout : float or None
+            Maximum time to wait in seconds. If None, wait indefinitely.
+
+        Returns
+        -------
+        flushed : bool
+            True if the queue was drained, False if the timeout expired first.
+        """
+        return self._q.flush(timeout)
+
+    def append_payload(self, payload, key=None, droppable=True):
+        """Append a payload to a queue.
+
+        Safe to call from any thread.
+
+        payload : str or bytes
+            Message to be added to queue.
+        key : hashable
+            Stream the payload belongs to, used when conflating. Defaults to the topic.
+        droppable : bool
+            If False, the payload is never discarded to bound the queue.
+        """
+        key = self._topic if key is None else key
+        self._q.put(payload, key=key, droppable=droppable)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _queue_publisher(self):
+        """Publish elements in the queue.
+
+        Queue items are marked done when their publication completes, or when it
+        fails to start.
+        """
+        window = asyncio.Semaphore(self.max_inflight)
+
+        def complete(published, start=None):
+            if start is not None:
+                if published.cancelled() or (published.exception() is not None):
+                    self._failed.inc()
+                else:
+                    self._publish_seconds.observe(time.monotonic() - start)
+                    self._published.inc()
+            window.release()
+            self._q.task_done()
+
+        while True:
+            # clear before checking the queue so an append in between isn't missed
+            self._wakeup.clear()
+            try:
+                payload = self._q.get(timeout=0)
+            except queue.Empty:
+                await self._wakeup.wait()
+                continue
+            await window.acquire()
+            self._published_bytes.inc(len(payload))
+            start = time.monotonic()
+            try:
+                published = self._connection.publish(
+                    self._topic, payload, qos=self.qos
+                )
+            except Exception as e:
+                # keep consuming, so flush() and end_q() don't wait for a dead task
+                complete(None)
+                self._failed.inc()
+                warnings.warn(f"Failed to publish to {self._topic}: {e!r}")
+            else:
+                published.add_done_callback(functools.partial(complete, start=start))
+
+    def __enter__(self):
+        """Enter the runtime context related to this object."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit the runtime context related to this object.
+
+        Make sure everything gets cleaned up properly.
+        """
+        print(f"\nCleaning up {self._topic}...")
+        # on error don't hang waiting for a queue that may never drain
+        self.end_q(timeout=None if exc_type is None else 0)
+        self.disconnect()
+        print("Clean!")
+
+
+class AsyncVoltageDataHandler(VoltageStream, AsyncMQTTQueuePublisher):
+    """Publish voltage vs. time data from the asyncio event loop."""
+
+
+class AsyncIVDataHandler(IVStream, AsyncMQTTQueuePublisher):
+    """Publish current vs. voltage data from the asyncio event loop."""
+
+
+class AsyncMPPTDataHandler(MPPTStream, AsyncMQTTQueuePublisher):
+    """Publish max power point tracking data from the asyncio event loop."""
+
+
+class AsyncCurrentDataHandler(CurrentStream, AsyncMQTTQueuePublisher):
+    """Publish current vs. time data from the asyncio event loop."""
+
+
+class AsyncEQEDataHandler(EQEStream, AsyncMQTTQueuePublisher):
+    """Publish EQE data from the asyncio event loop."""
@@ -0,0 +1,15 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    plotter: {
+        // apply a Plotly.relayout patch to the graph with the given id
+        relayout: function(patch, id) {
+            if (patch) {
+                var graph = document.getElementById(id);
+                var gd = graph && graph.getElementsByClassName("js-plotly-plot")[0];
+                if (gd) {
+                    Plotly.relayout(gd, patch);
+                }
+            }
+            return window.dash_clientside.no_update;
+        }
+    }
+});
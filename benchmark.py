@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+"""Offline micro-benchmarks of the producer and plotter hot paths.
+
+The functions are called directly with synthetic data, so no MQTT broker or browser
+is needed:
+
+- encode: data handler handle_data, in the JSON and binary wire formats.
+- ingest: on_message_1..5 with a single data point (a whole sweep for stream 2) on
+  top of stored history.
+- format: format_figure_1..5 with the whole stored history, as sent when a figure is
+  redrawn.
+- update: the update_graph_live callback after a point is appended, as run on every
+  interval.
+
+Each benchmark is run at several sizes (history length, or sweep length for stream
+2), and reports throughput, latency percentiles, and the memory allocated per call
+measured with tracemalloc. Results can be saved as JSON to compare runs.
+"""
+
+import copy
+import json
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+import plotter
+import wire
+from streams import CurrentStream, EQEStream, IVStream, MPPTStream, VoltageStream
+
+# history lengths benchmarked by default
+SIZES = [100, 1000, 10000, 100000, 1000000]
+
+# number of data columns and encoder of each stream
+NCOLS = {1: 2, 2: 4, 3: 4, 4: 2, 5: 3}
+STREAMS = {
+    1: VoltageStream,
+    2: IVStream,
+    3: MPPTStream,
+    4: CurrentStream,
+    5: EQEStream,
+}
+ON_MESSAGES = {
+    1: plotter.on_message_1,
+    2: plotter.on_message_2,
+    3: plotter.on_message_3,
+    4: plotter.on_message_4,
+    5: plotter.on_message_5,
+}
+FORMAT_FIGURES = {
+    1: plotter.format_figure_1,
+    2: plotter.format_figure_2,
+    3: plotter.format_figure_3,
+    4: plotter.format_figure_4,
+    5: plotter.format_figure_5,
+}
+
+
+class _Sink:
+    """Publisher stand-in that keeps the last appended payload."""
+
+    def __init__(self):
+        self.payload = None
+
+    def append_payload(self, payload, key=None, droppable=True):
+        self.payload = payload
+
+
+def make_handler(stream, wire_format):
+    """Make a data handler that encodes data without publishing it.
+
+    Parameters
+    ----------
+    stream : int
+        Stream number from range 1-5.
+    wire_format : {"json", "binary"}
+        Format to encode data in.
+
+    Returns
+    -------
+    handler : DataStream
+        Data handler. The last payload is kept in its `payload` attribute.
+    """
+    cls = type("Handler", (STREAMS[stream], _Sink), {})
+    return cls(idn="dev0", wire_format=wire_format)
+
+
+def make_rows(stream, n):
+    """Make synthetic rows of data for a stream.
+
+    Parameters
+    ----------
+    stream : int
+        Stream number from range 1-5.
+    n : int
+        Number of rows.
+
+    Returns
+    -------
+    rows : array
+        Array of shape (n, columns). The first column increases monotonically.
+    """
+    rows = np.random.rand(n, NCOLS[stream])
+    rows[:, 0] = np.arange(n)
+    return rows
+
+
+def make_payload(stream, rows, wire_format):
+    """Encode rows of data as a plotter would receive them.
+
+    Parameters
+    ----------
+    stream : int
+        Stream number from range 1-5.
+    rows : array
+        Rows of data. Streams other than 2 only send the first row.
+    wire_format : {"json", "binary"}
+        Format to encode data in.
+
+    Returns
+    -------
+    payload : bytes
+        MQTT payload.
+    """
+    handler = make_handler(stream, wire_format)
+    if stream == 2:
+        handler.handle_data(rows)
+    else:
+        handler.handle_data(list(rows[0]))
+    payload = handler.payload
+    return payload if isinstance(payload, bytes) else payload.encode()
+
+
+def fill_store(stream, n):
+    """Replace the data of a device in the plotter with synthetic history.
+
+    Parameters
+    ----------
+    stream : int
+        Stream number from range 1-5.
+    n : int
+        Number of rows of history.
+
+    Returns
+    -------
+    store : SeriesStore
+        Plotter store of device dev0 on the stream.
+    """
+    msg = {"clear": False, "id": "dev0"}
+    plotter.STORES.replace(f"exp{stream}", "dev0", make_rows(stream, n), msg)
+    return plotter.STORES.get(f"exp{stream}", "dev0")
+
+
+def measure(func, before=None, duration=0.5, min_calls=3, max_calls=100000):
+    """Measure the latency and allocations of a function.
+
+    Parameters
+    ----------
+    func : callable
+        Function to call with no arguments.
+    before : callable or None
+        Called before each call of `func`, excluded from the measurement.
+    duration : float
+        Time in seconds to keep calling the function for.
+    min_calls : int
+        Minimum number of calls.
+    max_calls : int
+        Maximum number of calls.
+
+    Returns
+    -------
+    result : dict
+        Number of "calls", "throughput" in calls/s, latency percentiles "p50",
+        "p90", and "p99" in s, and mean "alloc" in bytes allocated per call.
+    """
+    latencies = []
+    start = time.perf_counter()
+    while (len(latencies) < min_calls) or (
+        (len(latencies) < max_calls) and (time.perf_counter() - start < duration)
+    ):
+        if before is not None:
+            before()
+        t0 = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - t0)
+
+    # allocations are measured separately because tracing slows everything down
+    calls = min(len(latencies), min_calls)
+    allocated = 0
+    tracemalloc.start()
+    for _ in range(calls):
+        if before is not None:
+            before()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        func()
+        allocated += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        "calls": len(latencies),
+        "throughput": len(latencies) / sum(latencies),
+        "p50": p50,
+        "p90": p90,
+        "p99": p99,
+        "alloc": allocated / calls,
+    }
+
+
+def bench_encode(stream, wire_format, n):
+    """Benchmark encoding data from an experiment.
+
+    Stream 2 encodes a sweep of `n` points. Other streams encode a single point.
+    """
+    handler = make_handler(stream, wire_format)
+    if stream == 2:
+        data = make_rows(stream, n)
+    else:
+        data = list(make_rows(stream, 1)[0])
+    return lambda: handler.handle_data(data), None
+
+
+def bench_ingest(stream, wire_format, n):
+    """Benchmark ingesting a message on top of `n` points of history.
+
+    Stream 2 replaces its data with a sweep of `n` points.
+    """
+    rows = make_rows(stream, n)
+    fill_store(stream, 0 if stream == 2 else n)
+    msg = types.SimpleNamespace(payload=make_payload(stream, rows, wire_format))
+    on_message = ON_MESSAGES[stream]
+    return lambda: on_message(None, None, msg), None
+
+
+def bench_format(stream, wire_format, n):
+    """Benchmark formatting a complete figure with `n` points."""
+    store = fill_store(stream, n)
+    template = plotter.GRAPHS[f"g{stream}"]["template"]
+    format_figure = FORMAT_FIGURES[stream]
+
+    def func():
+        format_figure(store.data, copy.deepcopy(template), "dev0", store.bounds)
+
+    return func, None
+
+
+def bench_update(stream, wire_format, n):
+    """Benchmark the live update callback after a point is appended to `n` points."""
+    store = fill_store(stream, n)
+    graph = f"g{stream}"
+    row = make_rows(stream, 1)
+    seen = {"device": None, "version": -1, "generation": -1, "count": 0}
+    # bring the browser state up to date with the history
+    seen = plotter.update_graph_live(graph, seen, False)[3]
+
+    def before():
+        store.extend(row, store.msg)
+
+    def func():
+        nonlocal seen
+        seen = plotter.update_graph_live(graph, seen, False)[3]
+
+    return func, before
+
+
+BENCHMARKS = {
+    "encode": bench_encode,
+    "ingest": bench_ingest,
+    "format": bench_format,
+    "update": bench_update,
+}
+
+
+def run(benchmarks=None, streams=None, formats=None, sizes=None, duration=0.5):
+    """Run benchmarks and print the results.
+
+    Parameters
+    ----------
+    benchmarks : list of str or None
+        Names of benchmarks in `BENCHMARKS`. If None, run all of them.
+    streams : list of int or None
+        Stream numbers from range 1-5. If None, use all streams.
+    formats : list of str or None
+        Wire formats. If None, use all supported formats.
+    sizes : list of int or None
+        History lengths. If None, use `SIZES`.
+    duration : float
+        Time in seconds to run each benchmark for.
+
+    Returns
+    -------
+    results : list of dict
+        Result of each benchmark run with its name, stream, format and size.
+    """
+    benchmarks = list(BENCHMARKS) if benchmarks is None else benchmarks
+    streams = list(STREAMS) if streams is None else streams
+    formats = list(wire.SUPPORTED_FORMATS) if formats is None else formats
+    sizes = SIZES if sizes is None else sizes
+
+    print(
+        f"{'benchmark':<10}{'stream':>7}{'format':>8}{'size':>9}{'calls':>8}"
+        + f"{'ops/s':>11}{'p50 (us)':>11}{'p90 (us)':>11}{'p99 (us)':>11}"
+        + f"{'alloc (KiB)':>13}"
+    )
+    results = []
+    for name in benchmarks:
+        for stream in streams:
+            for wire_format in formats:
+                # the plotter's figures don't depend on the wire format
+                if (name in ["format", "update"]) and (wire_format != formats[0]):
+                    continue
+                for n in sizes:
+                    func, before = BENCHMARKS[name](stream, wire_format, n)
+                    result = measure(func, before, duration)
+                    result["name"] = name
+                    result["stream"] = stream
+                    result["format"] = wire_format
+                    result["size"] = n
+                    results.append(result)
+                    print(
+                        f"{name:<10}{stream:>7}{wire_format:>8}{n:>9}"
+                        + f"{result['calls']:>8}{result['throughput']:>11.1f}"
+                        + f"{result['p50'] * 1e6:>11.1f}{result['p90'] * 1e6:>11.1f}"
+                        + f"{result['p99'] * 1e6:>11.1f}{result['alloc'] / 1024:>13.1f}"
+                    )
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-b",
+        metavar="b",
+        type=str,
+        nargs="+",
+        default=None,
+        choices=list(BENCHMARKS),
+        help="Benchmark(s) to run. Defaults to all.",
+    )
+    parser.add_argument(
+        "-e",
+        metavar="e",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Stream/experiment type(s) from range 1-5. Defaults to all.",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        nargs="+",
+        default=None,
+        choices=list(wire.SUPPORTED_FORMATS),
+        help="Wire format(s). Defaults to all.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=SIZES,
+        help="History lengths in points.",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=0.5,
+        help="Time (s) to run each benchmark for.",
+    )
+    parser.add_argument(
+        "-o", metavar="o", type=str, default=None, help="Save results to a JSON file."
+    )
+    args = parser.parse_args()
+
+    results = run(args.b, args.e, args.format, args.sizes, args.duration)
+
+    if args.o is not None:
+        with open(args.o, "w") as f:
+            json.dump(results, f, indent=2)
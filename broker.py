@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""Minimal MQTT broker for local testing.
+
+A stand-in for a real broker so the producer and plotter can be load tested on one
+machine without a network connection. It implements the parts of MQTT 3.1.1 used by
+this project on a single asyncio event loop:
+
+- clean sessions only, no authentication, no wills;
+- publishing at QoS 0, 1, and 2;
+- subscriptions with + and # wildcards, granted at QoS 0, so messages are
+  forwarded to subscribers at most once;
+- retained messages.
+
+Forwarding waits for a subscriber's socket buffer to drain, so a slow subscriber
+slows down publishers rather than using unbounded memory.
+"""
+
+import asyncio
+import struct
+import threading
+
+import paho.mqtt.client as mqtt
+
+# packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def _packet(packet_type, flags, body):
+    """Build a packet from its type, header flags, and variable header and payload."""
+    length = len(body)
+    header = bytearray([packet_type << 4 | flags])
+    while True:
+        byte = length % 128
+        length //= 128
+        header.append(byte | 0x80 if length > 0 else byte)
+        if length == 0:
+            break
+    return bytes(header) + body
+
+
+def _string(data, offset):
+    """Read a length-prefixed UTF-8 string, returning it and the offset after it."""
+    (length,) = struct.unpack_from("!H", data, offset)
+    start = offset + 2
+    return data[start : start + length].decode(), start + length
+
+
+class _Session:
+    """Connection from a client."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.subscriptions = set()
+        # QoS 2 messages received but not yet released, to ignore duplicates
+        self.incoming = set()
+
+    async def send(self, packet):
+        """Send a packet, waiting for the socket buffer to drain if it's full."""
+        self.writer.write(packet)
+        await self.writer.drain()
+
+
+class Broker:
+    """MQTT broker serving clients from an asyncio event loop."""
+
+    def __init__(self, host="127.0.0.1", port=1883):
+        """Construct broker.
+
+        Parameters
+        ----------
+        host : str
+            Address to listen on.
+        port : int
+            Port to listen on. If 0, a free port is chosen when the broker starts.
+        """
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.retained = {}
+        self.received = 0
+        self.forwarded = 0
+        self._server = None
+        self._loop = None
+
+    async def start(self):
+        """Start listening for clients."""
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening and disconnect all clients."""
+        self._server.close()
+        for session in list(self.sessions):
+            session.writer.close()
+        await self._server.wait_closed()
+
+    def start_thread(self):
+        """Run the broker on its own event loop in a daemon thread.
+
+        Returns once the broker is listening.
+        """
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self._loop.run_forever, name="mqtt-broker", daemon=True
+        ).start()
+        asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+
+    def stop_thread(self):
+        """Stop a broker started with `start_thread`."""
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _serve(self, reader, writer):
+        """Handle the packets from a client until it disconnects."""
+        session = _Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                first = (await reader.readexactly(1))[0]
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if byte & 0x80 == 0:
+                        break
+                body = await reader.readexactly(length)
+                if await self._handle(session, first >> 4, first & 0x0F, body) is False:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # client went away without disconnecting
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    async def _handle(self, session, packet_type, flags, body):
+        """Handle a packet from a client.
+
+        Returns
+        -------
+        connected : bool
+            False if the client has disconnected.
+        """
+        if packet_type == CONNECT:
+            # session present: 0, return code: accepted
+            await session.send(_packet(CONNACK, 0, b"\x00\x00"))
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            retain = flags & 0x01
+            topic, offset = _string(body, 0)
+            if qos > 0:
+                (packet_id,) = struct.unpack_from("!H", body, offset)
+                offset += 2
+            payload = body[offset:]
+            if qos == 1:
+                await session.send(_packet(PUBACK, 0, struct.pack("!H", packet_id)))
+            elif qos == 2:
+                await session.send(_packet(PUBREC, 0, struct.pack("!H", packet_id)))
+                if packet_id in session.incoming:
+                    # retransmission of a message that has already been forwarded
+                    return True
+                session.incoming.add(packet_id)
+            if retain == 1:
+                if len(payload) > 0:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            await self._forward(topic, payload)
+        elif packet_type == PUBREL:
+            (packet_id,) = struct.unpack_from("!H", body, 0)
+            session.incoming.discard(packet_id)
+            await session.send(_packet(PUBCOMP, 0, body[:2]))
+        elif packet_type == SUBSCRIBE:
+            offset = 2
+            filters = []
+            while offset < len(body):
+                topic_filter, offset = _string(body, offset)
+                offset += 1  # requested QoS
+                filters.append(topic_filter)
+            session.subscriptions.update(filters)
+            # grant QoS 0 for every filter
+            await session.send(_packet(SUBACK, 0, body[:2] + bytes(len(filters))))
+            for topic, payload in list(self.retained.items()):
+                if any(mqtt.topic_matches_sub(f, topic) for f in filters):
+                    await session.send(self._publish_packet(topic, payload, retain=1))
+        elif packet_type == UNSUBSCRIBE:
+            offset = 2
+            while offset < len(body):
+                topic_filter, offset = _string(body, offset)
+                session.subscriptions.discard(topic_filter)
+            await session.send(_packet(UNSUBACK, 0, body[:2]))
+        elif packet_type == PINGREQ:
+            await session.send(_packet(PINGRESP, 0, b""))
+        elif packet_type == DISCONNECT:
+            return False
+        return True
+
+    @staticmethod
+    def _publish_packet(topic, payload, retain=0):
+        """Build a QoS 0 PUBLISH packet."""
+        topic = topic.encode()
+        return _packet(PUBLISH, retain, struct.pack("!H", len(topic)) + topic + payload)
+
+    async def _forward(self, topic, payload):
+        """Forward a message to every subscriber of its topic."""
+        self.received += 1
+        packet = None
+        for session in list(self.sessions):
+            if any(mqtt.topic_matches_sub(f, topic) for f in session.subscriptions):
+                if packet is None:
+                    packet = self._publish_packet(topic, payload)
+                try:
+                    await session.send(packet)
+                except ConnectionError:
+                    continue
+                self.forwarded += 1
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="Address to listen on."
+    )
+    parser.add_argument("--port", type=int, default=1883, help="Port to listen on.")
+    args = parser.parse_args()
+
+    async def main():
+        broker = Broker(args.host, args.port)
+        await broker.start()
+        print(f"Listening on mqtt://{broker.host}:{broker.port}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
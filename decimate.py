@@ -0,0 +1,143 @@
+"""Reduce the number of points in a trace while preserving its visual shape."""
+
+import numpy as np
+
+
+def _bucket_edges(start, stop, n_buckets):
+    """Split the index range [start, stop) into equal-count buckets."""
+    return np.linspace(start, stop, n_buckets + 1).astype(int)
+
+
+def lttb(x, y, n_out):
+    """Select points with the largest-triangle-three-buckets algorithm.
+
+    The first and last points are always kept. The remaining points are split into
+    `n_out` - 2 buckets and from each bucket the point forming the largest triangle
+    with the point selected from the previous bucket and the average of the next
+    bucket is kept.
+
+    Since each selection depends on the one before it, the buckets are visited in
+    turn in Python. The bucket averages, and the triangle areas of all points in a
+    bucket, are calculated with numpy.
+
+    Parameters
+    ----------
+    x : array
+        x values.
+    y : array
+        y values.
+    n_out : int
+        Number of points to keep.
+
+    Returns
+    -------
+    indices : array
+        Sorted indices of the points to keep.
+    """
+    n = len(x)
+    if (n_out >= n) or (n_out < 3):
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    edges = _bucket_edges(1, n - 1, n_out - 2)
+    counts = np.diff(edges)
+
+    # average of each bucket, followed by the last point, used as the third vertex
+    avg_x = np.append(np.add.reduceat(x[: n - 1], edges[:-1]) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[: n - 1], edges[:-1]) / counts, y[-1])
+
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        xb = x[lo:hi]
+        yb = y[lo:hi]
+        # twice the triangle area, sign dropped
+        area = np.abs(
+            (x[a] - avg_x[i + 1]) * (yb - y[a]) - (x[a] - xb) * (avg_y[i + 1] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        indices[i + 1] = a
+
+    return indices
+
+
+def minmax(x, y, n_out):
+    """Select the minimum and maximum point of each bucket.
+
+    Points are split into (`n_out` - 2) / 2 equal-count buckets, one per horizontal
+    pixel column the trace is drawn into, and the lowest and highest point of each
+    bucket are kept along with the first and last points. Buckets are formed by index
+    rather than by x value so traces that double back on themselves, such as forward
+    and reverse sweeps, are preserved.
+
+    Parameters
+    ----------
+    x : array
+        x values.
+    y : array
+        y values.
+    n_out : int
+        Maximum number of points to keep.
+
+    Returns
+    -------
+    indices : array
+        Sorted indices of the points to keep.
+    """
+    n = len(y)
+    if (n_out >= n) or (n_out < 4):
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=float)
+
+    n_buckets = (n_out - 2) // 2
+    edges = _bucket_edges(0, n, n_buckets)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+
+    selected = []
+    for reduce in (np.minimum, np.maximum):
+        extremes = reduce.reduceat(y, edges[:-1])
+        candidates = np.flatnonzero(y == extremes[bucket])
+        # keep the first candidate in each bucket
+        first = np.ones(len(candidates), dtype=bool)
+        first[1:] = bucket[candidates[1:]] != bucket[candidates[:-1]]
+        selected.append(candidates[first])
+
+    return np.unique(np.concatenate(selected + [[0, n - 1]]))
+
+
+# available decimation methods
+METHODS = {"lttb": lttb, "minmax": minmax}
+
+
+def decimate(x, y, n_out, method="lttb"):
+    """Reduce the number of points in a trace.
+
+    Parameters
+    ----------
+    x : array
+        x values.
+    y : array
+        y values.
+    n_out : int or None
+        Target number of points. If None, no points are removed.
+    method : str or None
+        Name of a method in `METHODS`. If None, no points are removed.
+
+    Returns
+    -------
+    x : array
+        Decimated x values.
+    y : array
+        Decimated y values.
+    """
+    if (method is None) or (n_out is None) or (len(x) <= n_out):
+        return x, y
+
+    indices = METHODS[method](x, y, n_out)
+    return x[indices], y[indices]
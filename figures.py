@@ -0,0 +1,223 @@
+"""Initial figures of the plotter's graphs.
+
+Building figures with plotly.subplots and validating them with plotly's graph
+objects is slow and only needs to be done once. The figures are built by
+`build_templates` and cached as plain dicts in a JSON file, which `load_templates`
+reads on later starts without importing plotly. The cache is rebuilt whenever this
+module is newer than it.
+"""
+
+import json
+import os
+
+# cache of the figures built by build_templates
+TEMPLATES_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "figures.json"
+)
+
+
+def build_templates():
+    """Build the initial figure of each graph.
+
+    Returns
+    -------
+    templates : dict
+        Dictionary representation of each Plotly figure, keyed by graph id.
+    """
+    import plotly.graph_objs as go
+    from plotly.subplots import make_subplots
+
+    fig1 = make_subplots(subplot_titles=["-"])
+    fig1.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="v"))
+    fig1.update_xaxes(
+        title="time (s)",
+        ticks="inside",
+        mirror="ticks",
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig1.update_yaxes(
+        title="voltage (V)",
+        ticks="inside",
+        mirror="ticks",
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig1.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
+
+    fig2 = make_subplots(subplot_titles=["-"])
+    fig2.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="fwd"))
+    fig2.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="rev"))
+    fig2.update_xaxes(
+        title="voltage (V)",
+        ticks="inside",
+        mirror="ticks",
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig2.update_yaxes(
+        title="current (A)",
+        ticks="inside",
+        mirror="ticks",
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig2.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
+
+    fig3 = make_subplots(
+        specs=[[{"secondary_y": True}]], subplot_titles=["-"]
+    )
+    fig3.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="j"))
+    fig3.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="p"))
+    fig3.add_trace(
+        go.Scatter(x=[], y=[], mode="lines+markers", name="v"), secondary_y=True
+    )
+    fig3.update_xaxes(
+        title="time (s)",
+        ticks="inside",
+        mirror="ticks",
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig3.update_yaxes(
+        title="current (A) | power (W)",
+        ticks="inside",
+        mirror=True,
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig3.update_yaxes(
+        title="voltage (V)",
+        ticks="inside",
+        mirror=True,
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        overlaying="y",
+        secondary_y=True,
+        autorange=False,
+    )
+    fig3.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
+
+    fig4 = make_subplots(subplot_titles=["-"])
+    fig4.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="j"))
+    fig4.update_xaxes(
+        title="time (s)",
+        ticks="inside",
+        mirror="ticks",
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig4.update_yaxes(
+        title="current (A)",
+        ticks="inside",
+        mirror="ticks",
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig4.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
+
+    fig5 = make_subplots(
+        specs=[[{"secondary_y": True}]], subplot_titles=["-"]
+    )
+    fig5.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="eta"))
+    fig5.add_trace(
+        go.Scatter(x=[], y=[], mode="lines+markers", name="j"), secondary_y=True
+    )
+    fig5.update_xaxes(
+        title="wavelength (nm)",
+        ticks="inside",
+        mirror="ticks",
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig5.update_yaxes(
+        title="eqe (%)",
+        ticks="inside",
+        mirror=True,
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        autorange=False,
+    )
+    fig5.update_yaxes(
+        title="integrated j (A/m^2)",
+        ticks="inside",
+        mirror=True,
+        linecolor="#444",
+        showline=True,
+        zeroline=False,
+        showgrid=False,
+        overlaying="y",
+        secondary_y=True,
+        autorange=False,
+    )
+    fig5.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
+
+    return {
+        "g1": fig1.to_dict(),
+        "g2": fig2.to_dict(),
+        "g3": fig3.to_dict(),
+        "g4": fig4.to_dict(),
+        "g5": fig5.to_dict(),
+    }
+
+
+def load_templates(path=TEMPLATES_FILE):
+    """Load the initial figure of each graph, building and caching them if needed.
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON cache file.
+
+    Returns
+    -------
+    templates : dict
+        Dictionary representation of each Plotly figure, keyed by graph id.
+    """
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(__file__):
+            with open(path) as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        # missing or unreadable cache
+        pass
+
+    templates = build_templates()
+    try:
+        with open(path, "w") as f:
+            json.dump(templates, f)
+    except OSError:
+        # e.g. read-only install, build them again next time
+        pass
+    return templates
@@ -1,32 +1,125 @@
-"""Launch MQTT broker, data producer, and plotter."""
-
-import subprocess
-import time
-
-# open dash plotter
-p1 = subprocess.Popen(["python", "plotter.py"])
-# wait some time for Flask server to load
-time.sleep(10)
-
-# start producers
-p2 = subprocess.Popen(["python", "producer.py", "-m", "2", "-e", "1"])
-p3 = subprocess.Popen(["python", "producer.py", "-m", "2", "-e", "2"])
-p4 = subprocess.Popen(["python", "producer.py", "-m", "2", "-e", "3"])
-p5 = subprocess.Popen(["python", "producer.py", "-m", "2", "-e", "4"])
-p6 = subprocess.Popen(["python", "producer.py", "-m", "2", "-e", "5"])
-
-# end all processes with keyboard interrupt
-try:
-    p1.wait()
-    p2.wait()
-    p3.wait()
-    p4.wait()
-    p5.wait()
-    p6.wait()
-except KeyboardInterrupt:
-    p1.terminate()
-    p2.terminate()
-    p3.terminate()
-    p4.terminate()
-    p5.terminate()
-    p6.terminate()
+"""Launch MQTT broker, data producer, and plotter."""
+
+import subprocess
+import time
+import urllib.error
+import urllib.request
+
+# without the reloader, which would run a second plotter process ingesting the same
+# data, and which terminate() wouldn't stop
+PLOTTER = ["python", "plotter.py", "--no-reload"]
+PRODUCER = [
+    "python",
+    "producer.py",
+    "-m",
+    "2",
+    "-e",
+    "1",
+    "2",
+    "3",
+    "4",
+    "5",
+    "--run",
+    "threads",
+]
+
+# plotter endpoint reporting when it's ready to receive data
+READY_URL = "http://127.0.0.1:8050/ready"
+
+
+def is_ready(url=READY_URL):
+    """Check whether the plotter is ready to receive data.
+
+    Parameters
+    ----------
+    url : str
+        Address of the plotter's readiness endpoint.
+
+    Returns
+    -------
+    ready : bool
+        True if the plotter's web server is up and its MQTT subscriptions have been
+        acknowledged.
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError, OSError):
+        # not listening yet, or responded 503
+        return False
+
+
+def wait_ready(process, url=READY_URL, timeout=60, interval=0.05):
+    """Wait until the plotter is ready to receive data.
+
+    Parameters
+    ----------
+    process : subprocess.Popen
+        Plotter process.
+    url : str
+        Address of the plotter's readiness endpoint.
+    timeout : float
+        Maximum time to wait in seconds.
+    interval : float
+        Time between polls in seconds.
+
+    Returns
+    -------
+    ready : bool
+        True if the plotter became ready, False if it exited or the timeout expired.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        if is_ready(url) is True:
+            return True
+        time.sleep(interval)
+    return False
+
+
+def start_plotter():
+    """Start the plotter and wait until it's ready to receive data.
+
+    Returns
+    -------
+    process : subprocess.Popen
+        Plotter process.
+    """
+    t0 = time.monotonic()
+    process = subprocess.Popen(PLOTTER)
+    if wait_ready(process) is True:
+        print(f"Plotter ready after {time.monotonic() - t0:.2f} s")
+    else:
+        print("Plotter didn't report ready, starting producers anyway")
+    return process
+
+
+if __name__ == "__main__":
+    # open dash plotter
+    plotter = start_plotter()
+
+    # start producers, running all experiments concurrently in one process
+    producer = subprocess.Popen(PRODUCER)
+
+    # restart children that die until keyboard interrupt
+    try:
+        while True:
+            time.sleep(1)
+            if plotter.poll() is not None:
+                print(f"Plotter exited with code {plotter.returncode}, restarting")
+                plotter = start_plotter()
+            if (producer is not None) and (producer.poll() is not None):
+                if producer.returncode == 0:
+                    # finished all experiments
+                    producer = None
+                else:
+                    print(
+                        f"Producer exited with code {producer.returncode}, restarting"
+                    )
+                    producer = subprocess.Popen(PRODUCER)
+    except KeyboardInterrupt:
+        for process in [plotter, producer]:
+            if process is not None:
+                process.terminate()
+                process.wait()
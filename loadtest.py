@@ -0,0 +1,605 @@
+#!/usr/bin/env python
+"""Load test the producer to plotter pipeline on one machine.
+
+Starts a local stand-in broker (see broker.py) unless a broker address is given, the
+plotter as a subprocess, and N synthetic producer processes publishing voltage data
+to the plotter's exp1 subtopic with the same data handlers as producer.py. Each
+producer has its own process and broker connection, as separate producers would.
+Each payload is a binary record of `rows` points stamped with the time it was made.
+
+The number of messages the plotter has ingested and their latency, from making a
+payload to storing it, are read from the plotter's metrics page, so latency
+percentiles are estimated from the buckets of its plotter_latency_seconds histogram.
+Without the plotter, a probe client subscribed to the producers' topic measures
+broker delivery instead. The plotter's CPU use and memory are sampled from /proc,
+so they are only reported on Linux.
+"""
+
+import bisect
+import json
+import math
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+import launcher
+import metrics
+import wire
+from broker import Broker
+from producer import VoltageDataHandler
+
+# directory holding the plotter
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# plotter metrics page
+METRICS_URL = "http://127.0.0.1:8050/metrics"
+
+# stream the synthetic producers publish
+STREAM = "exp1"
+
+# latency percentiles reported
+PERCENTILES = (50, 90, 99)
+
+# longest time in seconds a producer waits for its queue to drain when stopped
+DRAIN_TIMEOUT = 10
+
+_SAMPLE = re.compile(r"^(\w+)(?:\{(.*)\})? (\S+)$")
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def process_tree(pid):
+    """Get the ids of a process and all of its descendants.
+
+    Parameters
+    ----------
+    pid : int
+        Process id.
+
+    Returns
+    -------
+    pids : list of int
+        Process ids.
+    """
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command name may contain spaces, fields after it are space separated
+        ppid = int(stat[stat.rindex(")") + 2 :].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+
+    pids = [pid]
+    for p in pids:
+        pids.extend(children.get(p, []))
+    return pids
+
+
+def cpu_seconds(pids):
+    """Get the total CPU time used by processes.
+
+    Parameters
+    ----------
+    pids : list of int
+        Process ids.
+
+    Returns
+    -------
+    seconds : float
+        User and system CPU time of the processes in seconds.
+    """
+    ticks = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        ticks += int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def rss_bytes(pids):
+    """Get the total resident memory of processes.
+
+    Parameters
+    ----------
+    pids : list of int
+        Process ids.
+
+    Returns
+    -------
+    rss : int
+        Resident set size of the processes in bytes.
+    """
+    rss = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return rss
+
+
+def parse_samples(text):
+    """Parse the samples of a page in the Prometheus text format.
+
+    Parameters
+    ----------
+    text : str
+        Metrics page.
+
+    Yields
+    ------
+    name : str
+        Sample name.
+    labels : dict
+        Sample labels.
+    value : float
+        Sample value.
+    """
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        yield name, dict(_LABEL.findall(labels or "")), float(value)
+
+
+def percentiles(bounds, counts):
+    """Estimate latency percentiles from the cumulative counts of histogram buckets.
+
+    Observations are assumed to be spread evenly within a bucket. Percentiles in
+    the last, unbounded bucket are given as its lower bound.
+
+    Parameters
+    ----------
+    bounds : sequence of float
+        Increasing upper bounds of the buckets in seconds, the last one infinite.
+    counts : sequence of float
+        Cumulative number of observations in each bucket.
+
+    Returns
+    -------
+    latencies : list of float
+        Latency at each of `PERCENTILES` in ms, NaN if there were no observations.
+    """
+    total = counts[-1] if len(counts) > 0 else 0
+    if total == 0:
+        return [float("nan")] * len(PERCENTILES)
+    latencies = []
+    for q in PERCENTILES:
+        rank = total * q / 100
+        i = bisect.bisect_left(counts, rank)
+        lo = bounds[i - 1] if i > 0 else 0.0
+        below = counts[i - 1] if i > 0 else 0
+        if math.isinf(bounds[i]):
+            latency = lo
+        else:
+            latency = lo + (bounds[i] - lo) * (rank - below) / (counts[i] - below)
+        latencies.append(latency * 1000)
+    return latencies
+
+
+class PlotterMetrics:
+    """Reader of the plotter's message count and latency of the producers' stream."""
+
+    def __init__(self, url=METRICS_URL, stream=STREAM):
+        """Construct reader.
+
+        Parameters
+        ----------
+        url : str
+            Plotter metrics page.
+        stream : str
+            Stream the producers publish.
+        """
+        self.url = url
+        self.stream = stream
+
+    def read(self):
+        """Get the plotter's totals for the stream so far.
+
+        Returns
+        -------
+        received : float
+            Number of messages ingested.
+        bounds : list of float
+            Upper bounds of the latency histogram's buckets in seconds.
+        counts : list of float
+            Cumulative number of latencies in each bucket.
+        """
+        with urllib.request.urlopen(self.url, timeout=5) as response:
+            text = response.read().decode()
+        received = 0.0
+        buckets = {}
+        for name, labels, value in parse_samples(text):
+            # producer metrics exported by the plotter have a source label
+            if (labels.get("stream") != self.stream) or ("source" in labels):
+                continue
+            if name == "plotter_messages_total":
+                received += value
+            elif name == "plotter_latency_seconds_bucket":
+                bound = float(labels["le"])
+                buckets[bound] = buckets.get(bound, 0.0) + value
+        if len(buckets) == 0:
+            # nothing ingested yet, the plotter uses the default buckets
+            buckets = dict.fromkeys(metrics.DEFAULT_BUCKETS + (math.inf,), 0.0)
+        bounds = sorted(buckets)
+        return received, bounds, [buckets[bound] for bound in bounds]
+
+
+class Probe:
+    """Subscriber measuring the delivery and latency of synthetic producer messages.
+
+    It has the same `read` method as PlotterMetrics.
+    """
+
+    def __init__(self, host, port, topic, qos=2):
+        """Construct probe and subscribe to the producers' topic.
+
+        Parameters
+        ----------
+        host : str
+            MQTT broker address.
+        port : int
+            MQTT broker port.
+        topic : str
+            Topic the producers publish to.
+        qos : int
+            Quality of service level of the subscription.
+        """
+        self._lock = threading.Lock()
+        self._latency = metrics.Histogram(
+            "probe_latency_seconds",
+            "Time from making a payload to receiving it.",
+            registry=None,
+        )
+        self.received = {}
+        self.mqttc = mqtt.Client()
+        self.mqttc.on_message = self._on_message
+        self.mqttc.connect(host, port)
+        self.mqttc.subscribe(topic, qos)
+        self.mqttc.loop_start()
+
+    def _on_message(self, mqttc, obj, msg):
+        """Record the latency and sequence number of each record in a message."""
+        now = time.time()
+        for record in wire.iter_records(msg.payload):
+            self._latency.observe(now - record.timestamp)
+            with self._lock:
+                self.received.setdefault(record.idn, set()).add(record.seq)
+
+    def read(self):
+        """Get the totals so far, see `PlotterMetrics.read`."""
+        with self._lock:
+            received = sum(len(seqs) for seqs in self.received.values())
+        counts = self._latency.labels().get()[0]
+        return received, list(self._latency.buckets) + [math.inf], counts
+
+    def stop(self):
+        """Disconnect from the broker."""
+        self.mqttc.loop_stop()
+        self.mqttc.disconnect()
+
+
+def produce(host, port, topic, idn, rate, rows, qos, started, stop, sent, dropped, kw):
+    """Publish payloads of timestamped data at a fixed rate until stopped.
+
+    Run in a producer process.
+
+    Parameters
+    ----------
+    host : str
+        MQTT broker address.
+    port : int
+        MQTT broker port.
+    topic : str
+        Topic to publish to.
+    idn : str
+        Device id of the producer.
+    rate : float
+        Payloads per second.
+    rows : int
+        Data points per payload.
+    qos : int
+        Quality of service level.
+    started : multiprocessing.Barrier
+        Waited on once connected, so all producers start publishing together.
+    stop : multiprocessing.Event
+        Set to stop publishing.
+    sent : multiprocessing.Value
+        Number of payloads made, updated while publishing.
+    dropped : multiprocessing.Value
+        Set to the number of payloads dropped by the queue policy when finished.
+    kw : dict
+        Keyword arguments passed to the data handler.
+    """
+    handler = VoltageDataHandler(idn=idn, wire_format="binary", qos=qos, **kw)
+    handler.connect(host, port)
+    handler.start_q(topic)
+    started.wait()
+    data = np.empty((rows, 2))
+    start = time.monotonic()
+    n = 0
+    while stop.is_set() is not True:
+        data[:, 0] = time.time()
+        data[:, 1] = np.random.rand(rows)
+        handler.append_payload(handler.encode_data(data))
+        n += 1
+        sent.value = n
+        delay = start + n / rate - time.monotonic()
+        if delay > 0:
+            stop.wait(delay)
+    handler.end_q(timeout=DRAIN_TIMEOUT)
+    dropped.value = handler.dropped
+    handler.disconnect()
+
+
+def run(
+    host=None,
+    port=1883,
+    topic="loadtest",
+    producers=1,
+    rate=10,
+    rows=1,
+    qos=2,
+    duration=60,
+    interval=5,
+    plotter=True,
+    **kwargs,
+):
+    """Run a load test and print statistics while it runs.
+
+    Parameters
+    ----------
+    host : str or None
+        MQTT broker address. If None, start a local stand-in broker.
+    port : int
+        MQTT broker port. Ignored for a local broker, which uses a free port.
+    topic : str
+        Base topic of the plotter.
+    producers : int
+        Number of synthetic producer processes.
+    rate : float
+        Payloads per second sent by each producer.
+    rows : int
+        Data points per payload.
+    qos : int
+        Quality of service level of published messages and subscriptions.
+    duration : float
+        Time in seconds to publish for.
+    interval : float
+        Time in seconds between statistics reports.
+    plotter : bool
+        Run the plotter as a subprocess and measure what it ingests. If False,
+        measure delivery to a probe subscriber.
+    **kwargs
+        Keyword arguments passed to the data handlers, e.g. queue bounds.
+
+    Returns
+    -------
+    summary : dict
+        Statistics of the whole run.
+    """
+    broker = None
+    if host is None:
+        broker = Broker("127.0.0.1", 0)
+        broker.start_thread()
+        host, port = broker.host, broker.port
+    print(f"Broker: mqtt://{host}:{port}")
+
+    data_topic = f"{topic}/{STREAM}"
+    plotter_process = None
+    if plotter is True:
+        plotter_process = subprocess.Popen(
+            [sys.executable, "plotter.py", "--host", host, "--port", str(port)]
+            # a single process, so only one subscriber is measured
+            + ["-t", topic, "--no-reload"],
+            cwd=HERE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if launcher.wait_ready(plotter_process) is not True:
+            plotter_process.kill()
+            raise RuntimeError("Plotter didn't become ready.")
+        source = PlotterMetrics()
+    else:
+        source = Probe(host, port, data_topic, qos)
+
+    # spawned, as this process runs the broker's thread
+    context = multiprocessing.get_context("spawn")
+    started = context.Barrier(producers + 1)
+    stop = context.Event()
+    sent = [context.Value("q", 0) for _ in range(producers)]
+    dropped = [context.Value("q", 0) for _ in range(producers)]
+    processes = [
+        context.Process(
+            target=produce,
+            args=(host, port, data_topic, f"load{i}", rate, rows, qos, started, stop)
+            + (sent[i], dropped[i], kwargs),
+            daemon=True,
+        )
+        for i in range(producers)
+    ]
+    for process in processes:
+        process.start()
+
+    print(
+        f"{'time (s)':>9}{'sent/s':>10}{'recv/s':>10}"
+        + "".join(f"{f'p{q} (ms)':>10}" for q in PERCENTILES)
+        + f"{'cpu (%)':>9}{'rss (MB)':>10}"
+    )
+    samples = []
+    received, bounds, counts = base = source.read()
+    started.wait(timeout=60)
+    start = time.monotonic()
+    last = {"time": start, "sent": 0, "received": received, "counts": counts}
+    last["cpu"] = 0.0
+    if plotter_process is not None:
+        last["cpu"] = cpu_seconds(process_tree(plotter_process.pid))
+    while time.monotonic() - start < duration:
+        time.sleep(min(interval, max(duration - (time.monotonic() - start), 0)))
+        now = time.monotonic()
+        total = sum(value.value for value in sent)
+        received, bounds, counts = source.read()
+        sample = {
+            "time": now - start,
+            "sent_rate": (total - last["sent"]) / (now - last["time"]),
+            "received_rate": (received - last["received"]) / (now - last["time"]),
+            "latency": percentiles(bounds, np.subtract(counts, last["counts"])),
+            "cpu": float("nan"),
+            "rss": float("nan"),
+        }
+        if plotter_process is not None:
+            pids = process_tree(plotter_process.pid)
+            cpu = cpu_seconds(pids)
+            sample["cpu"] = 100 * (cpu - last["cpu"]) / (now - last["time"])
+            sample["rss"] = rss_bytes(pids) / 1e6
+            last["cpu"] = cpu
+        samples.append(sample)
+        last.update(
+            {"time": now, "sent": total, "received": received, "counts": counts}
+        )
+        print(
+            f"{sample['time']:>9.1f}{sample['sent_rate']:>10.1f}"
+            + f"{sample['received_rate']:>10.1f}"
+            + "".join(f"{x:>10.1f}" for x in sample["latency"])
+            + f"{sample['cpu']:>9.1f}{sample['rss']:>10.1f}"
+        )
+
+    # stop publishing and wait for messages still on their way
+    stop.set()
+    for process in processes:
+        process.join()
+    total = sum(value.value for value in sent)
+    total_dropped = sum(value.value for value in dropped)
+    deadline = time.monotonic() + interval
+    while True:
+        received, bounds, counts = source.read()
+        if (received - base[0] >= total - total_dropped) or (
+            time.monotonic() > deadline
+        ):
+            break
+        time.sleep(0.1)
+    if plotter is not True:
+        source.stop()
+
+    received -= base[0]
+    summary = {
+        "producers": producers,
+        "rate": rate,
+        "rows": rows,
+        "qos": qos,
+        "duration": duration,
+        "sent": total,
+        "received": received,
+        "lost": total - received,
+        "dropped": total_dropped,
+        "percentiles": list(PERCENTILES),
+        "latency": percentiles(bounds, np.subtract(counts, base[2])),
+        "samples": samples,
+    }
+    if plotter_process is not None:
+        summary["max_rss"] = max([s["rss"] for s in samples], default=float("nan"))
+        plotter_process.terminate()
+        plotter_process.wait()
+    if broker is not None:
+        broker.stop_thread()
+
+    print(
+        f"sent {total}, received {received:.0f}, lost {summary['lost']:.0f}"
+        + f" ({summary['dropped']} dropped by queue policies), latency"
+        + f" p{'/p'.join(str(q) for q in PERCENTILES)} "
+        + "/".join(f"{x:.1f}" for x in summary["latency"])
+        + " ms"
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=None,
+        help="MQTT broker address. Defaults to a local stand-in broker.",
+    )
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port.")
+    parser.add_argument(
+        "-t", metavar="t", type=str, default="loadtest", help="Plotter topic."
+    )
+    parser.add_argument(
+        "-N", metavar="N", type=int, default=1, help="Number of producer processes."
+    )
+    parser.add_argument(
+        "--rate", type=float, default=10, help="Payloads per second per producer."
+    )
+    parser.add_argument("--rows", type=int, default=1, help="Data points per payload.")
+    parser.add_argument(
+        "--qos", type=int, default=2, choices=[0, 1, 2], help="MQTT QoS level."
+    )
+    parser.add_argument(
+        "--duration", type=float, default=60, help="Time (s) to publish for."
+    )
+    parser.add_argument(
+        "--interval", type=float, default=5, help="Time (s) between reports."
+    )
+    parser.add_argument(
+        "--no-plotter",
+        action="store_true",
+        help="Don't run the plotter, only measure broker delivery to the probe.",
+    )
+    parser.add_argument(
+        "--maxsize",
+        type=int,
+        default=None,
+        help="Maximum queued payloads per producer.",
+    )
+    parser.add_argument(
+        "--policy",
+        type=str,
+        default="block",
+        choices=["block", "drop_oldest", "drop_newest", "conflate"],
+        help="What to do when a producer's queue is full.",
+    )
+    parser.add_argument(
+        "-o", metavar="o", type=str, default=None, help="Save summary to a JSON file."
+    )
+    args = parser.parse_args()
+
+    summary = run(
+        args.host,
+        args.port,
+        args.t,
+        args.N,
+        args.rate,
+        args.rows,
+        args.qos,
+        args.duration,
+        args.interval,
+        not args.no_plotter,
+        maxsize=args.maxsize,
+        policy=args.policy,
+    )
+
+    if args.o is not None:
+        with open(args.o, "w") as f:
+            json.dump(summary, f, indent=2)
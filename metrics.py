@@ -0,0 +1,398 @@
+"""Counters, gauges, and histograms exported in the Prometheus text format.
+
+Metrics are registered in a Registry, REGISTRY by default, when they are created at
+module level. Each metric may have labels, in which case values are recorded on the
+child returned by `labels`:
+
+    INGEST_SECONDS = Histogram("ingest_seconds", "Time to ingest.", ["stream"])
+    INGEST_SECONDS.labels("exp1").observe(0.001)
+
+Values can be updated from any thread. `Registry.collect` returns plain data that can
+be sent to another process as JSON and rendered there with `render`, so one process
+can export the metrics of others.
+"""
+
+import abc
+import bisect
+import math
+import threading
+import time
+
+# histogram bucket upper bounds in seconds, suited to latencies from 10 us to 10 s
+DEFAULT_BUCKETS = (
+    1e-5,
+    2.5e-5,
+    5e-5,
+    1e-4,
+    2.5e-4,
+    5e-4,
+    1e-3,
+    2.5e-3,
+    5e-3,
+    1e-2,
+    2.5e-2,
+    5e-2,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Registry:
+    """Collection of metrics exported together."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric to the registry."""
+        with self._lock:
+            self._metrics.append(metric)
+
+    def collect(self):
+        """Get the current values of all metrics.
+
+        Returns
+        -------
+        families : list of dict
+            Metric "name", "type", "help", and "samples". Each sample is a list of
+            the sample's name, a dict of its labels, and its value.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return [metric.collect() for metric in metrics]
+
+
+REGISTRY = Registry()
+
+
+class _Value:
+    """Value of a counter or gauge."""
+
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Increase the value."""
+        with self._lock:
+            self._value += amount
+
+    def set_function(self, function):
+        """Get the value by calling a function without arguments when collected."""
+        self._function = function
+
+    def get(self):
+        """Get the value."""
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+
+class _GaugeValue(_Value):
+    """Value of a gauge."""
+
+    def dec(self, amount=1):
+        """Decrease the value."""
+        self.inc(-amount)
+
+    def set(self, value):
+        """Set the value."""
+        with self._lock:
+            self._value = float(value)
+
+
+class _HistogramValue:
+    """Distribution of observations."""
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record an observation."""
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def time(self):
+        """Get a context manager that observes the time spent in it in seconds."""
+        return _Timer(self)
+
+    def get(self):
+        """Get the cumulative bucket counts, the sum, and the count."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        n = 0
+        for count in counts:
+            n += count
+            cumulative.append(n)
+        return cumulative, total, n
+
+
+class _Timer:
+    """Context manager observing the time spent in it."""
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class _Metric(abc.ABC):
+    """Metric with a value for each combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        """Construct metric and add it to a registry.
+
+        Parameters
+        ----------
+        name : str
+            Metric name.
+        documentation : str
+            Description of the metric.
+        labelnames : sequence of str
+            Names of the metric's labels.
+        registry : Registry or None
+            Registry to add the metric to. If None, the metric isn't registered.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Get the value for a combination of label values.
+
+        Parameters
+        ----------
+        *values : str
+            Label values in the order of `labelnames`.
+
+        Returns
+        -------
+        child : obj
+            Counter, gauge, or histogram value.
+        """
+        # fast path for label values that are already strings
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"Expected label values for {self.labelnames}.")
+            values = tuple(str(value) for value in values)
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values):
+        """Forget the value for a combination of label values."""
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in values), None)
+
+    def collect(self):
+        """Get the metric's current values. See `Registry.collect`."""
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for values, child in children:
+            samples.extend(self._samples(dict(zip(self.labelnames, values)), child))
+        return {
+            "name": self.name,
+            "type": self.kind,
+            "help": self.documentation,
+            "samples": samples,
+        }
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """Make the value for a new combination of label values."""
+
+    def _samples(self, labels, child):
+        return [[self.name, labels, child.get()]]
+
+
+class Counter(_Metric):
+    """Value that only increases, such as a number of messages."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        """Increase the value of a metric without labels."""
+        self.labels().inc(amount)
+
+    def _samples(self, labels, child):
+        return [[f"{self.name}_total", labels, child.get()]]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, such as a queue length."""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        """Set the value of a metric without labels."""
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    """Distribution of observations, such as latencies, in buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        registry=REGISTRY,
+        buckets=DEFAULT_BUCKETS,
+    ):
+        """Construct histogram and add it to a registry.
+
+        Parameters
+        ----------
+        name : str
+            Metric name.
+        documentation : str
+            Description of the metric.
+        labelnames : sequence of str
+            Names of the metric's labels.
+        registry : Registry or None
+            Registry to add the metric to. If None, the metric isn't registered.
+        buckets : sequence of float
+            Increasing upper bounds of the buckets. A +Inf bucket is added.
+        """
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        """Record an observation of a metric without labels."""
+        self.labels().observe(value)
+
+    def time(self):
+        """Time a block of code for a metric without labels."""
+        return self.labels().time()
+
+    def _samples(self, labels, child):
+        cumulative, total, count = child.get()
+        samples = []
+        for bound, n in zip(self.buckets + (math.inf,), cumulative):
+            samples.append([f"{self.name}_bucket", dict(labels, le=bound), n])
+        samples.append([f"{self.name}_sum", labels, total])
+        samples.append([f"{self.name}_count", labels, count])
+        return samples
+
+
+def _format_value(value):
+    """Format a sample value or bucket bound."""
+    if value == math.inf:
+        return "+Inf"
+    elif value == -math.inf:
+        return "-Inf"
+    elif value != value:
+        return "NaN"
+    elif float(value).is_integer():
+        return str(int(value))
+    else:
+        return repr(float(value))
+
+
+def _format_labels(labels):
+    """Format sample labels."""
+    if len(labels) == 0:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        if not isinstance(value, str):
+            value = _format_value(value)
+        value = value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def add_labels(families, **labels):
+    """Add labels to every sample of collected metrics.
+
+    Parameters
+    ----------
+    families : list of dict
+        Metrics returned by `Registry.collect`.
+    **labels
+        Labels to add.
+
+    Returns
+    -------
+    families : list of dict
+        Metrics with the labels added.
+    """
+    return [
+        dict(
+            family,
+            samples=[
+                [name, dict(sample_labels, **labels), value]
+                for name, sample_labels, value in family["samples"]
+            ],
+        )
+        for family in families
+    ]
+
+
+def render(families):
+    """Render collected metrics in the Prometheus text exposition format.
+
+    Families with the same name, e.g. collected from several processes, are merged.
+
+    Parameters
+    ----------
+    families : list of dict
+        Metrics returned by `Registry.collect`.
+
+    Returns
+    -------
+    text : str
+        Metrics in the text exposition format.
+    """
+    merged = {}
+    for family in families:
+        if family["name"] in merged:
+            merged[family["name"]]["samples"].extend(family["samples"])
+        else:
+            merged[family["name"]] = dict(family, samples=list(family["samples"]))
+
+    lines = []
+    for family in merged.values():
+        lines.append(f"# HELP {family['name']} {family['help']}")
+        lines.append(f"# TYPE {family['name']} {family['type']}")
+        for name, labels, value in family["samples"]:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
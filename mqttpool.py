@@ -0,0 +1,190 @@
+"""MQTT connections shared by every publisher in a process.
+
+Opening a connection per publisher means connection setup and keepalive traffic
+grow with the number of streams. Instead, publishers acquire a connection to their
+broker from a pool, which opens one connection and network loop per broker and
+multiplexes all topics over it. The connection is closed when the last publisher
+using it releases it.
+"""
+
+import threading
+
+import paho.mqtt.client as mqtt
+
+
+class MQTTConnection:
+    """MQTT client connection and network thread shared by publishers.
+
+    Message IDs are unique per client, so the on_publish callback is reserved for
+    this class and dispatches each acknowledgement to the publisher of the message.
+    """
+
+    def __init__(self, host, port=1883):
+        """Construct connection.
+
+        Parameters
+        ----------
+        host : str
+            MQTT broker address.
+        port : int
+            MQTT broker port.
+        """
+        self.host = host
+        self.port = port
+        self.client = mqtt.Client()
+        # each publisher bounds its own in-flight window
+        self.client.max_inflight_messages_set(0)
+        self.client.on_publish = self._on_publish
+        self._lock = threading.Lock()
+        self._pending = {}
+        # acknowledgements received while publish() calls were still in progress
+        self._publishing = 0
+        self._published_early = set()
+
+    def open(self):
+        """Connect to the broker and start the network thread."""
+        self.client.connect(self.host, self.port)
+        self.client.loop_start()
+
+    def close(self):
+        """Disconnect from the broker and stop the network thread."""
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def publish(self, topic, payload, qos, callback):
+        """Publish a message without waiting for completion.
+
+        Parameters
+        ----------
+        topic : str
+            MQTT topic to publish to.
+        payload : str or bytes
+            Message payload.
+        qos : int
+            Quality of service level.
+        callback : callable
+            Called with no arguments when publication of the message has completed.
+            It may be called from the network thread or before this method returns.
+        """
+        with self._lock:
+            self._publishing += 1
+        try:
+            info = self.client.publish(topic, payload, qos=qos)
+        except Exception:
+            with self._lock:
+                self._end_publish()
+            raise
+        with self._lock:
+            if info.mid in self._published_early:
+                # on_publish ran before publish() returned
+                self._published_early.discard(info.mid)
+                complete = True
+            elif (qos == 0) and (info.rc != mqtt.MQTT_ERR_SUCCESS):
+                # QoS 0 messages that couldn't be sent are never acknowledged
+                complete = True
+            else:
+                self._pending[info.mid] = callback
+                complete = False
+            self._end_publish()
+        if complete is True:
+            callback()
+
+    def _on_publish(self, client, userdata, mid):
+        """Notify the publisher of a message that it has been published.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            Client that published the message.
+        userdata : obj
+            User data of the client.
+        mid : int
+            Message ID.
+        """
+        with self._lock:
+            callback = self._pending.pop(mid, None)
+            if callback is None:
+                if self._publishing > 0:
+                    # it may belong to a publish() that hasn't returned yet
+                    self._published_early.add(mid)
+                return
+        callback()
+
+    def _end_publish(self):
+        """Note that a publish() call has registered its message.
+
+        Acknowledgements not claimed once no publish() is in progress weren't for
+        messages published through this connection, so they are forgotten, and their
+        message IDs can't complete later messages when the IDs wrap around.
+
+        Must be called with the lock held.
+        """
+        self._publishing -= 1
+        if self._publishing == 0:
+            self._published_early.clear()
+
+
+class ConnectionPool:
+    """Reference counted connections, one per broker."""
+
+    def __init__(self, factory):
+        """Construct pool.
+
+        Parameters
+        ----------
+        factory : callable
+            Called with the broker host and port to create a connection. The
+            connection must have `open` and `close` methods.
+        """
+        self.factory = factory
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Get number of open connections."""
+        return len(self._connections)
+
+    def acquire(self, host, port=1883):
+        """Get a connection to a broker, opening it if necessary.
+
+        Parameters
+        ----------
+        host : str
+            MQTT broker address.
+        port : int
+            MQTT broker port.
+
+        Returns
+        -------
+        connection : obj
+            Open connection. Give it back with `release` when finished.
+        """
+        with self._lock:
+            entry = self._connections.get((host, port))
+            if entry is None:
+                connection = self.factory(host, port)
+                connection.open()
+                entry = self._connections[(host, port)] = [connection, 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, connection):
+        """Give back a connection, closing it if nothing else is using it.
+
+        Parameters
+        ----------
+        connection : obj
+            Connection returned by `acquire`.
+        """
+        with self._lock:
+            key = (connection.host, connection.port)
+            entry = self._connections[key]
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._connections[key]
+        connection.close()
+
+
+# connections used by MQTTQueuePublisher
+pool = ConnectionPool(MQTTConnection)
@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 """Plot data obtained from MQTT broker using Dash."""
 
-import collections
+import argparse
+import copy
 import json
+import os
+import threading
 import time
+import warnings
 
 import dash
 import dash_core_components as dcc
@@ -11,15 +15,242 @@ import dash_daq as daq
 import dash_html_components as html
 import numpy as np
 import paho.mqtt.client as mqtt
-import plotly
-import plotly.graph_objs as go
-from plotly.subplots import make_subplots
-
-MQTTHOST = "mqtt.greyltc.com"
+from flask import request
+
+import metrics
+import sampler
+import wire
+from decimate import decimate
+from figures import load_templates
+from recorder import Recorder
+from series import KeyedSeriesStore
+from sharedstore import new_prefix, shared_factory
+
+MQTTHOST = os.environ.get("MQTTHOST", "mqtt.greyltc.com")
+MQTTPORT = int(os.environ.get("MQTTPORT", 1883))
 DASHHOST = "127.0.0.1"
 
+# decimation applied to each trace before it's sent to the browser
+DECIMATE_METHOD = "lttb"
+DECIMATE_POINTS = 2000
+
+# time in seconds after which metrics from a producer that stopped are forgotten
+METRICS_EXPIRY = 60
+
+# memory for stored data in bytes, beyond which inactive devices are forgotten
+MEMORY_BUDGET = 512 * 1024 ** 2
+
+# device selector value showing the device that most recently sent data
+LATEST_DEVICE = "*"
+
+# ingest process serving the data to this web worker, see serve.py, or None if the
+# plotter ingests data itself
+INGEST = None
+
+# name of this web worker, labelling its metrics, or None if there's a single process
+WORKER = None
+
+# records every ingested row to disk if not None
+RECORDER = None
+
+# name prefix of the shared memory segments holding the stores, see sharedstore.py,
+# or None if the stores are in private memory
+SHARED_PREFIX = None
+
+# enable the /profile route, and the longest time in seconds a profile can run for
+PROFILING = False
+MAX_PROFILE_SECONDS = 60
+
+MESSAGES = metrics.Counter("plotter_messages", "MQTT messages received.", ["stream"])
+POINTS = metrics.Counter("plotter_points", "Data points stored.", ["stream"])
+DROPPED = metrics.Counter(
+    "plotter_messages_dropped",
+    "MQTT messages that couldn't be decoded or stored.",
+    ["subtopic"],
+)
+SEQUENCE_GAPS = metrics.Counter(
+    "plotter_sequence_gaps",
+    "Messages missing from the sequence sent by a device.",
+    ["stream"],
+)
+INGEST_SECONDS = metrics.Histogram(
+    "plotter_ingest_seconds", "Time to decode and store a message.", ["stream"]
+)
+LATENCY_SECONDS = metrics.Histogram(
+    "plotter_latency_seconds",
+    "Time from acquiring data in the producer to storing it in the plotter.",
+    ["stream"],
+)
+FORMAT_SECONDS = metrics.Histogram(
+    "plotter_format_figure_seconds", "Time to format a complete figure.", ["graph"]
+)
+UPDATE_SECONDS = metrics.Histogram(
+    "plotter_update_seconds",
+    "Time to run a graph's live update callback when data has changed.",
+    ["graph"],
+)
+
+
+def column_bounds(data):
+    """Get the minimum and maximum of each data column.
+
+    A single vectorised reduction is used for all columns. NaNs are ignored.
+
+    Parameters
+    ----------
+    data : array
+        Array of data.
+
+    Returns
+    -------
+    lo : array
+        Minimum of each column.
+    hi : array
+        Maximum of each column.
+    """
+    return np.fmin.reduce(data, axis=0), np.fmax.reduce(data, axis=0)
+
+
+def axis_ranges_1(lo, hi):
+    """Get axis ranges for figure type 1.
+
+    Parameters
+    ----------
+    lo : array
+        Minimum of each data column.
+    hi : array
+        Maximum of each data column.
+
+    Returns
+    -------
+    ranges : dict
+        Range of each axis, keyed by layout axis name.
+    """
+    return {
+        "xaxis": [float(lo[0]), float(hi[0])],
+        "yaxis": [float(lo[1]), float(hi[1])],
+    }
+
+
+def axis_ranges_2(lo, hi):
+    """Get axis ranges for figure type 2.
+
+    Parameters
+    ----------
+    lo : array
+        Minimum of each data column.
+    hi : array
+        Maximum of each data column.
+
+    Returns
+    -------
+    ranges : dict
+        Range of each axis, keyed by layout axis name.
+    """
+    return {
+        "xaxis": [float(min(lo[0], lo[2])), float(max(hi[0], hi[2]))],
+        "yaxis": [float(min(lo[1], lo[3])), float(max(hi[1], hi[3]))],
+    }
+
+
+def axis_ranges_3(lo, hi):
+    """Get axis ranges for figure type 3.
+
+    Parameters
+    ----------
+    lo : array
+        Minimum of each data column.
+    hi : array
+        Maximum of each data column.
+
+    Returns
+    -------
+    ranges : dict
+        Range of each axis, keyed by layout axis name.
+    """
+    return {
+        "xaxis": [float(lo[0]), float(hi[0])],
+        "yaxis": [float(min(lo[1], lo[2])), float(max(hi[1], hi[2]))],
+        "yaxis2": [float(lo[3]), float(hi[3])],
+    }
+
+
+def axis_ranges_4(lo, hi):
+    """Get axis ranges for figure type 4.
+
+    Parameters
+    ----------
+    lo : array
+        Minimum of each data column.
+    hi : array
+        Maximum of each data column.
+
+    Returns
+    -------
+    ranges : dict
+        Range of each axis, keyed by layout axis name.
+    """
+    return axis_ranges_1(lo, hi)
+
+
+def axis_ranges_5(lo, hi):
+    """Get axis ranges for figure type 5.
+
+    Parameters
+    ----------
+    lo : array
+        Minimum of each data column.
+    hi : array
+        Maximum of each data column.
 
-def format_figure_1(data, fig, title="-"):
+    Returns
+    -------
+    ranges : dict
+        Range of each axis, keyed by layout axis name.
+    """
+    return {
+        "xaxis": [float(lo[0]), float(hi[0])],
+        "yaxis": [float(lo[1]), float(hi[1])],
+        "yaxis2": [float(lo[2]), float(hi[2])],
+    }
+
+
+def layout_patch(ranges, title="-"):
+    """Build a Plotly relayout update for new axis ranges and title.
+
+    Parameters
+    ----------
+    ranges : dict
+        Range of each axis, keyed by layout axis name.
+    title : str
+        Title of plot.
+
+    Returns
+    -------
+    patch : dict
+        Update for Plotly.relayout.
+    """
+    patch = {f"{axis}.range": axis_range for axis, axis_range in ranges.items()}
+    patch["annotations[0].text"] = title
+    return patch
+
+
+def set_trace(trace, x, y):
+    """Set the data of a figure trace, decimating it if necessary.
+
+    Parameters
+    ----------
+    trace : dict
+        Dictionary representation of a Plotly trace.
+    x : array
+        x values.
+    y : array
+        y values.
+    """
+    trace["x"], trace["y"] = decimate(x, y, DECIMATE_POINTS, DECIMATE_METHOD)
+
+
+def format_figure_1(data, fig, title="-", bounds=None):
     """Format figure type 1.
 
     Parameters
@@ -30,6 +261,9 @@ def format_figure_1(data, fig, title="-"):
         Dictionary representation of Plotly figure.
     title : str
         Title of plot.
+    bounds : tuple of array or None
+        Minimum and maximum of each data column. If None, they are calculated from
+        `data`.
 
     Returns
     -------
@@ -41,12 +275,13 @@ def format_figure_1(data, fig, title="-"):
         return fig
     else:
         # add data to fig
-        fig["data"][0]["x"] = data[:, 0]
-        fig["data"][0]["y"] = data[:, 1]
+        set_trace(fig["data"][0], data[:, 0], data[:, 1])
 
         # update ranges
-        fig["layout"]["xaxis"]["range"] = [min(data[:, 0]), max(data[:, 0])]
-        fig["layout"]["yaxis"]["range"] = [min(data[:, 1]), max(data[:, 1])]
+        if bounds is None:
+            bounds = column_bounds(data)
+        for axis, axis_range in axis_ranges_1(*bounds).items():
+            fig["layout"][axis]["range"] = axis_range
 
         # update title
         fig["layout"]["annotations"][0]["text"] = title
@@ -54,44 +289,39 @@ def format_figure_1(data, fig, title="-"):
         return fig
 
 
-def format_figure_2(data, fig, title="-"):
+def format_figure_2(data, fig, title="-", bounds=None):
     """Format figure type 2.
 
     Parameters
     ----------
     data : array
         Array of data.
-    fig : plotly.graph_objs.Figure
-        Plotly figure.
+    fig : dict
+        Dictionary representation of Plotly figure.
     title : str
         Title of plot.
+    bounds : tuple of array or None
+        Minimum and maximum of each data column. If None, they are calculated from
+        `data`.
 
     Returns
     -------
-    fig : plotly.graph_objs.Figure
-        Updated plotly figure.
+    fig : dict
+        Dictionary representation of Plotly figure.
     """
     if len(data) == 0:
         # if request to clear has been issued, return cleared figure
         return fig
     else:
         # add data to fig
-        fig["data"][0]["x"] = data[:, 0]
-        fig["data"][0]["y"] = data[:, 1]
-        fig["data"][1]["x"] = data[:, 2]
-        fig["data"][1]["y"] = data[:, 3]
+        set_trace(fig["data"][0], data[:, 0], data[:, 1])
+        set_trace(fig["data"][1], data[:, 2], data[:, 3])
 
         # update ranges
-        xrange = [
-            min(np.append(data[:, 0], data[:, 2])),
-            max(np.append(data[:, 0], data[:, 2])),
-        ]
-        yrange = [
-            min(np.append(data[:, 1], data[:, 3])),
-            max(np.append(data[:, 1], data[:, 3])),
-        ]
-        fig["layout"]["xaxis"]["range"] = xrange
-        fig["layout"]["yaxis"]["range"] = yrange
+        if bounds is None:
+            bounds = column_bounds(data)
+        for axis, axis_range in axis_ranges_2(*bounds).items():
+            fig["layout"][axis]["range"] = axis_range
 
         # update title
         fig["layout"]["annotations"][0]["text"] = title
@@ -99,45 +329,40 @@ def format_figure_2(data, fig, title="-"):
         return fig
 
 
-def format_figure_3(data, fig, title="-"):
+def format_figure_3(data, fig, title="-", bounds=None):
     """Format figure type 3.
 
     Parameters
     ----------
     data : array
         Array of data.
-    fig : plotly.graph_objs.Figure
-        Plotly figure.
+    fig : dict
+        Dictionary representation of Plotly figure.
     title : str
         Title of plot.
+    bounds : tuple of array or None
+        Minimum and maximum of each data column. If None, they are calculated from
+        `data`.
 
     Returns
     -------
-    fig : plotly.graph_objs.Figure
-        Updated plotly figure.
+    fig : dict
+        Dictionary representation of Plotly figure.
     """
     if len(data) == 0:
         # if request to clear has been issued, return cleared figure
         return fig
     else:
         # add data to fig
-        fig["data"][0]["x"] = data[:, 0]
-        fig["data"][0]["y"] = data[:, 1]
-        fig["data"][1]["x"] = data[:, 0]
-        fig["data"][1]["y"] = data[:, 2]
-        fig["data"][2]["x"] = data[:, 0]
-        fig["data"][2]["y"] = data[:, 3]
+        set_trace(fig["data"][0], data[:, 0], data[:, 1])
+        set_trace(fig["data"][1], data[:, 0], data[:, 2])
+        set_trace(fig["data"][2], data[:, 0], data[:, 3])
 
         # update ranges
-        xrange = [min(data[:, 0]), max(data[:, 0])]
-        yrange = [
-            min(np.append(data[:, 1], data[:, 2])),
-            max(np.append(data[:, 1], data[:, 2])),
-        ]
-        yrange2 = [min(data[:, 3]), max(data[:, 3])]
-        fig["layout"]["xaxis"]["range"] = xrange
-        fig["layout"]["yaxis"]["range"] = yrange
-        fig["layout"]["yaxis2"]["range"] = yrange2
+        if bounds is None:
+            bounds = column_bounds(data)
+        for axis, axis_range in axis_ranges_3(*bounds).items():
+            fig["layout"][axis]["range"] = axis_range
 
         # update title
         fig["layout"]["annotations"][0]["text"] = title
@@ -145,60 +370,62 @@ def format_figure_3(data, fig, title="-"):
         return fig
 
 
-def format_figure_4(data, fig, title="-"):
+def format_figure_4(data, fig, title="-", bounds=None):
     """Format figure type 4.
 
     Parameters
     ----------
     data : array
         Array of data.
-    fig : plotly.graph_objs.Figure
-        Plotly figure.
+    fig : dict
+        Dictionary representation of Plotly figure.
     title : str
         Title of plot.
+    bounds : tuple of array or None
+        Minimum and maximum of each data column. If None, they are calculated from
+        `data`.
 
     Returns
     -------
-    fig : plotly.graph_objs.Figure
-        Updated plotly figure.
+    fig : dict
+        Dictionary representation of Plotly figure.
     """
-    return format_figure_1(data, fig, title)
+    return format_figure_1(data, fig, title, bounds)
 
 
-def format_figure_5(data, fig, title="-"):
+def format_figure_5(data, fig, title="-", bounds=None):
     """Format figure type 5.
 
     Parameters
     ----------
     data : array
         Array of data.
-    fig : plotly.graph_objs.Figure
-        Plotly figure.
+    fig : dict
+        Dictionary representation of Plotly figure.
     title : str
         Title of plot.
+    bounds : tuple of array or None
+        Minimum and maximum of each data column. If None, they are calculated from
+        `data`.
 
     Returns
     -------
-    fig : plotly.graph_objs.Figure
-        Updated plotly figure.
+    fig : dict
+        Dictionary representation of Plotly figure.
     """
     if len(data) == 0:
         # if request to clear has been issued, return cleared figure
         return fig
     else:
         # add data to fig
-        fig["data"][0]["x"] = data[:, 0]
-        fig["data"][0]["y"] = data[:, 1]
-        fig["data"][1]["x"] = data[:, 0]
-        fig["data"][1]["y"] = data[:, 2]
+        set_trace(fig["data"][0], data[:, 0], data[:, 1])
+        set_trace(fig["data"][1], data[:, 0], data[:, 2])
 
         # update ranges
-        xrange = [min(data[:, 0]), max(data[:, 0])]
-        yrange = [min(data[:, 1]), max(data[:, 1])]
-        yrange2 = [min(data[:, 2]), max(data[:, 2])]
-        fig["layout"]["xaxis"]["range"] = xrange
-        fig["layout"]["yaxis"]["range"] = yrange
-        fig["layout"]["yaxis2"]["range"] = yrange2
+        if bounds is None:
+            bounds = column_bounds(data)
+        for axis, axis_range in axis_ranges_5(*bounds).items():
+            fig["layout"][axis]["range"] = axis_range
 
         # update title
         fig["layout"]["annotations"][0]["text"] = title
@@ -206,172 +433,55 @@ def format_figure_5(data, fig, title="-"):
         return fig
 
 
-# create thread-safe containers for storing latest data and plot info
-graph1_latest = collections.deque(maxlen=1)
-graph2_latest = collections.deque(maxlen=1)
-graph3_latest = collections.deque(maxlen=1)
-graph4_latest = collections.deque(maxlen=1)
-graph5_latest = collections.deque(maxlen=1)
-
-# initialise plot info/data queues
-graph1_latest.append({"msg": {"clear": True, "id": "-"}, "data": np.empty((0, 2))})
-graph2_latest.append({"msg": {"clear": True, "id": "-"}, "data": np.empty((0, 4))})
-graph3_latest.append({"msg": {"clear": True, "id": "-"}, "data": np.empty((0, 4))})
-graph4_latest.append({"msg": {"clear": True, "id": "-"}, "data": np.empty((0, 2))})
-graph5_latest.append({"msg": {"clear": True, "id": "-"}, "data": np.empty((0, 3))})
-
-# initial figure properties
-fig1 = make_subplots(subplot_titles=["-"])
-fig1.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="v"))
-fig1.update_xaxes(
-    title="time (s)",
-    ticks="inside",
-    mirror="ticks",
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
-)
-fig1.update_yaxes(
-    title="voltage (V)",
-    ticks="inside",
-    mirror="ticks",
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
+# create thread-safe stores for the data of each device on each stream
+STORES = KeyedSeriesStore(
+    {"exp1": 2, "exp2": 4, "exp3": 4, "exp4": 2, "exp5": 3}, MEMORY_BUDGET
 )
-fig1.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
-
-fig2 = make_subplots(subplot_titles=["-"])
-fig2.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="fwd"))
-fig2.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="rev"))
-fig2.update_xaxes(
-    title="voltage (V)",
-    ticks="inside",
-    mirror="ticks",
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
-)
-fig2.update_yaxes(
-    title="current (A)",
-    ticks="inside",
-    mirror="ticks",
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
-)
-fig2.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
 
-fig3 = make_subplots(
-    specs=[[{"secondary_y": True}]], subplot_titles=["-"]
-)
-fig3.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="j"))
-fig3.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="p"))
-fig3.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="v"), secondary_y=True)
-fig3.update_xaxes(
-    title="time (s)",
-    ticks="inside",
-    mirror="ticks",
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
-)
-fig3.update_yaxes(
-    title="current (A) | power (W)",
-    ticks="inside",
-    mirror=True,
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
-)
-fig3.update_yaxes(
-    title="voltage (V)",
-    ticks="inside",
-    mirror=True,
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    overlaying="y",
-    secondary_y=True,
-    autorange=False,
-)
-fig3.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
-
-fig4 = make_subplots(subplot_titles=["-"])
-fig4.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="j"))
-fig4.update_xaxes(
-    title="time (s)",
-    ticks="inside",
-    mirror="ticks",
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
-)
-fig4.update_yaxes(
-    title="current (A)",
-    ticks="inside",
-    mirror="ticks",
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
-)
-fig4.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
-
-fig5 = make_subplots(
-    specs=[[{"secondary_y": True}]], subplot_titles=["-"]
-)
-fig5.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="eta"))
-fig5.add_trace(go.Scatter(x=[], y=[], mode="lines+markers", name="j"), secondary_y=True)
-fig5.update_xaxes(
-    title="wavelength (nm)",
-    ticks="inside",
-    mirror="ticks",
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
-)
-fig5.update_yaxes(
-    title="eqe (%)",
-    ticks="inside",
-    mirror=True,
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    autorange=False,
-)
-fig5.update_yaxes(
-    title="integrated j (A/m^2)",
-    ticks="inside",
-    mirror=True,
-    linecolor="#444",
-    showline=True,
-    zeroline=False,
-    showgrid=False,
-    overlaying="y",
-    secondary_y=True,
-    autorange=False,
-)
-fig5.update_layout(margin=dict(l=20, r=0, t=30, b=0), plot_bgcolor="rgba(0,0,0,0)")
+# initial figure of each graph
+TEMPLATES = load_templates()
+
+# maximum number of points per trace kept by the browser
+MAX_POINTS = 100000
+
+# data, formatting, and traces of each graph
+GRAPHS = {
+    "g1": {
+        "stream": "exp1",
+        "template": TEMPLATES["g1"],
+        "format_figure": format_figure_1,
+        "axis_ranges": axis_ranges_1,
+        "traces": [(0, 1)],
+    },
+    "g2": {
+        "stream": "exp2",
+        "template": TEMPLATES["g2"],
+        "format_figure": format_figure_2,
+        "axis_ranges": axis_ranges_2,
+        "traces": [(0, 1), (2, 3)],
+    },
+    "g3": {
+        "stream": "exp3",
+        "template": TEMPLATES["g3"],
+        "format_figure": format_figure_3,
+        "axis_ranges": axis_ranges_3,
+        "traces": [(0, 1), (0, 2), (0, 3)],
+    },
+    "g4": {
+        "stream": "exp4",
+        "template": TEMPLATES["g4"],
+        "format_figure": format_figure_4,
+        "axis_ranges": axis_ranges_4,
+        "traces": [(0, 1)],
+    },
+    "g5": {
+        "stream": "exp5",
+        "template": TEMPLATES["g5"],
+        "format_figure": format_figure_5,
+        "axis_ranges": axis_ranges_5,
+        "traces": [(0, 1), (0, 2)],
+    },
+}
 
 app = dash.Dash(__name__)
 
@@ -381,18 +491,32 @@ app.layout = html.Div(
     [
         html.Div(
             [
-                html.Div([dcc.Graph(id="g1", figure=fig1)], className="four columns",),
-                html.Div([dcc.Graph(id="g2", figure=fig2)], className="four columns",),
-                html.Div([dcc.Graph(id="g3", figure=fig3)], className="four columns",),
+                html.Div([dcc.Graph(id="g1", figure=TEMPLATES["g1"])], className="four columns",),
+                html.Div([dcc.Graph(id="g2", figure=TEMPLATES["g2"])], className="four columns",),
+                html.Div([dcc.Graph(id="g3", figure=TEMPLATES["g3"])], className="four columns",),
             ],
             className="row",
         ),
         html.Div(
             [
-                html.Div([dcc.Graph(id="g4", figure=fig4)], className="four columns",),
-                html.Div([dcc.Graph(id="g5", figure=fig5)], className="four columns",),
+                html.Div([dcc.Graph(id="g4", figure=TEMPLATES["g4"])], className="four columns",),
+                html.Div([dcc.Graph(id="g5", figure=TEMPLATES["g5"])], className="four columns",),
                 html.Div(
                     [
+                        dcc.Dropdown(
+                            id="device-select",
+                            options=[
+                                {"label": "Latest device", "value": LATEST_DEVICE}
+                            ],
+                            value=LATEST_DEVICE,
+                            clearable=False,
+                            style={
+                                "width": "250px",
+                                "margin": "auto",
+                                "margin-top": "150px",
+                                "font-family": "sans-serif",
+                            },
+                        ),
                         daq.ToggleSwitch(
                             id="pause-switch",
                             value=False,
@@ -417,7 +541,7 @@ app.layout = html.Div(
                             style={
                                 "width": "250px",
                                 "margin": "auto",
-                                "margin-top": "200px",
+                                "margin-top": "50px",
                             },
                         )
                     ],
@@ -431,45 +555,230 @@ app.layout = html.Div(
             interval=1 * 2000,  # in milliseconds
             n_intervals=0,
         ),
-    ],
+    ]
+    # per-graph state of the browser's copy of the data
+    + [
+        dcc.Store(
+            id=f"{graph}-seen",
+            data={"device": None, "version": -1, "generation": -1, "count": 0},
+        )
+        for graph in GRAPHS
+    ]
+    + [dcc.Store(id=f"{graph}-relayout") for graph in GRAPHS]
+    + [dcc.Store(id=f"{graph}-relayout-done") for graph in GRAPHS],
 )
 
 
+def update_graph(store, seen, template, format_figure, axis_ranges, traces, name=""):
+    """Get the updates that bring a graph up to date with its series store.
+
+    Only points the browser hasn't seen are sent, as extendData, along with a small
+    relayout patch for the axis ranges and title. The whole, decimated, figure is only
+    sent if the store has been cleared or replaced since the browser's last update, or
+    if the raw points appended since the last complete figure exceed the decimation
+    target, so the number of points in the browser stays bounded.
+
+    Parameters
+    ----------
+    store : SeriesStore
+        Store holding the graph's data, or an object with the same `since`,
+        `bounds`, `msg`, and `maxlen`.
+    seen : dict
+        Store "generation", appended row "count", and number of rows "extended" since
+        the last complete figure at the browser's last update.
+    template : dict
+        Dictionary representation of the empty Plotly figure.
+    format_figure : function
+        Function that formats the figure with data.
+    axis_ranges : function
+        Function that gets the figure's axis ranges from column bounds.
+    traces : list of tuple
+        Data columns plotted as (x, y) by each trace.
+    name : str
+        Graph id, used to label metrics.
+
+    Returns
+    -------
+    figure : dict or dash.no_update
+        Complete figure.
+    extend_data : list or dash.no_update
+        New points for the Graph's extendData property.
+    relayout : dict or dash.no_update
+        Update for Plotly.relayout.
+    seen : dict or dash.no_update
+        Store "generation", appended row "count", and rows "extended" after this
+        update.
+    """
+    generation, count, rows, complete = store.since(seen["generation"], seen["count"])
+    if len(rows) == 0:
+        # nothing new, or cleared: keep showing old data until new data arrives
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+    extended = seen.get("extended", 0) + len(rows)
+    if (
+        (complete is not True)
+        and (DECIMATE_METHOD is not None)
+        and (extended > DECIMATE_POINTS)
+    ):
+        # redraw decimated data once enough raw points have been appended
+        generation, count, rows, complete = store.since(-1, 0)
+
+    title = store.msg["id"]
+    if complete is True:
+        with FORMAT_SECONDS.labels(name).time():
+            fig = format_figure(rows, copy.deepcopy(template), title, store.bounds)
+        seen = {"generation": generation, "count": count, "extended": 0}
+        return fig, dash.no_update, dash.no_update, seen
+    else:
+        seen = {"generation": generation, "count": count, "extended": extended}
+        # the browser mustn't keep more points than the store
+        max_points = MAX_POINTS
+        if store.maxlen is not None:
+            max_points = min(MAX_POINTS, store.maxlen)
+        extend_data = [
+            {
+                "x": [rows[:, x] for x, y in traces],
+                "y": [rows[:, y] for x, y in traces],
+            },
+            list(range(len(traces))),
+            max_points,
+        ]
+        relayout = layout_patch(axis_ranges(*store.bounds), title)
+        return dash.no_update, extend_data, relayout, seen
+
+
+class _DeviceView:
+    """Read the store of one device through `STORES`, for `update_graph`."""
+
+    def __init__(self, stream, idn):
+        self.stream = stream
+        self.idn = idn
+        self.bounds = None
+        self.msg = None
+        self.maxlen = None
+
+    def since(self, generation, count):
+        """Get new rows, keeping the bounds, message, and maxlen read with them."""
+        *result, self.bounds, self.msg, self.maxlen = STORES.since(
+            self.stream, self.idn, generation, count
+        )
+        return tuple(result)
+
+
+def update_graph_live(graph, seen, paused, device=LATEST_DEVICE):
+    """Update a graph if its data have changed.
+
+    Parameters
+    ----------
+    graph : str
+        Graph id.
+    seen : dict
+        Displayed "device", and its store's "version", "generation", and appended
+        row "count" at the browser's last update.
+    paused : bool
+        Live updates are paused.
+    device : str
+        Id of the device to show, or `LATEST_DEVICE` to show the device that most
+        recently sent data.
+
+    Returns
+    -------
+    updates : tuple
+        Figure, extendData, relayout patch, and seen state for the graph.
+    """
+    if paused is True:
+        raise dash.exceptions.PreventUpdate
+
+    info = GRAPHS[graph]
+    if device == LATEST_DEVICE:
+        device = STORES.latest(info["stream"])
+    state = None if device is None else STORES.state(info["stream"], device)
+    if seen.get("device") != device:
+        # start again from the new device's data, or an empty figure without any
+        seen = {"device": device, "version": -1, "generation": -1, "count": 0}
+        if (state is None) or (state[1] == 0):
+            fig = copy.deepcopy(info["template"])
+            fig["layout"]["annotations"][0]["text"] = device or "-"
+            return fig, dash.no_update, dash.no_update, seen
+    if (state is None) or (state[0] == seen["version"]):
+        raise dash.exceptions.PreventUpdate
+
+    version = state[0]
+    with UPDATE_SECONDS.labels(graph).time():
+        figure, extend_data, relayout, new_seen = update_graph(
+            _DeviceView(info["stream"], device),
+            seen,
+            info["template"],
+            info["format_figure"],
+            info["axis_ranges"],
+            info["traces"],
+            graph,
+        )
+    if new_seen is dash.no_update:
+        # keep the old position in the data so new data is drawn correctly
+        new_seen = dict(seen)
+    new_seen["device"] = device
+    new_seen["version"] = version
+    return figure, extend_data, relayout, new_seen
+
+
+def register_graph_callback(graph):
+    """Register the callback that keeps a graph up to date.
+
+    Parameters
+    ----------
+    graph : str
+        Graph id.
+    """
+
+    @app.callback(
+        [
+            dash.dependencies.Output(graph, "figure"),
+            dash.dependencies.Output(graph, "extendData"),
+            dash.dependencies.Output(f"{graph}-relayout", "data"),
+            dash.dependencies.Output(f"{graph}-seen", "data"),
+        ],
+        [
+            dash.dependencies.Input("interval-component", "n_intervals"),
+            dash.dependencies.Input("device-select", "value"),
+        ],
+        [
+            dash.dependencies.State(f"{graph}-seen", "data"),
+            dash.dependencies.State("pause-switch", "value"),
+        ],
+    )
+    def update(n, device, seen, paused):
+        return update_graph_live(graph, seen, paused, device)
+
+
+for graph in GRAPHS:
+    register_graph_callback(graph)
+
+for graph in GRAPHS:
+    # apply layout patches in the browser without resending the figure
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(
+            namespace="plotter", function_name="relayout"
+        ),
+        dash.dependencies.Output(f"{graph}-relayout-done", "data"),
+        [dash.dependencies.Input(f"{graph}-relayout", "data")],
+        [dash.dependencies.State(graph, "id")],
+    )
+
+
 @app.callback(
-    [
-        dash.dependencies.Output("g1", "figure"),
-        dash.dependencies.Output("g2", "figure"),
-        dash.dependencies.Output("g3", "figure"),
-        dash.dependencies.Output("g4", "figure"),
-        dash.dependencies.Output("g5", "figure"),
-    ],
+    dash.dependencies.Output("device-select", "options"),
     [dash.dependencies.Input("interval-component", "n_intervals")],
-    [
-        dash.dependencies.State("g1", "figure"),
-        dash.dependencies.State("g2", "figure"),
-        dash.dependencies.State("g3", "figure"),
-        dash.dependencies.State("g4", "figure"),
-        dash.dependencies.State("g5", "figure"),
-        dash.dependencies.State("pause-switch", "value"),
-    ],
+    [dash.dependencies.State("device-select", "options")],
 )
-def update_graph_live(n, g1, g2, g3, g4, g5, paused):
-    """Update graph."""
-    if paused is not True:
-        g1_latest = graph1_latest[0]
-        g2_latest = graph2_latest[0]
-        g3_latest = graph3_latest[0]
-        g4_latest = graph4_latest[0]
-        g5_latest = graph5_latest[0]
-
-        # update figures
-        g1 = format_figure_1(g1_latest["data"], g1, g1_latest["msg"]["id"])
-        g2 = format_figure_2(g2_latest["data"], g2, g2_latest["msg"]["id"])
-        g3 = format_figure_3(g3_latest["data"], g3, g3_latest["msg"]["id"])
-        g4 = format_figure_4(g4_latest["data"], g4, g4_latest["msg"]["id"])
-        g5 = format_figure_5(g5_latest["data"], g5, g5_latest["msg"]["id"])
-
-    return g1, g2, g3, g4, g5
+def update_devices(n, options):
+    """List the devices with stored data in the device selector."""
+    new_options = [{"label": "Latest device", "value": LATEST_DEVICE}] + [
+        {"label": idn, "value": idn} for idn in sorted(STORES.devices())
+    ]
+    if new_options == options:
+        raise dash.exceptions.PreventUpdate
+    return new_options
 
 
 @app.callback(
@@ -484,111 +793,574 @@ def pause_button(paused):
         return "#36C95D"
 
 
+# set once the broker has acknowledged the plotter's subscriptions
+subscribed = threading.Event()
+
+
+@app.server.route("/ready")
+def ready():
+    """Report whether the plotter is ready to receive data.
+
+    Responds with status 200 once the web server is up and the MQTT subscriptions
+    have been acknowledged, or 503 until then. Used by the launcher to start
+    producers as soon as possible.
+    """
+    if subscribed.is_set() or ((INGEST is not None) and INGEST.ready()):
+        return "ready", 200
+    else:
+        return "waiting for MQTT subscriptions", 503
+
+
+def unpack(payload, keys=None):
+    """Decode an MQTT payload into blocks of data.
+
+    Payloads may be in the binary wire format or JSON, and may hold a single message
+    or a batch frame. Binary data are wrapped without copying. Consecutive JSON data
+    points from a device are merged into a single block, described by the last
+    message in the block with the acquisition "time" of the first message and the
+    "count" of messages.
+
+    Parameters
+    ----------
+    payload : bytes
+        MQTT payload.
+    keys : tuple of str or None
+        JSON message keys holding the columns of a data point. If None, JSON messages
+        hold an array of rows under "data".
+
+    Yields
+    ------
+    msg : dict
+        Message info, including "clear" and "id", and the sequence number "seq" and
+        acquisition "time" if the producer sent them.
+    data : array or list or None
+        Rows of data, or None if the message is a request to clear.
+    """
+    if wire.is_binary(payload):
+        for record in wire.iter_records(payload):
+            msg = {
+                "clear": record.clear,
+                "id": record.idn,
+                "seq": record.seq,
+                "time": record.timestamp,
+            }
+            if record.clear is True:
+                yield msg, None
+            else:
+                yield msg, record.data
+        return
+
+    m = json.loads(payload)
+    if "batch" in m:
+        msgs = m["batch"]
+    else:
+        msgs = [m]
+
+    # rows of consecutive data points from one device and the first and last messages
+    # holding them
+    rows = []
+    first = last = None
+    for m in msgs:
+        if m["clear"] is True:
+            if len(rows) > 0:
+                yield dict(last, time=first.get("time"), count=len(rows)), rows
+                rows = []
+            yield m, None
+        elif keys is None:
+            yield m, m["data"]
+        else:
+            if (len(rows) > 0) and (m["id"] != last["id"]):
+                # blocks only hold data from one device
+                yield dict(last, time=first.get("time"), count=len(rows)), rows
+                rows = []
+            if len(rows) == 0:
+                first = m
+            rows.append([m[k] for k in keys])
+            last = m
+    if len(rows) > 0:
+        yield dict(last, time=first.get("time"), count=len(rows)), rows
+
+
+# last sequence number received from each (stream, device)
+_last_seq = {}
+
+
+def ingest(stream, payload, keys=None, replace=False):
+    """Append, replace, or clear the data of devices on a stream.
+
+    Each device has its own store in `STORES`. Consecutive blocks of data from a
+    device are appended to its store in a single operation. A clear ends the
+    device's run: its data are kept until it sends new data. If `RECORDER` is set,
+    the data are also recorded, with a new run for each device started by every
+    clear or replacement. Metrics for the stream are updated: the time taken, the
+    number of points, the latency from acquisition, and gaps in the sequence numbers
+    of each device.
+
+    Parameters
+    ----------
+    stream : str
+        Name of the stream.
+    payload : bytes
+        MQTT payload.
+    keys : tuple of str or None
+        JSON message keys holding the columns of a data point.
+    replace : bool
+        If True, each block of data replaces the stored data instead of being
+        appended to it.
+    """
+    start = time.perf_counter()
+    blocks = []
+    last = None
+    times = []
+    points = 0
+    for msg, data in unpack(payload, keys):
+        _check_sequence(stream, msg)
+        if msg.get("time") is not None:
+            times.append(msg["time"])
+        if RECORDER is not None:
+            if (msg["clear"] is True) or (replace is True):
+                RECORDER.clear(stream, msg["id"])
+            if data is not None:
+                RECORDER.record(stream, msg["id"], data)
+        if (last is not None) and (msg["id"] != last["id"]):
+            # another device, so append the blocks so far to the previous one
+            _extend(stream, blocks, last)
+            blocks = []
+            last = None
+        if msg["clear"] is True:
+            _extend(stream, blocks, last)
+            blocks = []
+            last = None
+            STORES.end_run(stream, msg["id"])
+        elif replace is True:
+            STORES.replace(stream, msg["id"], data, msg)
+            points += len(data)
+        else:
+            blocks.append(data)
+            last = msg
+            points += len(data)
+    if len(blocks) > 0:
+        _extend(stream, blocks, last)
+
+    now = time.time()
+    latency = LATENCY_SECONDS.labels(stream)
+    for t in times:
+        latency.observe(now - t)
+    MESSAGES.labels(stream).inc()
+    POINTS.labels(stream).inc(points)
+    INGEST_SECONDS.labels(stream).observe(time.perf_counter() - start)
+
+
+def _check_sequence(stream, msg):
+    """Count messages missing from the sequence sent by a device."""
+    if msg.get("seq") is None:
+        return
+    first = msg["seq"] - msg.get("count", 1) + 1
+    key = (stream, msg["id"])
+    last = _last_seq.get(key)
+    if (last is not None) and (first > last + 1):
+        SEQUENCE_GAPS.labels(stream).inc(first - last - 1)
+    _last_seq[key] = msg["seq"]
+
+
+def _extend(stream, blocks, msg):
+    """Append blocks of rows to a device's store in a single operation."""
+    if len(blocks) == 0:
+        return
+    elif len(blocks) == 1:
+        rows = blocks[0]
+    else:
+        ncols = STORES.columns[stream]
+        rows = np.concatenate(
+            [np.asarray(block, dtype=float).reshape(-1, ncols) for block in blocks]
+        )
+    STORES.extend(stream, msg["id"], rows, msg)
+
+
 # MQTT on_message callback functions for each graph
 def on_message_1(mqttc, obj, msg):
     """Act on an MQTT msg.
 
-    Append or clear data stored in a queue.
+    Append or clear the data of a device.
     """
-    m = json.loads(msg.payload)
-    data = graph1_latest[0]["data"]
-    if m["clear"] is True:
-        data = np.empty((0, 2))
-    else:
-        data = np.append(data, np.array([[m["x1"], m["y1"]]]), axis=0)
-    graph1_latest.append({"msg": m, "data": data})
+    ingest("exp1", msg.payload, ("x1", "y1"))
 
 
 def on_message_2(mqttc, obj, msg):
     """Act on an MQTT msg.
 
-    Append or clear data stored in a queue.
+    Replace or clear the data of a device.
     """
-    m = json.loads(msg.payload)
-    data = graph2_latest[0]["data"]
-    if m["clear"] is True:
-        data = np.empty((0, 4))
-    else:
-        data = np.array(m["data"])
-    graph2_latest.append({"msg": m, "data": data})
+    ingest("exp2", msg.payload, replace=True)
 
 
 def on_message_3(mqttc, obj, msg):
     """Act on an MQTT msg.
 
-    Append or clear data stored in a queue.
+    Append or clear the data of a device.
     """
-    m = json.loads(msg.payload)
-    data = graph3_latest[0]["data"]
-    if m["clear"] is True:
-        data = np.empty((0, 4))
-    else:
-        data = np.append(data, np.array([[m["x1"], m["y1"], m["y2"], m["y3"]]]), axis=0)
-    graph3_latest.append({"msg": m, "data": data})
+    ingest("exp3", msg.payload, ("x1", "y1", "y2", "y3"))
 
 
 def on_message_4(mqttc, obj, msg):
     """Act on an MQTT msg.
 
-    Append or clear data stored in a queue.
+    Append or clear the data of a device.
     """
-    m = json.loads(msg.payload)
-    data = graph4_latest[0]["data"]
-    if m["clear"] is True:
-        data = np.empty((0, 2))
-    else:
-        data = np.append(data, np.array([[m["x1"], m["y1"]]]), axis=0)
-    graph4_latest.append({"msg": m, "data": data})
+    ingest("exp4", msg.payload, ("x1", "y1"))
 
 
 def on_message_5(mqttc, obj, msg):
     """Act on an MQTT msg.
 
-    Append or clear data stored in a queue.
+    Append or clear the data of a device.
+    """
+    ingest("exp5", msg.payload, ("x1", "y1", "y2"))
+
+
+# metrics published by each producer process, with the time they were received
+REMOTE_METRICS = {}
+
+
+def on_message_metrics(mqttc, obj, msg):
+    """Act on an MQTT msg.
+
+    Keep the latest metrics published by a producer. Malformed metrics are dropped
+    with a warning, keeping the producer's previous metrics.
     """
-    m = json.loads(msg.payload)
-    data = graph5_latest[0]["data"]
-    if m["clear"] is True:
-        data = np.empty((0, 3))
+    source = msg.topic.rsplit("/", 1)[-1]
+    if len(msg.payload) > 0:
+        try:
+            remote = json.loads(msg.payload)
+        except ValueError as e:
+            warnings.warn(f"Ignoring malformed metrics from {source}: {e}")
+            return
+        REMOTE_METRICS[source] = (time.time(), remote)
     else:
-        data = np.append(data, np.array([[m["x1"], m["y1"], m["y2"]]]), axis=0)
-    graph5_latest.append({"msg": m, "data": data})
+        REMOTE_METRICS.pop(source, None)
 
 
-if __name__ == "__main__":
-    import argparse
+def collect_metrics():
+    """Get the metrics of this process and of the producers publishing to it.
+
+    Producer metrics are labelled with the producer's source name.
+
+    Returns
+    -------
+    families : list of dict
+        Metrics, see `metrics.Registry.collect`.
+    """
+    families = metrics.REGISTRY.collect()
+    for source, (received, remote) in list(REMOTE_METRICS.items()):
+        if time.time() - received > METRICS_EXPIRY:
+            REMOTE_METRICS.pop(source, None)
+        else:
+            families.extend(metrics.add_labels(remote, source=source))
+    return families
+
+
+@app.server.route("/metrics")
+def export_metrics():
+    """Export plotter and producer metrics in the Prometheus text format.
+
+    A web worker exports its own metrics and those of its ingest process, labelled
+    with the worker's name and "ingest" respectively, so scrapes served by different
+    workers can be told apart.
+    """
+    families = collect_metrics()
+    if WORKER is not None:
+        families = metrics.add_labels(families, worker=WORKER)
+    if INGEST is not None:
+        families.extend(metrics.add_labels(INGEST.collect_metrics(), worker="ingest"))
+    return (
+        metrics.render(families),
+        200,
+        {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+_profile_lock = threading.Lock()
+
+
+@app.server.route("/profile")
+def profile():
+    """Sample the stacks of every plotter thread and return them.
+
+    Only available when profiling is enabled. The query parameters "seconds" and
+    "interval" set the time to sample for and between samples. The response, sent
+    once sampling has finished, is in the collapsed format used by flame graph tools,
+    e.g. ``curl "127.0.0.1:8050/profile?seconds=10" | flamegraph.pl > plotter.svg``.
+    Only one profile can run at a time.
+    """
+    if PROFILING is False:
+        return "profiling is disabled", 404
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        interval = float(request.args.get("interval", sampler.DEFAULT_INTERVAL))
+    except ValueError:
+        return "seconds and interval must be numbers", 400
+    if not (0 < seconds <= MAX_PROFILE_SECONDS):
+        return f"seconds must be in range (0, {MAX_PROFILE_SECONDS}]", 400
+    if not (interval > 0):
+        return "interval must be positive", 400
+    if not _profile_lock.acquire(blocking=False):
+        return "a profile is already running", 409
+    try:
+        stacks = sampler.profile(seconds, interval)
+    finally:
+        _profile_lock.release()
+    return stacks, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+# handler for each subtopic of the plotter's topic
+ON_MESSAGES = {
+    "exp1": on_message_1,
+    "exp2": on_message_2,
+    "exp3": on_message_3,
+    "exp4": on_message_4,
+    "exp5": on_message_5,
+    f"{wire.METRICS_SUBTOPIC}/+": on_message_metrics,
+}
+
+
+def _dispatch(subtopic, on_msg):
+    """Wrap a message handler so a message it can't handle doesn't stop the client.
+
+    paho re-raises exceptions from callbacks in its network thread, so one malformed
+    message would otherwise stop every stream from being received. Such messages are
+    dropped with a warning and counted instead.
+
+    Parameters
+    ----------
+    subtopic : str
+        Subtopic the handler is registered for, used to label the count.
+    on_msg : callable
+        MQTT on_message callback.
+
+    Returns
+    -------
+    on_message : callable
+        Wrapped callback.
+    """
+
+    def on_message(mqttc, obj, msg):
+        try:
+            on_msg(mqttc, obj, msg)
+        except Exception as e:
+            DROPPED.labels(subtopic).inc()
+            warnings.warn(f"Dropped message on {msg.topic}: {e!r}")
+
+    return on_message
+
 
+def start_subscriber(host, topic, filters=None, port=1883):
+    """Start one MQTT client that receives every stream for the plotter.
+
+    Messages are routed to their handler by subtopic using paho's per-topic
+    callbacks. Messages on subtopics without a handler are ignored, and messages a
+    handler fails on are dropped, see `_dispatch`. Subscriptions are made in the
+    on_connect callback so they are restored after a reconnect, and `subscribed` is
+    set when the broker acknowledges them.
+
+    Parameters
+    ----------
+    host : str
+        MQTT broker address.
+    topic : str
+        Base topic. Handlers are registered for its subtopics in `ON_MESSAGES`.
+    filters : list of str or None
+        Topic filters to subscribe to. If None, subscribe to `topic`/#.
+    port : int
+        MQTT broker port.
+
+    Returns
+    -------
+    mqttc : mqtt.Client
+        Running MQTT client.
+    """
+    if filters is None:
+        filters = [f"{topic}/#"]
+
+    subscribe_mid = None
+
+    def on_connect(mqttc, obj, flags, rc):
+        nonlocal subscribe_mid
+        subscribed.clear()
+        _, subscribe_mid = mqttc.subscribe([(f, 2) for f in filters])
+        # advertise the wire formats this plotter can decode to producers
+        mqttc.publish(
+            f"{topic}/{wire.FORMATS_SUBTOPIC}",
+            json.dumps(wire.SUPPORTED_FORMATS),
+            qos=1,
+            retain=True,
+        )
+
+    def on_subscribe(mqttc, obj, mid, granted_qos):
+        # 0x80 means the broker refused a subscription
+        if (mid == subscribe_mid) and (0x80 not in granted_qos):
+            subscribed.set()
+
+    mqttc = mqtt.Client()
+    for subtopic, on_msg in ON_MESSAGES.items():
+        mqttc.message_callback_add(f"{topic}/{subtopic}", _dispatch(subtopic, on_msg))
+    mqttc.on_connect = on_connect
+    mqttc.on_subscribe = on_subscribe
+    mqttc.connect(host, port)
+    mqttc.loop_start()
+    return mqttc
+
+
+def stop_subscriber(mqttc, topic):
+    """Withdraw the format advertisement and stop a client from `start_subscriber`.
+
+    Parameters
+    ----------
+    mqttc : mqtt.Client
+        Running MQTT client.
+    topic : str
+        Base topic.
+    """
+    formats_topic = f"{topic}/{wire.FORMATS_SUBTOPIC}"
+    try:
+        info = mqttc.publish(formats_topic, b"", qos=1, retain=True)
+        info.wait_for_publish(timeout=5)
+    except RuntimeError as e:
+        warnings.warn(f"Couldn't withdraw the format advertisement: {e}")
+    finally:
+        # stop receiving even if the broker is gone, so nothing is stored afterwards
+        mqttc.loop_stop()
+        mqttc.disconnect()
+
+
+def make_parser():
+    """Make the command line parser of the plotter's options.
+
+    Returns
+    -------
+    parser : argparse.ArgumentParser
+        Parser.
+    """
     parser = argparse.ArgumentParser()
     parser.add_argument("-t", metavar="t", type=str, default="data", help="Topic.")
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=MQTTHOST,
+        help="MQTT broker address. Defaults to the MQTTHOST environment variable.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=MQTTPORT,
+        help="MQTT broker port. Defaults to the MQTTPORT environment variable.",
+    )
+    parser.add_argument(
+        "--decimate",
+        type=str,
+        default="lttb",
+        choices=["lttb", "minmax", "none"],
+        help="Method used to reduce the number of points sent to the browser.",
+    )
+    parser.add_argument(
+        "--points",
+        type=int,
+        default=2000,
+        help="Target number of points per trace after decimation.",
+    )
+    parser.add_argument(
+        "-s",
+        metavar="s",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Topic filter(s) to subscribe to. Defaults to all subtopics of the topic.",
+    )
+    parser.add_argument(
+        "--memory",
+        type=float,
+        default=MEMORY_BUDGET / 1024 ** 2,
+        help="Memory (MiB) for stored data. Inactive devices are forgotten beyond it.",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=None,
+        help="Directory to record all received data in.",
+    )
+    parser.add_argument(
+        "--profiling",
+        action="store_true",
+        help="Enable sampling profiles of the running plotter at /profile.",
+    )
+    parser.add_argument(
+        "--shared-rows",
+        type=int,
+        default=0,
+        help="Keep the last N rows of each device in shared memory ring buffers that"
+        + " other processes can read. 0 keeps all rows in private memory.",
+    )
+    parser.add_argument(
+        "--shared-prefix",
+        type=str,
+        default=None,
+        help="Name prefix of the shared memory segments. Defaults to a random prefix.",
+    )
+    return parser
+
+
+def configure(args):
+    """Apply command line options to the plotter.
+
+    Recording isn't started, see `Recorder`.
 
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Options parsed by the parser from `make_parser`.
+    """
+    global DECIMATE_METHOD, DECIMATE_POINTS, PROFILING, SHARED_PREFIX
+    DECIMATE_METHOD = None if args.decimate == "none" else args.decimate
+    DECIMATE_POINTS = args.points
+    PROFILING = args.profiling
+    STORES.budget = int(args.memory * 1024 ** 2)
+    if args.shared_rows > 0:
+        SHARED_PREFIX = args.shared_prefix or new_prefix()
+        STORES.factory = shared_factory(SHARED_PREFIX, args.shared_rows)
+
+
+if __name__ == "__main__":
+    parser = make_parser()
+    parser.add_argument(
+        "--no-reload",
+        action="store_true",
+        help="Don't run the development server's reloader, which would run a second"
+        + " plotter process subscribed to the same data.",
+    )
     args = parser.parse_args()
+    configure(args)
+    if args.record is not None:
+        RECORDER = Recorder(args.record)
+        print(f"Recording to {args.record}")
+    if SHARED_PREFIX is not None:
+        print(f"Sharing stores in memory segments named {SHARED_PREFIX}*")
 
     topic = args.t
-    print(f"Subscribing to mqtt://{MQTTHOST}/{topic}")
-
-    subtopics = []
-    subtopics.append(f"{topic}/exp1")
-    subtopics.append(f"{topic}/exp2")
-    subtopics.append(f"{topic}/exp3")
-    subtopics.append(f"{topic}/exp4")
-    subtopics.append(f"{topic}/exp5")
-
-    on_messages = [on_message_1, on_message_2, on_message_3, on_message_4, on_message_5]
-
-    # start a new mqtt subscriber client for each subtopic, each in its own thread
-    mqtt_clients = []
-    for subtopic, on_msg in zip(subtopics, on_messages):
-        mqttc = mqtt.Client()
-        mqtt_clients.append(mqttc)
-        mqttc.on_message = on_msg
-        mqttc.connect(MQTTHOST)
-        mqttc.subscribe(subtopic, qos=2)
-        mqttc.loop_start()
+    print(f"Subscribing to mqtt://{args.host}:{args.port}/{topic}")
 
-    # start dash server
-    app.run_server(host=DASHHOST, debug=True)
+    # a single client and network thread serves every stream
+    mqttc = start_subscriber(args.host, topic, args.s, args.port)
 
-    # stop mqtt client threads
-    for mqttc in mqtt_clients:
-        mqttc.loop_stop()
-        mqttc.disconnect()
+    # start dash server
+    # the reloader would run a second plotter process recording the same data, or
+    # writing to the same shared memory
+    reload = (RECORDER is None) and (SHARED_PREFIX is None) and not args.no_reload
+    try:
+        app.run_server(host=DASHHOST, debug=True, use_reloader=reload)
+    finally:
+        # stop ingesting before closing what it writes to
+        try:
+            stop_subscriber(mqttc, topic)
+        finally:
+            if RECORDER is not None:
+                RECORDER.close()
+            STORES.close()
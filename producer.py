@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 """MQTT client producing data."""
 
+import concurrent.futures
+import functools
 import json
-import collections
+import os
+import queue
+import signal
+import socket
 import threading
 import time
 import warnings
@@ -10,26 +15,122 @@ import warnings
 import paho.mqtt.client as mqtt
 import numpy as np
 
-MQTTHOST = "mqtt.greyltc.com"
+import metrics
+import mqttpool
+import sampler
+import wire
+from publishqueue import (
+    CONFLATED,
+    DROPPED,
+    FAILED,
+    PUBLISH_SECONDS,
+    PUBLISHED,
+    PUBLISHED_BYTES,
+    QUEUE_DEPTH,
+    PublishQueue,
+)
+from streams import CurrentStream, EQEStream, IVStream, MPPTStream, VoltageStream
 
+MQTTHOST = os.environ.get("MQTTHOST", "mqtt.greyltc.com")
+MQTTPORT = int(os.environ.get("MQTTPORT", 1883))
 
-class MQTTQueuePublisher(mqtt.Client):
-    """MQTT client that publishes data to a topic from its own queue.
+# sentinel telling a queue publisher thread to stop
+_STOP = object()
+
+# time in seconds between publishing metrics to the plotter, 0 to disable
+METRICS_INTERVAL = 5.0
+
+# directory profiles are saved in
+PROFILE_DIR = "."
+
+
+class MQTTQueuePublisher:
+    """Publish data to a topic from its own queue.
 
     Publishing to a topic can take a significant amount of time. If data is produced
     and quickly, appending it to a queue is faster than publishing, allowing the
     program to continue without blocking. Messages can be published from the queue
     concurrently without blocking the main program producing data.
+
+    Publishers don't own an MQTT client. `connect` acquires a connection to the broker
+    from mqttpool.pool, so all publishers in a process share one connection and
+    network thread per broker.
+
+    Up to `max_inflight` messages are published without waiting for the previous ones
+    to be acknowledged, so throughput is not limited to one QoS handshake per
+    round trip. Messages are still delivered in queue order.
+
+    If `batch` is True, queued payloads are coalesced into a single frame of the form
+    ``{"batch": [payload, ...]}``. A frame is published as soon as it holds
+    `batch_max_count` payloads, reaches `batch_max_bytes`, or the first payload in it
+    has waited `batch_max_latency` seconds.
+
+    Binary payloads (see the wire module) are batched by placing their records back to
+    back.
+
+    The queue can be bounded by `maxsize` payloads and `maxbytes` bytes, with
+    `policy` deciding whether appending to a full queue blocks, drops payloads, or
+    conflates them (see PublishQueue). The `dropped` and `conflated` counters record
+    payloads lost to the bounds.
     """
 
-    def __init__(self):
-        """Construct MQTT client, inheriting from mqtt.Client.
+    def __init__(
+        self,
+        qos=2,
+        max_inflight=20,
+        batch=False,
+        batch_max_count=100,
+        batch_max_bytes=65536,
+        batch_max_latency=0.1,
+        maxsize=None,
+        maxbytes=None,
+        policy="block",
+    ):
+        """Construct queue publisher.
+
+        Call `connect` before starting the queue.
 
-        Callback and connect methods are not automatically run here. They should be
-        called in the same way as for the base mqtt.Client.
+        Parameters
+        ----------
+        qos : int
+            Default quality of service level (0, 1, or 2) for published messages.
+        max_inflight : int
+            Maximum number of published messages awaiting acknowledgement.
+        batch : bool
+            Coalesce queued payloads into multi-payload frames.
+        batch_max_count : int
+            Maximum number of payloads in a frame.
+        batch_max_bytes : int
+            Frame size in bytes at which a frame is published.
+        batch_max_latency : float
+            Maximum time in seconds a payload waits for a frame to fill up.
+        maxsize : int or None
+            Maximum number of queued payloads. If None, the queue isn't limited.
+        maxbytes : int or None
+            Maximum total size of queued payloads. If None, the size isn't limited.
+        policy : {"block", "drop_oldest", "drop_newest", "conflate"}
+            What to do when a payload is appended to a full queue.
         """
-        super().__init__()
         self._topic = None
+        self._connection = None
+        self.qos = qos
+        self.max_inflight = max_inflight
+        self.batch = batch
+        self.batch_max_count = batch_max_count
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_max_latency = batch_max_latency
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.policy = policy
+        self._q = None
+        self._inflight = 0
+        self._inflight_cond = threading.Condition()
+        self._stopping = False
+
+    @property
+    def inflight(self):
+        """Get number of published messages awaiting acknowledgement."""
+        return self._inflight
 
     @property
     def topic(self):
@@ -38,237 +139,269 @@ class MQTTQueuePublisher(mqtt.Client):
 
     @property
     def q_size(self):
-        """Get current length of deque."""
+        """Get current length of queue."""
         return len(self._q)
 
-    def start_q(self, topic):
-        """Start queue and mqtt client threads.
+    @property
+    def dropped(self):
+        """Get number of payloads discarded because the queue was full."""
+        return 0 if self._q is None else self._q.dropped
+
+    @property
+    def conflated(self):
+        """Get number of payloads replaced by a newer one because the queue was full."""
+        return 0 if self._q is None else self._q.conflated
+
+    def connect(self, host, port=1883):
+        """Connect to a broker through the shared connection pool.
 
-        The MQTT client publishes data to a topic from its own queue.
+        Parameters
+        ----------
+        host : str
+            MQTT broker address.
+        port : int
+            MQTT broker port.
+        """
+        if self._connection is None:
+            self._connection = mqttpool.pool.acquire(host, port)
+
+    def disconnect(self):
+        """Release the connection to the broker."""
+        if self._connection is not None:
+            mqttpool.pool.release(self._connection)
+            self._connection = None
+
+    def start_q(self, topic, qos=None):
+        """Start queue thread.
+
+        The thread publishes data to a topic from its own queue.
 
         topic : str
             MQTT topic to publish to.
+        qos : int or None
+            Quality of service level for this stream. If None, use the default given
+            at construction.
         """
         if self._topic is None:
             self._topic = topic
-            self.loop_start()  # start MQTT client thread
-            self._q = collections.deque()
-            self._t = threading.Thread(target=self._queue_publisher)
+            if qos is not None:
+                self.qos = qos
+            self._q = PublishQueue(self.maxsize, self.maxbytes, self.policy)
+            q = self._q
+            QUEUE_DEPTH.labels(topic).set_function(lambda: len(q))
+            DROPPED.labels(topic).set_function(lambda: q.dropped)
+            CONFLATED.labels(topic).set_function(lambda: q.conflated)
+            self._published = PUBLISHED.labels(topic)
+            self._failed = FAILED.labels(topic)
+            self._published_bytes = PUBLISHED_BYTES.labels(topic)
+            self._publish_seconds = PUBLISH_SECONDS.labels(topic)
+            self._stopping = False
+            self._t = threading.Thread(
+                target=self._queue_publisher, name=f"publisher-{topic}"
+            )
             self._t.start()
         else:
             warnings.warn(
                 f"A queue for '{self._topic}' is already running. End that queue first or instantiate a new queue publisher client."
             )
 
-    def end_q(self):
-        """End a thread that publishes data to a topic from its own queue."""
-        self._q.appendleft("stop")  # send the queue thread a stop command
-        self._t.join()  # join thread
-        self.loop_stop()
+    def end_q(self, timeout=None):
+        """End a thread that publishes data to a topic from its own queue.
+
+        timeout : float or None
+            Maximum time in seconds to wait for queued payloads to be published
+            before stopping, and then for the thread to stop. If None, wait until the
+            queue is drained. Payloads still queued after the timeout are discarded,
+            as is a message waiting for a slot in a full in-flight window.
+        """
+        if self._topic is None:
+            return
+        self._q.flush(timeout)
+        # stop waiting for acknowledgements that may never come
+        with self._inflight_cond:
+            self._stopping = True
+            self._inflight_cond.notify_all()
+        # send the queue thread a stop command
+        self._q.put(_STOP, front=True, droppable=False)
+        self._t.join(timeout)  # join thread
+        if self._t.is_alive():
+            warnings.warn(f"The queue thread for '{self._topic}' didn't stop in time.")
         self._topic = None  # forget thread and queue
 
-    def append_payload(self, payload):
+    def flush(self, timeout=None):
+        """Block until all queued payloads have been published.
+
+        timeout : float or None
+            Maximum time to wait in seconds. If None, wait indefinitely.
+
+        Returns
+        -------
+        flushed : bool
+            True if the queue was drained, False if the timeout expired first.
+        """
+        return self._q.flush(timeout)
+
+    def append_payload(self, payload, key=None, droppable=True):
         """Append a payload to a queue.
 
-        payload : str
-            Message to be added to deque.
+        payload : str or bytes
+            Message to be added to queue.
+        key : hashable
+            Stream the payload belongs to, used when conflating. Defaults to the topic.
+        droppable : bool
+            If False, the payload is never discarded to bound the queue.
         """
-        self._q.append(payload)
+        key = self._topic if key is None else key
+        self._q.put(payload, key=key, droppable=droppable)
 
     def _queue_publisher(self):
         """Publish elements in the queue.
 
-        q : deque
-            Deque to publish from.
-        topic : str
-            MQTT topic to publish to.
+        Sleeps while the queue is empty and exits when it receives the stop sentinel.
+        Queue items are marked done when their publication completes, or fails.
         """
         while True:
-            if len(self._q) > 0:
-                payload = self._q.popleft()
-                if payload == "stop":
-                    break
-                # publish paylod with blocking wait for completion
-                self.publish(self._topic, payload, qos=2).wait_for_publish()
-
-    def __enter__(self):
-        """Enter the runtime context related to this object."""
-        return self
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        """Exit the runtime context related to this object.
-
-        Make sure everything gets cleaned up properly.
-        """
-        print(f"\nCleaning up {self._topic}...")
-        self.end_q()
-        self.disconnect()
-        print(f"Clean!")
-
-
-class VoltageDataHandler(MQTTQueuePublisher):
-    """Publish voltage vs. time data with MQTT client."""
-
-    def __init__(self, idn=""):
-        """Construct MQTT queue publisher.
-
-        Parameters
-        ----------
-        idn : str
-            Identity string to send with data.
+            payloads = self._next_frame()
+            stop = payloads[-1] is _STOP
+            if stop is True:
+                payloads.pop()
+                self._q.task_done()
+            if len(payloads) > 0:
+                self._publish_frame(payloads)
+            if stop is True:
+                break
+
+    def _next_frame(self):
+        """Get the payloads to publish in the next message.
+
+        Without batching this is the next item in the queue. With batching, items are
+        collected until one of the count, size, or latency limits is reached.
+
+        Returns
+        -------
+        payloads : list
+            Payloads taken from the queue, possibly ending with the stop sentinel.
         """
-        super().__init__()
-        self.idn = idn
-
-    def handle_data(self, data):
-        """Perform tasks with data.
+        payload = self._q.get()
+        payloads = [payload]
+        if (self.batch is not True) or (payload is _STOP):
+            return payloads
+
+        size = len(payload)
+        deadline = time.monotonic() + self.batch_max_latency
+        while (len(payloads) < self.batch_max_count) and (size < self.batch_max_bytes):
+            try:
+                payload = self._q.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            payloads.append(payload)
+            if payload is _STOP:
+                break
+            size += len(payload)
+
+        return payloads
+
+    def _publish_frame(self, payloads):
+        """Publish payloads as a single message without waiting for completion.
 
         Parameters
         ----------
-        data : list or str
-            List of data from exp_1.
+        payloads : list
+            Payloads to publish. More than one payload is sent as a batch frame.
         """
-        payload = {
-            "x1": data[0],
-            "y1": data[1],
-            "clear": False,
-            "id": self.idn,
-        }
-        # turn dict into string that mqtt can send
-        payload = json.dumps(payload)
-        self.append_payload(payload)
-
+        if len(payloads) == 1:
+            frame = payloads[0]
+        elif isinstance(payloads[0], bytes):
+            frame = b"".join(payloads)
+        else:
+            frame = '{"batch": [' + ", ".join(payloads) + "]}"
 
-class IVDataHandler(MQTTQueuePublisher):
-    """Publish current vs. voltage data with MQTT client."""
+        n = len(payloads)
 
-    def __init__(self, idn=""):
-        """Construct MQTT queue publisher.
+        # wait for a free slot in the in-flight window, unless the queue is ending
+        with self._inflight_cond:
+            self._inflight_cond.wait_for(
+                lambda: self._stopping or (self._inflight < self.max_inflight)
+            )
+            full = self._inflight >= self.max_inflight
+            if full is False:
+                self._inflight += 1
+        if full is True:
+            self._failed.inc(n)
+            for _ in range(n):
+                self._q.task_done()
+            warnings.warn(
+                f"Discarded {n} payloads to {self._topic}: no acknowledgements while"
+                + " stopping."
+            )
+            return
 
-        Parameters
-        ----------
-        idn : str
-            Identity string to send with data.
-        """
-        super().__init__()
-        self.idn = idn
+        self._published_bytes.inc(len(frame))
+        start = time.monotonic()
+        try:
+            self._connection.publish(
+                self._topic, frame, self.qos, lambda: self._complete_frame(n, start)
+            )
+        except Exception as e:
+            # keep consuming, so flush() and end_q() don't wait for a dead thread
+            self._complete_frame(n)
+            self._failed.inc(n)
+            warnings.warn(f"Failed to publish {n} payloads to {self._topic}: {e!r}")
 
-    def handle_data(self, data):
-        """Perform tasks with data.
+    def _complete_frame(self, n, start=None):
+        """Release the in-flight slot of a message holding `n` queued payloads.
 
         Parameters
         ----------
-        data : array
-            Array of data from exp_2.
+        n : int
+            Number of queued payloads contained in the message.
+        start : float or None
+            Monotonic time the message was published. If None, the message wasn't
+            published.
         """
-        payload = {
-            "data": data.tolist(),
-            "clear": False,
-            "id": self.idn,
-        }
-        # turn dict into string that mqtt can send
-        payload = json.dumps(payload)
-        self.append_payload(payload)
-
+        if start is not None:
+            self._publish_seconds.observe(time.monotonic() - start)
+            self._published.inc(n)
+        with self._inflight_cond:
+            self._inflight -= 1
+            self._inflight_cond.notify_all()
+        for _ in range(n):
+            self._q.task_done()
 
-class MPPTDataHandler(MQTTQueuePublisher):
-    """Publish max power point tracking data with MQTT client."""
-
-    def __init__(self, idn=""):
-        """Construct MQTT queue publisher.
-
-        Parameters
-        ----------
-        idn : str
-            Identity string to send with data.
-        """
-        super().__init__()
-        self.idn = idn
+    def __enter__(self):
+        """Enter the runtime context related to this object."""
+        return self
 
-    def handle_data(self, data):
-        """Perform tasks with data.
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit the runtime context related to this object.
 
-        Parameters
-        ----------
-        data : list
-            List of data from exp_4.
+        Make sure everything gets cleaned up properly.
         """
-        payload = {
-            "x1": data[0],
-            "y1": data[1],
-            "y2": data[2],
-            "y3": data[3],
-            "clear": False,
-            "id": self.idn,
-        }
-        payload = json.dumps(payload)
-        self.append_payload(payload)
+        print(f"\nCleaning up {self._topic}...")
+        # on error don't hang waiting for a queue that may never drain
+        self.end_q(timeout=None if exc_type is None else 0)
+        self.disconnect()
+        print(f"Clean!")
 
 
-class CurrentDataHandler(MQTTQueuePublisher):
-    """Publish current vs. time data with MQTT client."""
+class VoltageDataHandler(VoltageStream, MQTTQueuePublisher):
+    """Publish voltage vs. time data over a shared MQTT connection."""
 
-    def __init__(self, idn=""):
-        """Construct MQTT queue publisher.
 
-        Parameters
-        ----------
-        idn : str
-            Identity string to send with data.
-        """
-        super().__init__()
-        self.idn = idn
+class IVDataHandler(IVStream, MQTTQueuePublisher):
+    """Publish current vs. voltage data over a shared MQTT connection."""
 
-    def handle_data(self, data):
-        """Perform tasks with data.
 
-        Parameters
-        ----------
-        data : list
-            List of data from exp_4.
-        """
-        payload = {
-            "x1": data[0],
-            "y1": data[1],
-            "clear": False,
-            "id": self.idn,
-        }
-        # turn dict into string that mqtt can send
-        payload = json.dumps(payload)
-        self.append_payload(payload)
+class MPPTDataHandler(MPPTStream, MQTTQueuePublisher):
+    """Publish max power point tracking data over a shared MQTT connection."""
 
 
-class EQEDataHandler(MQTTQueuePublisher):
-    """Publish EQE data with MQTT client."""
+class CurrentDataHandler(CurrentStream, MQTTQueuePublisher):
+    """Publish current vs. time data over a shared MQTT connection."""
 
-    def __init__(self, idn=""):
-        """Construct MQTT queue publisher.
 
-        Parameters
-        ----------
-        idn : str
-            Identity string to send with data.
-        """
-        super().__init__()
-        self.idn = idn
-
-    def handle_data(self, data):
-        """Perform tasks with data.
-
-        Parameters
-        ----------
-        data : list
-            List of data from exp_4.
-        """
-        payload = {
-            "x1": data[0],
-            "y1": data[1],
-            "y2": data[2],
-            "clear": False,
-            "id": self.idn,
-        }
-        payload = json.dumps(payload)
-        self.append_payload(payload)
+class EQEDataHandler(EQEStream, MQTTQueuePublisher):
+    """Publish EQE data over a shared MQTT connection."""
 
 
 def exp_1(n, data_handler=None):
@@ -375,6 +508,254 @@ def exp_5(n, data_handler=None):
         time.sleep(0.25)
 
 
+def negotiate_format(host, topic, timeout=1.0, port=1883):
+    """Choose a wire format that subscribers to a topic can decode.
+
+    Subscribers advertise the formats they support in a retained message on the
+    formats subtopic. The binary format is chosen if it is advertised, otherwise JSON
+    is used as a fallback.
+
+    Parameters
+    ----------
+    host : str
+        MQTT broker address.
+    topic : str
+        Base topic data will be published to.
+    timeout : float
+        Time in seconds to wait for an advertisement.
+    port : int
+        MQTT broker port.
+
+    Returns
+    -------
+    wire_format : {"json", "binary"}
+        Format to publish data in.
+    """
+    formats = []
+    advertised = threading.Event()
+
+    def on_message(mqttc, obj, msg):
+        if len(msg.payload) > 0:
+            formats.extend(json.loads(msg.payload))
+        advertised.set()
+
+    mqttc = mqtt.Client()
+    mqttc.on_message = on_message
+    mqttc.connect(host, port)
+    mqttc.subscribe(f"{topic}/{wire.FORMATS_SUBTOPIC}", qos=1)
+    mqttc.loop_start()
+    advertised.wait(timeout)
+    mqttc.loop_stop()
+    mqttc.disconnect()
+
+    if "binary" in formats:
+        return "binary"
+    else:
+        return "json"
+
+
+def source_name():
+    """Get a name for this process that's unique among producers."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+_metrics_thread = None
+_metrics_stop = threading.Event()
+_metrics_lock = threading.Lock()
+
+
+def start_metrics_export(host, topic, port=1883, interval=METRICS_INTERVAL):
+    """Periodically publish this process's metrics for the plotter to export.
+
+    Metrics are published as JSON to the metrics subtopic followed by a name unique
+    to this process. Only the first call in a process has any effect, until
+    `stop_metrics_export` is called.
+
+    Parameters
+    ----------
+    host : str
+        MQTT broker address.
+    topic : str
+        Base topic of the plotter.
+    port : int
+        MQTT broker port.
+    interval : float
+        Time in seconds between publications. If 0, metrics aren't published.
+    """
+    global _metrics_thread
+    if interval <= 0:
+        return
+
+    metrics_topic = f"{topic}/{wire.METRICS_SUBTOPIC}/{source_name()}"
+
+    def export(connection):
+        try:
+            while True:
+                # keep exporting if a publication fails, e.g. while disconnected
+                try:
+                    payload = json.dumps(metrics.REGISTRY.collect())
+                    # through the connection, so it knows the acknowledgement is
+                    # expected
+                    connection.publish(metrics_topic, payload, 0, lambda: None)
+                except Exception as e:
+                    warnings.warn(
+                        f"Failed to publish metrics to {metrics_topic}: {e!r}"
+                    )
+                if _metrics_stop.wait(interval) is True:
+                    break
+        finally:
+            mqttpool.pool.release(connection)
+
+    # experiment threads may all start exporting at once
+    with _metrics_lock:
+        if _metrics_thread is not None:
+            return
+        _metrics_stop.clear()
+        connection = mqttpool.pool.acquire(host, port)
+        _metrics_thread = threading.Thread(
+            target=export, args=(connection,), name="metrics", daemon=True
+        )
+        _metrics_thread.start()
+
+
+def stop_metrics_export(timeout=None):
+    """Stop publishing metrics and release the broker connection.
+
+    Parameters
+    ----------
+    timeout : float or None
+        Maximum time in seconds to wait for the export thread to stop. If None, wait
+        indefinitely.
+    """
+    global _metrics_thread
+    with _metrics_lock:
+        if _metrics_thread is None:
+            return
+        _metrics_stop.set()
+        _metrics_thread.join(timeout)
+        _metrics_thread = None
+
+
+# samples this process's threads on request
+_profiler = sampler.Sampler()
+
+
+def save_profile(stacks, directory=None):
+    """Save a profile to a file for flame graph tools.
+
+    Parameters
+    ----------
+    stacks : str
+        Sampled stacks in the collapsed format.
+    directory : str or None
+        Directory to save the file in. If None, use `PROFILE_DIR`.
+
+    Returns
+    -------
+    path : str
+        Path of the saved file.
+    """
+    directory = PROFILE_DIR if directory is None else directory
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(directory, f"producer-{source_name()}-{timestamp}.folded")
+    with open(path, "w") as f:
+        f.write(stacks)
+    return path
+
+
+def toggle_profile(signum=None, frame=None, directory=None):
+    """Start sampling this process's threads, or stop and save the profile.
+
+    Installed as the SIGUSR1 handler, so ``kill -USR1 <pid>`` starts a profile and
+    sending the signal again saves it in `directory`, or `PROFILE_DIR` if None.
+    """
+    if _profiler.running is True:
+        _profiler.stop()
+        path = save_profile(_profiler.collapsed(), directory)
+        print(f"Saved profile of {_profiler.samples} samples to {path}")
+    else:
+        _profiler.start()
+        print("Profiling started, send the signal again to stop")
+
+
+_control_client = None
+_control_lock = threading.Lock()
+
+
+def start_profile_control(host, topic, port=1883, directory=None):
+    """Start profiling this process on request from the control topic.
+
+    A message on the control subtopic `profile` starts a profile. Its optional JSON
+    payload sets the "seconds" to sample for and the "interval" between samples,
+    e.g. ``{"seconds": 10}``. Every producer listening to the topic samples its
+    threads, saves the profile in `directory`, and publishes it to the profile
+    subtopic followed by its source name. Only the first call in a process has any
+    effect.
+
+    Parameters
+    ----------
+    host : str
+        MQTT broker address.
+    topic : str
+        Base topic of the plotter.
+    port : int
+        MQTT broker port.
+    directory : str or None
+        Directory to save profiles in. If None, use `PROFILE_DIR`.
+    """
+    global _control_client
+    control_topic = f"{topic}/{wire.CONTROL_SUBTOPIC}/profile"
+    profile_topic = f"{topic}/{wire.PROFILE_SUBTOPIC}/{source_name()}"
+
+    def run_profile(mqttc, seconds, interval):
+        try:
+            # the interval is only set if this request gets the sampler
+            _profiler.start(interval)
+        except RuntimeError:
+            warnings.warn("Ignoring profile request, a profile is already running.")
+            return
+        time.sleep(seconds)
+        _profiler.stop()
+        stacks = _profiler.collapsed()
+        save_profile(stacks, directory)
+        mqttc.publish(profile_topic, stacks, qos=1)
+
+    def on_connect(mqttc, obj, flags, rc):
+        mqttc.subscribe(control_topic, qos=1)
+
+    def on_message(mqttc, obj, msg):
+        # an error here would stop the network thread, so bad requests are ignored
+        try:
+            request = json.loads(msg.payload) if len(msg.payload) > 0 else {}
+            if not isinstance(request, dict):
+                raise ValueError("Expected a JSON object.")
+            seconds = float(request.get("seconds", 10))
+            interval = float(request.get("interval", sampler.DEFAULT_INTERVAL))
+            if (seconds < 0) or (interval <= 0):
+                raise ValueError("Seconds and interval must be positive.")
+        except (ValueError, TypeError) as e:
+            warnings.warn(f"Ignoring invalid profile request {msg.payload!r}: {e}")
+            return
+        # sample from another thread so the network thread is seen too
+        threading.Thread(
+            target=run_profile,
+            args=(mqttc, seconds, interval),
+            name="profile",
+            daemon=True,
+        ).start()
+
+    # experiment threads may all start listening at once
+    with _control_lock:
+        if _control_client is not None:
+            return
+        mqttc = mqtt.Client()
+        mqttc.on_connect = on_connect
+        mqttc.on_message = on_message
+        mqttc.connect(host, port)
+        mqttc.loop_start()
+        _control_client = mqttc
+
+
 # experiment worker threads
 def producer(args):
     """Simulate an experiment in a dedicated thread.
@@ -396,21 +777,190 @@ def producer(args):
             mqttdh.idn = f"dev{i}"
             exp(n, mqttdh.handle_data)
             time.sleep(5)
-            d = {"clear": True, "id": f"{mqttdh.idn}"}
-            d = json.dumps(d)
-            mqttdh.append_payload(d)
+            mqttdh.append_clear()
             i += 1
-        while mqttdh.q_size > 0:
-            time.sleep(1)
+        mqttdh.flush()
     mqttdh.end_q()
     mqttdh.disconnect()
 
 
+# experiment functions indexed by experiment type - 1
+EXPERIMENTS = [exp_1, exp_2, exp_3, exp_4, exp_5]
+
+# ways of running several experiments
+RUN_MODES = ("serial", "threads", "processes")
+
+
+def get_handlers(engine="thread"):
+    """Get the data handler classes for a publisher engine.
+
+    Parameters
+    ----------
+    engine : {"thread", "asyncio"}
+        Run publishers in their own threads or on one asyncio event loop.
+
+    Returns
+    -------
+    handlers : list
+        Data handler classes indexed by experiment type - 1.
+    """
+    if engine == "asyncio":
+        import aiopublisher
+
+        return [
+            aiopublisher.AsyncVoltageDataHandler,
+            aiopublisher.AsyncIVDataHandler,
+            aiopublisher.AsyncMPPTDataHandler,
+            aiopublisher.AsyncCurrentDataHandler,
+            aiopublisher.AsyncEQEDataHandler,
+        ]
+    else:
+        return [
+            VoltageDataHandler,
+            IVDataHandler,
+            MPPTDataHandler,
+            CurrentDataHandler,
+            EQEDataHandler,
+        ]
+
+
+def run_experiment(
+    e,
+    n,
+    m,
+    host,
+    topic,
+    engine="thread",
+    port=1883,
+    metrics_interval=METRICS_INTERVAL,
+    profile_dir=None,
+    **kwargs,
+):
+    """Run an experiment and publish its data.
+
+    Settings are passed as arguments rather than read from module globals, which
+    worker processes don't inherit.
+
+    Parameters
+    ----------
+    e : int
+        Experiment type from range 1-5.
+    n : int
+        Number of data points.
+    m : int
+        Number of repeats.
+    host : str
+        MQTT broker address.
+    topic : str
+        Base topic. Data is published to the experiment's subtopic.
+    engine : {"thread", "asyncio"}
+        Publisher engine.
+    port : int
+        MQTT broker port.
+    metrics_interval : float
+        Time in seconds between publishing metrics to the plotter, 0 to disable.
+    profile_dir : str or None
+        Directory to save profiles in. If None, use `PROFILE_DIR`.
+    **kwargs
+        Keyword arguments passed to the data handler.
+    """
+    start_metrics_export(host, topic, port, metrics_interval)
+    start_profile_control(host, topic, port, profile_dir)
+    mqttdh = get_handlers(engine)[e - 1](**kwargs)
+    mqttdh.connect(host, port)
+    mqttdh.start_q(f"{topic}/exp{e}")
+    producer((n, m, EXPERIMENTS[e - 1], mqttdh))
+
+
+def run_experiments(
+    es,
+    n,
+    m,
+    host,
+    topic,
+    mode="serial",
+    engine="thread",
+    port=1883,
+    metrics_interval=METRICS_INTERVAL,
+    profile_dir=None,
+    **kwargs,
+):
+    """Run several experiments in one process.
+
+    With "threads", the experiments run concurrently in worker threads and their
+    handlers share one broker connection. With "processes", each experiment runs in
+    a worker process with its own connection, for experiments that are CPU bound.
+
+    Parameters
+    ----------
+    es : list of int
+        Experiment types from range 1-5.
+    n : int
+        Number of data points.
+    m : int
+        Number of repeats.
+    host : str
+        MQTT broker address.
+    topic : str
+        Base topic.
+    mode : {"serial", "threads", "processes"}
+        Run the experiments one after another, in threads, or in a process pool.
+    engine : {"thread", "asyncio"}
+        Publisher engine.
+    port : int
+        MQTT broker port.
+    metrics_interval : float
+        Time in seconds between publishing metrics to the plotter, 0 to disable.
+    profile_dir : str or None
+        Directory to save profiles in. If None, use `PROFILE_DIR`.
+    **kwargs
+        Keyword arguments passed to the data handlers.
+    """
+    for e in es:
+        if (e < 1) or (e > 5):
+            raise ValueError(f"Invalid experiment type: {e}. Must be in range 1-5.")
+    if mode not in RUN_MODES:
+        raise ValueError(f"Invalid run mode: {mode}. Must be in {RUN_MODES}.")
+
+    kwargs.update(metrics_interval=metrics_interval, profile_dir=profile_dir)
+    if mode == "serial":
+        for e in es:
+            run_experiment(e, n, m, host, topic, engine, port, **kwargs)
+        return
+
+    if mode == "threads":
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(es))
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=len(es))
+    with executor:
+        futures = [
+            executor.submit(
+                run_experiment, e, n, m, host, topic, engine, port, **kwargs
+            )
+            for e in es
+        ]
+        # raise the first error from a worker
+        for future in futures:
+            future.result()
+
+
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-t", metavar="t", type=str, default="data", help="Topic.")
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=MQTTHOST,
+        help="MQTT broker address. Defaults to the MQTTHOST environment variable.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=MQTTPORT,
+        help="MQTT broker port. Defaults to the MQTTPORT environment variable.",
+    )
     parser.add_argument(
         "-n", metavar="n", type=int, default=30, help="Number of points."
     )
@@ -421,39 +971,136 @@ if __name__ == "__main__":
         "-e",
         metavar="e",
         type=int,
-        default=1,
+        default=[1],
         nargs="+",
         help="Experiment type(s) from range 1-5.",
     )
+    parser.add_argument(
+        "--qos",
+        type=int,
+        default=2,
+        choices=[0, 1, 2],
+        help="MQTT quality of service level.",
+    )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=20,
+        help="Maximum number of unacknowledged messages per handler.",
+    )
+    parser.add_argument(
+        "--batch", action="store_true", help="Publish data points in batch frames."
+    )
+    parser.add_argument(
+        "--batch-count", type=int, default=100, help="Maximum points per frame."
+    )
+    parser.add_argument(
+        "--batch-bytes", type=int, default=65536, help="Maximum bytes per frame."
+    )
+    parser.add_argument(
+        "--batch-latency",
+        type=float,
+        default=0.1,
+        help="Maximum time (s) a point waits to be published.",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="auto",
+        choices=["auto", "json", "binary"],
+        help="Wire format. 'auto' uses binary if the plotter advertises it.",
+    )
+    parser.add_argument(
+        "--maxsize", type=int, default=None, help="Maximum queued payloads per handler."
+    )
+    parser.add_argument(
+        "--maxbytes", type=int, default=None, help="Maximum queued bytes per handler."
+    )
+    parser.add_argument(
+        "--policy",
+        type=str,
+        default="block",
+        choices=["block", "drop_oldest", "drop_newest", "conflate"],
+        help="What to do when a handler's queue is full.",
+    )
+    parser.add_argument(
+        "--run",
+        type=str,
+        default="serial",
+        choices=list(RUN_MODES),
+        help="Run experiments one after another, concurrently in threads, or in a process pool.",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=METRICS_INTERVAL,
+        help="Time (s) between publishing metrics to the plotter, 0 to disable.",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        type=str,
+        default=PROFILE_DIR,
+        help="Directory to save profiles in.",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="thread",
+        choices=["thread", "asyncio"],
+        help="Run publishers in their own threads or on one asyncio event loop.",
+    )
     args = parser.parse_args()
 
     topic = args.t
-    print(f"Publishing to mqtt://{MQTTHOST}/{topic}")
+    print(f"Publishing to mqtt://{args.host}:{args.port}/{topic}")
     print("Use Ctrl-C to abort.")
 
-    subtopics = []
-    subtopics.append(f"{topic}/exp1")
-    subtopics.append(f"{topic}/exp2")
-    subtopics.append(f"{topic}/exp3")
-    subtopics.append(f"{topic}/exp4")
-    subtopics.append(f"{topic}/exp5")
+    # profile the running producer with kill -USR1 <pid>, where available
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(
+            signal.SIGUSR1,
+            functools.partial(toggle_profile, directory=args.profile_dir),
+        )
+        print(f"Send SIGUSR1 to process {os.getpid()} to start or stop profiling.")
 
     print(args)
 
-    vdh = VoltageDataHandler()
-    idh = IVDataHandler()
-    mdh = MPPTDataHandler()
-    cdh = CurrentDataHandler()
-    edh = EQEDataHandler()
-
-    dhs = [vdh, idh, mdh, cdh, edh]
-    exps = [exp_1, exp_2, exp_3, exp_4, exp_5]
-
-    # simulate experiments in series
-    for i in args.e:
-        if (i > 0) & (i < 6):
-            dhs[i - 1].connect(MQTTHOST)
-            dhs[i - 1].start_q(subtopics[i - 1])
-            producer((args.n, args.m, exps[i - 1], dhs[i - 1]))
-        else:
-            raise ValueError(f"Invalid experiment type: {i}. Must be in range 1-5.")
+    if args.format == "auto":
+        wire_format = negotiate_format(args.host, topic, port=args.port)
+    else:
+        wire_format = args.format
+    print(f"Using {wire_format} wire format")
+
+    kwargs = {
+        "qos": args.qos,
+        "max_inflight": args.max_inflight,
+        "batch": args.batch,
+        "batch_max_count": args.batch_count,
+        "batch_max_bytes": args.batch_bytes,
+        "batch_max_latency": args.batch_latency,
+        "wire_format": wire_format,
+        "maxsize": args.maxsize,
+        "maxbytes": args.maxbytes,
+        "policy": args.policy,
+    }
+    if args.engine == "asyncio":
+        # batching is only implemented by the threaded publisher
+        for key in ["batch", "batch_max_count", "batch_max_bytes", "batch_max_latency"]:
+            kwargs.pop(key)
+
+    try:
+        run_experiments(
+            args.e,
+            args.n,
+            args.m,
+            args.host,
+            topic,
+            args.run,
+            args.engine,
+            args.port,
+            args.metrics_interval,
+            args.profile_dir,
+            **kwargs,
+        )
+    finally:
+        stop_metrics_export()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Profile the time taken to import a module, e.g. the plotter at startup."""
+
+import os
+import subprocess
+import sys
+
+
+def import_times(module):
+    """Measure the import time of a module and everything it imports.
+
+    The module is imported in a fresh interpreter with Python's -X importtime option,
+    from the directory of this script.
+
+    Parameters
+    ----------
+    module : str
+        Name of the module to import.
+
+    Returns
+    -------
+    times : list of tuple
+        (module name, self time in s, cumulative time in s) for each imported module,
+        in import order.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # column headings
+            continue
+        times.append((fields[2].strip(), self_us / 1e6, cumulative_us / 1e6))
+    return times
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-m", metavar="m", type=str, default="plotter", help="Module to profile."
+    )
+    parser.add_argument(
+        "-n", metavar="n", type=int, default=20, help="Number of modules to show."
+    )
+    parser.add_argument(
+        "--sort",
+        type=str,
+        default="cumulative",
+        choices=["cumulative", "self"],
+        help="Order modules by time including or excluding their imports.",
+    )
+    args = parser.parse_args()
+
+    times = import_times(args.m)
+    total = times[-1][2]
+    column = 2 if args.sort == "cumulative" else 1
+    print(f"import {args.m}: {total:.3f} s, {len(times)} modules")
+    print(f"{'self (s)':>10} {'cumulative (s)':>15}  module")
+    for name, self_s, cumulative_s in sorted(times, key=lambda t: -t[column])[: args.n]:
+        print(f"{self_s:>10.3f} {cumulative_s:>15.3f}  {name}")
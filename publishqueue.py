@@ -0,0 +1,248 @@
+"""Bounded queue of payloads waiting to be published."""
+
+import collections
+import queue
+import threading
+
+import metrics
+
+# what to do with a new payload when the queue is full
+POLICIES = ("block", "drop_oldest", "drop_newest", "conflate")
+
+# metrics of queue publishers, shared by the thread and asyncio engines
+QUEUE_DEPTH = metrics.Gauge(
+    "producer_queue_depth", "Payloads waiting to be published.", ["topic"]
+)
+DROPPED = metrics.Counter(
+    "producer_payloads_dropped", "Payloads discarded by a full queue.", ["topic"]
+)
+CONFLATED = metrics.Counter(
+    "producer_payloads_conflated", "Payloads replaced in a full queue.", ["topic"]
+)
+PUBLISHED = metrics.Counter(
+    "producer_payloads_published", "Payloads published and acknowledged.", ["topic"]
+)
+FAILED = metrics.Counter(
+    "producer_payloads_failed", "Payloads that couldn't be published.", ["topic"]
+)
+PUBLISHED_BYTES = metrics.Counter(
+    "producer_published_bytes", "Size of published messages.", ["topic"]
+)
+PUBLISH_SECONDS = metrics.Histogram(
+    "producer_publish_seconds",
+    "Time from publishing a message to its acknowledgement.",
+    ["topic"],
+)
+
+
+class PublishQueue:
+    """Thread-safe FIFO queue whose consumers sleep until data arrives.
+
+    Unlike polling a deque, a consumer blocked in `get` uses no CPU while the queue
+    is empty. Producers can wait for everything they have queued to be processed with
+    `flush`.
+
+    The queue can be bounded by number of items (`maxsize`) and total payload size
+    (`maxbytes`) so memory stays bounded if the broker is slow or unreachable. When a
+    new item doesn't fit, `policy` decides what happens:
+
+    - "block": wait until the consumer has made room.
+    - "drop_oldest": discard the oldest droppable items to make room.
+    - "drop_newest": discard the new item.
+    - "conflate": replace the newest queued item with the same key, so only the latest
+      value of each stream is kept. If there is none, the oldest droppable items are
+      discarded.
+
+    Items put with `droppable` False, such as requests to clear data, are never
+    discarded and are always accepted.
+    """
+
+    def __init__(self, maxsize=None, maxbytes=None, policy="block"):
+        """Construct queue.
+
+        Parameters
+        ----------
+        maxsize : int or None
+            Maximum number of items. If None, the number of items isn't limited.
+        maxbytes : int or None
+            Maximum total length of the items. If None, the size isn't limited.
+        policy : str
+            Overflow policy, one of `POLICIES`.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid overflow policy: {policy}. Must be in {POLICIES}.")
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.policy = policy
+        self.dropped = 0
+        self.conflated = 0
+        # entries are [item, key, size, droppable] lists so they can be conflated
+        self._items = collections.deque()
+        self._latest = {}
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self._unfinished = 0
+
+    def __len__(self):
+        """Get number of items waiting in the queue."""
+        return len(self._items)
+
+    @property
+    def nbytes(self):
+        """Get total length of the items waiting in the queue."""
+        return self._bytes
+
+    def put(self, item, front=False, key=None, droppable=True):
+        """Add an item to the queue and wake a consumer.
+
+        Parameters
+        ----------
+        item : obj
+            Item to add.
+        front : bool
+            If True, add the item to the front of the queue so it is consumed next.
+        key : hashable
+            Stream the item belongs to, used by the "conflate" policy.
+        droppable : bool
+            If False, the item is never discarded to bound the queue.
+
+        Returns
+        -------
+        queued : bool
+            False if the item was discarded by the "drop_newest" policy.
+        """
+        size = len(item) if droppable is True else 0
+        with self._cond:
+            if (droppable is True) and not self._fits(size):
+                if self.policy == "block":
+                    self._cond.wait_for(lambda: self._fits(size))
+                elif self.policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                elif (self.policy == "conflate") and self._replaces(key, size):
+                    entry = self._latest[key]
+                    self._bytes += size - entry[2]
+                    entry[0] = item
+                    entry[2] = size
+                    self.conflated += 1
+                    return True
+                else:
+                    self._drop_oldest(size)
+
+            entry = [item, key, size, droppable]
+            if front is True:
+                self._items.appendleft(entry)
+            else:
+                self._items.append(entry)
+                if key is None:
+                    pass
+                elif droppable is True:
+                    self._latest[key] = entry
+                else:
+                    # later items mustn't be conflated into one before this item,
+                    # e.g. data sent after a clear
+                    self._latest.pop(key, None)
+            self._bytes += size
+            self._unfinished += 1
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """Remove and return the next item, blocking until one is available.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait in seconds. If None, wait indefinitely.
+
+        Returns
+        -------
+        item : obj
+            Next item in the queue.
+
+        Raises
+        ------
+        queue.Empty
+            If no item became available within `timeout`.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._items) > 0, timeout):
+                raise queue.Empty
+            entry = self._items.popleft()
+            self._forget(entry)
+            self._cond.notify_all()
+            return entry[0]
+
+    def task_done(self):
+        """Indicate that a previously retrieved item has been fully processed."""
+        with self._cond:
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until every item put on the queue has been processed.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait in seconds. If None, wait indefinitely.
+
+        Returns
+        -------
+        flushed : bool
+            True if the queue was drained, False if the timeout expired first.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def _fits(self, size, kept=0):
+        """Check whether an item of length `size` fits in the queue.
+
+        `kept` items taken out of the queue but going back in are counted too. Must
+        be called with the lock held. An empty queue accepts any item.
+        """
+        n = len(self._items) + kept
+        if n == 0:
+            return True
+        if (self.maxsize is not None) and (n >= self.maxsize):
+            return False
+        if (self.maxbytes is not None) and (self._bytes + size > self.maxbytes):
+            return False
+        return True
+
+    def _replaces(self, key, size):
+        """Check whether an item of length `size` can replace the latest of `key`.
+
+        Must be called with the lock held.
+        """
+        if key not in self._latest:
+            return False
+        if self.maxbytes is None:
+            return True
+        return self._bytes - self._latest[key][2] + size <= self.maxbytes
+
+    def _forget(self, entry):
+        """Stop tracking an entry removed from the queue.
+
+        Must be called with the lock held.
+        """
+        self._bytes -= entry[2]
+        if self._latest.get(entry[1]) is entry:
+            del self._latest[entry[1]]
+
+    def _drop_oldest(self, size):
+        """Discard the oldest droppable items until an item of length `size` fits.
+
+        Must be called with the lock held.
+        """
+        kept = collections.deque()
+        while (len(self._items) > 0) and not self._fits(size, len(kept)):
+            entry = self._items.popleft()
+            if entry[3] is True:
+                self._forget(entry)
+                self._unfinished -= 1
+                self.dropped += 1
+            else:
+                kept.append(entry)
+        self._items.extendleft(reversed(kept))
+        self._cond.notify_all()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+"""Append-only recording of data streams to disk.
+
+Every row the plotter ingests can be recorded so history survives clears and
+restarts without being held in memory. Data are grouped into runs, keyed by stream,
+device id, and run number. A run starts with the first rows from a device after a
+clear and ends at the next clear.
+
+Each run is stored in its own directory as a sequence of fixed size segment files.
+A segment is a .npy file holding an array of shape (columns, `segment_rows`), so it
+is columnar: each column is contiguous on disk. Rows are written into a segment
+through a memory map and are never modified afterwards. A new segment is started
+when one fills up:
+
+    root/
+        exp1/dev0/000001/run.json
+        exp1/dev0/000001/000000.npy
+        exp1/dev0/000001/000001.npy
+        exp1/dev0/000002/run.json
+        exp1/dev0/000002/000000.npy
+
+The index entry of a run in its run.json holds its number of columns, start and stop
+time, and the number of rows in each segment. Only the entries of runs being
+recorded are kept in memory. Each is rewritten atomically when the run starts a
+segment or ends, when the recorder is closed, and otherwise at most every
+`flush_interval` seconds, so after a crash only the rows recorded since the last
+write of the entry are lost. Run directories and segment files are never reused, so
+a crash can't cause recorded data to be overwritten.
+
+Runs are read back as read-only memory maps, so reading history doesn't use heap
+memory:
+
+    for run in load_index("data"):
+        rows = read_run("data", run)
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+# index entry of a run, in the run's directory
+RUN_FILE = "run.json"
+
+# rows per segment file, 512 KiB per column
+SEGMENT_ROWS = 65536
+
+# longest time in seconds between writes of the index
+FLUSH_INTERVAL = 5.0
+
+
+def _quote(name):
+    """Make a stream name or device id safe to use as a directory name."""
+    return urllib.parse.quote(name, safe="") or "_"
+
+
+def _run_directory(stream, idn, number):
+    """Get the directory of a run relative to the recording directory."""
+    return os.path.join(_quote(stream), _quote(idn), f"{number:06d}")
+
+
+def _write_entry(root, entry):
+    """Atomically write the index entry of a run to its directory."""
+    path = os.path.join(
+        root, _run_directory(entry["stream"], entry["id"], entry["run"]), RUN_FILE
+    )
+    with open(path + ".tmp", "w") as f:
+        json.dump(entry, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def load_index(root, stream=None, idn=None):
+    """Get the runs recorded in a directory.
+
+    Parameters
+    ----------
+    root : str
+        Recording directory.
+    stream : str or None
+        Only get runs of this stream. If None, get runs of all streams.
+    idn : str or None
+        Only get runs of this device. If None, get runs of all devices.
+
+    Returns
+    -------
+    runs : list of dict
+        Index entry of each run, in the order they started, with its "stream", "id",
+        "run" number, number of columns "ncols", total "rows", "start" and "stop"
+        time, whether it's "closed", and "segments", a list of dicts with the "file"
+        path relative to `root` and number of "rows" of each segment.
+    """
+    pattern = os.path.join(
+        glob.escape(root),
+        "*" if stream is None else _quote(stream),
+        "*" if idn is None else _quote(idn),
+        "*",
+        RUN_FILE,
+    )
+    runs = []
+    for path in glob.glob(pattern):
+        with open(path) as f:
+            runs.append(json.load(f))
+    runs.sort(key=lambda entry: (entry["start"], entry["run"]))
+    return runs
+
+
+def read_segments(root, run):
+    """Read the segments of a run as memory maps.
+
+    Parameters
+    ----------
+    root : str
+        Recording directory.
+    run : dict
+        Index entry of the run.
+
+    Yields
+    ------
+    rows : array
+        Read-only memory mapped array of shape (rows, columns) for each segment. It
+        is a transposed view, so each column is contiguous.
+    """
+    for segment in run["segments"]:
+        data = np.load(os.path.join(root, segment["file"]), mmap_mode="r")
+        yield data[:, : segment["rows"]].T
+
+
+def read_run(root, run):
+    """Read all rows of a run.
+
+    Parameters
+    ----------
+    root : str
+        Recording directory.
+    run : dict
+        Index entry of the run.
+
+    Returns
+    -------
+    rows : array
+        Array of shape (rows, columns). It's a read-only memory map if the run fits
+        in a single segment, otherwise the segments are copied into a new array.
+    """
+    segments = list(read_segments(root, run))
+    if len(segments) == 0:
+        return np.empty((0, run["ncols"]))
+    elif len(segments) == 1:
+        return segments[0]
+    else:
+        return np.concatenate(segments)
+
+
+class _Writer:
+    """Run being recorded."""
+
+    def __init__(self, entry, directory):
+        self.entry = entry
+        self.directory = directory
+        self.segment = None
+        self.filled = 0
+
+
+class Recorder:
+    """Record rows from data streams in runs of append-only segment files."""
+
+    def __init__(self, root, segment_rows=SEGMENT_ROWS, flush_interval=FLUSH_INTERVAL):
+        """Construct recorder.
+
+        Runs already in the directory are kept, and closed. New runs are numbered
+        after them, skipping the directories of runs whose index entry wasn't
+        written.
+
+        Parameters
+        ----------
+        root : str
+            Recording directory. It's created if it doesn't exist.
+        segment_rows : int
+            Number of rows in each segment file.
+        flush_interval : float
+            Longest time in seconds between writes of the index.
+        """
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.segment_rows = segment_rows
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # last run number of each (stream, device)
+        self._numbers = {}
+        for entry in load_index(root):
+            if entry["closed"] is False:
+                entry["closed"] = True
+                _write_entry(root, entry)
+            key = (entry["stream"], entry["id"])
+            self._numbers[key] = max(self._numbers.get(key, 0), entry["run"])
+        # runs being recorded
+        self._writers = {}
+        self._flushed = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, stream, idn, rows):
+        """Append rows to the current run of a device.
+
+        Parameters
+        ----------
+        stream : str
+            Stream name.
+        idn : str
+            Device id.
+        rows : array
+            Array of shape (n, columns). If the number of columns differs from the
+            current run's, a new run is started.
+        """
+        rows = np.asarray(rows, dtype=float)
+        n = len(rows)
+        if n == 0:
+            return
+        rows = rows.reshape(n, -1)
+        with self._lock:
+            writer = self._writers.get((stream, idn))
+            if (writer is not None) and (writer.entry["ncols"] != rows.shape[1]):
+                self._end_run(stream, idn)
+                writer = None
+            if writer is None:
+                writer = self._start_run(stream, idn, rows.shape[1])
+            entry = writer.entry
+            i = 0
+            while i < n:
+                if (writer.segment is None) or (writer.filled == self.segment_rows):
+                    self._start_segment(writer)
+                k = min(n - i, self.segment_rows - writer.filled)
+                writer.segment[:, writer.filled : writer.filled + k] = rows[i : i + k].T
+                writer.filled += k
+                entry["segments"][-1]["rows"] = writer.filled
+                i += k
+            entry["rows"] += n
+            entry["stop"] = time.time()
+            self._maybe_flush()
+
+    def clear(self, stream, idn):
+        """End the current run of a device.
+
+        Parameters
+        ----------
+        stream : str
+            Stream name.
+        idn : str
+            Device id.
+        """
+        with self._lock:
+            self._end_run(stream, idn)
+            self._maybe_flush()
+
+    def runs(self, stream=None, idn=None):
+        """Get the index entries of recorded runs.
+
+        Parameters
+        ----------
+        stream : str or None
+            Only get runs of this stream. If None, get runs of all streams.
+        idn : str or None
+            Only get runs of this device. If None, get runs of all devices.
+
+        Returns
+        -------
+        runs : list of dict
+            Index entries, see `load_index`.
+        """
+        with self._lock:
+            self._flush()
+            return load_index(self.root, stream, idn)
+
+    def read(self, stream, idn, run=None):
+        """Read all rows of a run, see `read_run`.
+
+        Parameters
+        ----------
+        stream : str
+            Stream name.
+        idn : str
+            Device id.
+        run : int or None
+            Run number. If None, read the latest run.
+
+        Returns
+        -------
+        rows : array
+            Array of shape (rows, columns).
+        """
+        runs = self.runs(stream, idn)
+        if run is not None:
+            runs = [entry for entry in runs if entry["run"] == run]
+        if len(runs) == 0:
+            raise KeyError(f"No run {run} recorded for {stream} from {idn}.")
+        return read_run(self.root, max(runs, key=lambda entry: entry["run"]))
+
+    def flush(self):
+        """Write recorded rows and the index entries of current runs to disk."""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """End all runs and write their index entries."""
+        with self._lock:
+            for stream, idn in list(self._writers):
+                self._end_run(stream, idn)
+            self._flush()
+
+    def _start_run(self, stream, idn, ncols):
+        """Start a new run of a device.
+
+        Must be called with the lock held.
+        """
+        number = self._numbers.get((stream, idn), 0)
+        while True:
+            number += 1
+            directory = _run_directory(stream, idn, number)
+            try:
+                os.makedirs(os.path.join(self.root, directory))
+                break
+            except FileExistsError:
+                # left by a run whose index entry wasn't written before a crash
+                continue
+        self._numbers[(stream, idn)] = number
+        now = time.time()
+        entry = {
+            "stream": stream,
+            "id": idn,
+            "run": number,
+            "ncols": ncols,
+            "rows": 0,
+            "start": now,
+            "stop": now,
+            "closed": False,
+            "segments": [],
+        }
+        writer = self._writers[(stream, idn)] = _Writer(entry, directory)
+        return writer
+
+    def _start_segment(self, writer):
+        """Start a new segment file for a run.
+
+        Must be called with the lock held.
+        """
+        entry = writer.entry
+        if writer.segment is not None:
+            writer.segment.flush()
+        path = os.path.join(writer.directory, f"{len(entry['segments']):06d}.npy")
+        # create the file exclusively so recorded data are never overwritten
+        open(os.path.join(self.root, path), "xb").close()
+        writer.segment = np.lib.format.open_memmap(
+            os.path.join(self.root, path),
+            mode="w+",
+            dtype="<f8",
+            shape=(entry["ncols"], self.segment_rows),
+        )
+        writer.filled = 0
+        entry["segments"].append({"file": path, "rows": 0})
+        if len(entry["segments"]) > 1:
+            # the previous segment is full
+            _write_entry(self.root, entry)
+
+    def _end_run(self, stream, idn):
+        """End the current run of a device.
+
+        Must be called with the lock held.
+
+        Returns
+        -------
+        ended : bool
+            False if the device had no current run.
+        """
+        writer = self._writers.pop((stream, idn), None)
+        if writer is None:
+            return False
+        if writer.segment is not None:
+            writer.segment.flush()
+        writer.entry["closed"] = True
+        _write_entry(self.root, writer.entry)
+        return True
+
+    def _maybe_flush(self):
+        """Write the index entries if they haven't been written for `flush_interval`.
+
+        Must be called with the lock held.
+        """
+        if time.monotonic() - self._flushed > self.flush_interval:
+            self._flush()
+
+    def _flush(self):
+        """Write recorded rows and the index entries of current runs to disk.
+
+        Must be called with the lock held.
+        """
+        for writer in self._writers.values():
+            if writer.segment is not None:
+                writer.segment.flush()
+                _write_entry(self.root, writer.entry)
+        self._flushed = time.monotonic()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", type=str, help="Recording directory.")
+    parser.add_argument(
+        "-s", metavar="s", type=str, default=None, help="Only list runs of a stream."
+    )
+    parser.add_argument(
+        "-i", metavar="i", type=str, default=None, help="Only list runs of a device."
+    )
+    args = parser.parse_args()
+
+    print(f"{'stream':<10}{'id':<12}{'run':>6}{'rows':>12}{'cols':>6}  start")
+    for run in load_index(args.root):
+        if ((args.s is not None) and (run["stream"] != args.s)) or (
+            (args.i is not None) and (run["id"] != args.i)
+        ):
+            continue
+        start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["start"]))
+        print(
+            f"{run['stream']:<10}{run['id']:<12}{run['run']:>6}{run['rows']:>12}"
+            + f"{run['ncols']:>6}  {start}"
+        )
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+"""Capture MQTT sessions and replay them to load test the plotter.
+
+A session is every payload published to the data subtopics of a plotter's topic,
+with the time it was received. Capture a session from a real experiment once:
+
+    python replay.py capture session.mqs -t data --duration 600
+
+then replay it against a plotter as often as needed, at the recorded pace, N times
+faster, or as fast as possible:
+
+    python replay.py play session.mqs -t data --speed 10
+
+Payloads are republished unchanged through MQTTQueuePublisher, one per subtopic, so
+batch frames and the mix of streams keep the shape of the real traffic. While
+replaying, the achieved publish rate and the plotter's ingest lag are reported. The
+lag is the number of published messages the plotter hasn't ingested yet, taken from
+the plotter_messages counter on the plotter's /metrics page, so other producers
+shouldn't publish to the topic during a replay. Payloads keep their original
+acquisition times, so the plotter's latency metrics aren't meaningful for replayed
+data.
+
+Session files start with `MAGIC`, followed by a record for each message: a header
+packed as `_RECORD` with the receive time, topic length, and payload length, then
+the topic relative to the base topic, then the payload.
+"""
+
+import struct
+import threading
+import time
+import urllib.request
+
+import paho.mqtt.client as mqtt
+
+from producer import MQTTHOST, MQTTPORT, PUBLISHED, MQTTQueuePublisher
+
+MAGIC = b"MQS1"
+_RECORD = struct.Struct("<dHI")
+
+# subtopics holding experiment data
+DATA_SUBTOPICS = ["exp1", "exp2", "exp3", "exp4", "exp5"]
+
+# plotter metrics page, used to measure ingest lag
+METRICS_URL = "http://127.0.0.1:8050/metrics"
+
+
+def write_record(f, t, subtopic, payload):
+    """Write a message to a session file.
+
+    Parameters
+    ----------
+    f : file
+        Session file opened for binary writing.
+    t : float
+        Time the message was received.
+    subtopic : str
+        Topic relative to the base topic.
+    payload : bytes
+        Message payload.
+    """
+    subtopic = subtopic.encode()
+    f.write(_RECORD.pack(t, len(subtopic), len(payload)) + subtopic + payload)
+
+
+def read_session(path):
+    """Read the messages in a session file.
+
+    Parameters
+    ----------
+    path : str
+        Session file.
+
+    Yields
+    ------
+    t : float
+        Time the message was received.
+    subtopic : str
+        Topic relative to the base topic.
+    payload : bytes
+        Message payload.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} isn't a session file.")
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                # end of file, or a record cut short when capture was stopped
+                return
+            t, topic_length, payload_length = _RECORD.unpack(header)
+            subtopic = f.read(topic_length).decode()
+            payload = f.read(payload_length)
+            if len(payload) < payload_length:
+                return
+            yield t, subtopic, payload
+
+
+def capture(path, host, topic, duration, port=1883, subtopics=None):
+    """Capture the messages published to a plotter's topic.
+
+    Parameters
+    ----------
+    path : str
+        Session file to write.
+    host : str
+        MQTT broker address.
+    topic : str
+        Base topic.
+    duration : float
+        Time in seconds to capture for.
+    port : int
+        MQTT broker port.
+    subtopics : list of str or None
+        Subtopics to capture. If None, use `DATA_SUBTOPICS`.
+
+    Returns
+    -------
+    count : int
+        Number of messages captured.
+    """
+    subtopics = DATA_SUBTOPICS if subtopics is None else subtopics
+    lock = threading.Lock()
+    count = 0
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+
+        def on_connect(mqttc, obj, flags, rc):
+            mqttc.subscribe([(f"{topic}/{subtopic}", 2) for subtopic in subtopics])
+
+        def on_message(mqttc, obj, msg):
+            nonlocal count
+            # retained messages were published before the capture started
+            if msg.retain == 1:
+                return
+            with lock:
+                write_record(f, time.time(), msg.topic[len(topic) + 1 :], msg.payload)
+                count += 1
+
+        mqttc = mqtt.Client()
+        mqttc.on_connect = on_connect
+        mqttc.on_message = on_message
+        mqttc.connect(host, port)
+        mqttc.loop_start()
+        try:
+            time.sleep(duration)
+        finally:
+            mqttc.loop_stop()
+            mqttc.disconnect()
+    return count
+
+
+def plotter_messages(url=METRICS_URL):
+    """Get the number of messages the plotter has ingested.
+
+    Parameters
+    ----------
+    url : str
+        Plotter metrics page.
+
+    Returns
+    -------
+    count : float or None
+        Total of the plotter's own plotter_messages counters, or None if the page
+        can't be read.
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            text = response.read().decode()
+    except OSError:
+        return None
+    count = 0.0
+    for line in text.splitlines():
+        # producer metrics exported by the plotter have a source label
+        if line.startswith("plotter_messages_total") and ("source=" not in line):
+            count += float(line.rsplit(" ", 1)[1])
+    return count
+
+
+def replay(
+    path,
+    host,
+    topic,
+    speed=1.0,
+    port=1883,
+    qos=2,
+    interval=1.0,
+    url=METRICS_URL,
+    timeout=30.0,
+):
+    """Republish a captured session and report the rates achieved.
+
+    Parameters
+    ----------
+    path : str
+        Session file.
+    host : str
+        MQTT broker address.
+    topic : str
+        Base topic to publish under.
+    speed : float
+        Replay speed relative to the captured pace. If 0, publish as fast as
+        possible.
+    port : int
+        MQTT broker port.
+    qos : int
+        Quality of service level of published messages.
+    interval : float
+        Time in seconds between reports.
+    url : str or None
+        Plotter metrics page used to measure ingest lag. If None, lag isn't measured.
+    timeout : float
+        Maximum time in seconds to wait for the plotter to catch up at the end.
+
+    Returns
+    -------
+    summary : dict
+        Number of messages "published", the publish "duration" and "rate", and, if
+        the plotter's metrics could be read, the number of messages "ingested", the
+        maximum "lag" in messages, and the time the plotter took to "catch_up"
+        after the last message was published.
+    """
+    publishers = {}
+    counters = []
+
+    def publisher(subtopic):
+        if subtopic not in publishers:
+            # never drop payloads, so the traffic is replayed exactly
+            p = publishers[subtopic] = MQTTQueuePublisher(qos=qos)
+            p.connect(host, port)
+            p.start_q(f"{topic}/{subtopic}")
+            counter = PUBLISHED.labels(p.topic)
+            # the counters are cumulative over every publisher in this process
+            counters.append((counter, counter.get()))
+        return publishers[subtopic]
+
+    def published():
+        return sum(counter.get() - base for counter, base in counters)
+
+    # the plotter's count at the start is the base for counting ingested messages
+    ingested_base = None if url is None else plotter_messages(url)
+    last = {"time": time.monotonic(), "published": 0.0}
+    max_lag = 0.0
+
+    def report(now):
+        nonlocal max_lag
+        count = published()
+        rate = (count - last["published"]) / (now - last["time"])
+        line = f"{now - start:>9.1f}{count:>12.0f}{rate:>12.1f}"
+        if ingested_base is not None:
+            ingested = plotter_messages(url)
+            if ingested is not None:
+                lag = count - (ingested - ingested_base)
+                max_lag = max(max_lag, lag)
+                line += f"{ingested - ingested_base:>12.0f}{lag:>10.0f}"
+        print(line)
+        last.update({"time": now, "published": count})
+
+    print(
+        f"{'time (s)':>9}{'published':>12}{'publish/s':>12}"
+        + (f"{'ingested':>12}{'lag':>10}" if ingested_base is not None else "")
+    )
+    start = time.monotonic()
+    first = None
+    appended = 0
+    for t, subtopic, payload in read_session(path):
+        if first is None:
+            first = t
+        due = start + (t - first) / speed if speed > 0 else 0
+        while True:
+            now = time.monotonic()
+            if now - last["time"] >= interval:
+                report(now)
+            if now >= due:
+                break
+            time.sleep(min(due - now, interval))
+        publisher(subtopic).append_payload(payload)
+        appended += 1
+
+    for p in publishers.values():
+        p.end_q()
+        p.disconnect()
+    stop = time.monotonic()
+    report(stop)
+
+    summary = {
+        "published": published(),
+        "duration": stop - start,
+        "rate": published() / (stop - start) if stop > start else float("nan"),
+    }
+    if ingested_base is not None:
+        # wait for the plotter to ingest everything
+        ingested = ingested_base
+        while time.monotonic() - stop < timeout:
+            ingested = plotter_messages(url) or ingested
+            if ingested - ingested_base >= summary["published"]:
+                break
+            time.sleep(0.05)
+        summary["ingested"] = ingested - ingested_base
+        summary["lag"] = max_lag
+        summary["catch_up"] = time.monotonic() - stop
+    print(
+        f"published {summary['published']:.0f} of {appended} messages in"
+        + f" {summary['duration']:.1f} s ({summary['rate']:.1f}/s)"
+    )
+    if ingested_base is not None:
+        print(
+            f"plotter ingested {summary['ingested']:.0f}, max lag"
+            + f" {summary['lag']:.0f} messages, caught up"
+            + f" {summary['catch_up']:.2f} s after the last publish"
+        )
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    capture_parser = subparsers.add_parser("capture", help="Capture a session.")
+    play_parser = subparsers.add_parser("play", help="Replay a session.")
+    for p in [capture_parser, play_parser]:
+        p.add_argument("path", type=str, help="Session file.")
+        p.add_argument("-t", metavar="t", type=str, default="data", help="Topic.")
+        p.add_argument(
+            "--host",
+            type=str,
+            default=MQTTHOST,
+            help="MQTT broker address. Defaults to the MQTTHOST environment variable.",
+        )
+        p.add_argument(
+            "--port",
+            type=int,
+            default=MQTTPORT,
+            help="MQTT broker port. Defaults to the MQTTPORT environment variable.",
+        )
+    capture_parser.add_argument(
+        "--duration", type=float, default=60, help="Time (s) to capture for."
+    )
+    play_parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Replay speed relative to the captured pace, 0 for as fast as possible.",
+    )
+    play_parser.add_argument(
+        "--qos", type=int, default=2, choices=[0, 1, 2], help="MQTT QoS level."
+    )
+    play_parser.add_argument(
+        "--interval", type=float, default=1.0, help="Time (s) between reports."
+    )
+    play_parser.add_argument(
+        "--metrics-url",
+        type=str,
+        default=METRICS_URL,
+        help="Plotter metrics page used to measure ingest lag.",
+    )
+    play_parser.add_argument(
+        "--no-lag", action="store_true", help="Don't measure the plotter's ingest lag."
+    )
+    args = parser.parse_args()
+
+    if args.command == "capture":
+        print(f"Capturing mqtt://{args.host}:{args.port}/{args.t} to {args.path}")
+        n = capture(args.path, args.host, args.t, args.duration, args.port)
+        print(f"Captured {n} messages")
+    else:
+        print(f"Replaying {args.path} to mqtt://{args.host}:{args.port}/{args.t}")
+        replay(
+            args.path,
+            args.host,
+            args.t,
+            args.speed,
+            args.port,
+            args.qos,
+            args.interval,
+            None if args.no_lag else args.metrics_url,
+        )
@@ -0,0 +1,140 @@
+"""Sampling profiler for a running process.
+
+A background thread periodically records the stack of every other thread in the
+process with `sys._current_frames`. Unlike cProfile it doesn't slow down the code
+being profiled, it sees threads that were already running when it started, such as
+MQTT network threads and Dash callback threads, and it can be started and stopped
+while the process is running:
+
+    sampler = Sampler()
+    sampler.start()
+    ...
+    sampler.stop()
+    print(sampler.collapsed())
+
+Stacks are reported in the collapsed format read by flamegraph.pl, speedscope, and
+similar tools: one line per unique stack, with the thread name as the root frame,
+frames separated by semicolons, and the number of samples at the end.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+# time in seconds between samples
+DEFAULT_INTERVAL = 0.005
+
+
+def _frame_name(frame):
+    """Format a frame as function (file:line)."""
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Sample the stacks of all threads in this process."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        """Construct sampler.
+
+        Parameters
+        ----------
+        interval : float
+            Time in seconds between samples.
+        """
+        self.interval = interval
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        """Check whether the sampler is running."""
+        return (self._thread is not None) and self._thread.is_alive()
+
+    def start(self, interval=None):
+        """Start sampling in a daemon thread, discarding previous samples.
+
+        Parameters
+        ----------
+        interval : float or None
+            Time in seconds between samples. If None, keep the current `interval`.
+            It's only changed if the sampler wasn't already running.
+        """
+        with self._lock:
+            if self.running is True:
+                raise RuntimeError("Sampler is already running.")
+            if interval is not None:
+                self.interval = interval
+            self.samples = 0
+            self.stacks = collections.Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._sample, name="sampler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampling thread to finish."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def collapsed(self):
+        """Get the sampled stacks in the collapsed format.
+
+        Returns
+        -------
+        text : str
+            One line per unique stack, most frequent first.
+        """
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n" if len(lines) > 0 else ""
+
+    def _sample(self):
+        """Record stacks until stopped."""
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+def profile(duration, interval=DEFAULT_INTERVAL):
+    """Sample all threads for a while.
+
+    Parameters
+    ----------
+    duration : float
+        Time in seconds to sample for.
+    interval : float
+        Time in seconds between samples.
+
+    Returns
+    -------
+    text : str
+        Sampled stacks in the collapsed format.
+    """
+    sampler = Sampler(interval)
+    sampler.start()
+    try:
+        time.sleep(duration)
+    finally:
+        sampler.stop()
+    return sampler.collapsed()
@@ -0,0 +1,520 @@
+"""Growable and ring-buffered storage for plotted data series."""
+
+import collections
+import threading
+
+import numpy as np
+
+
+class SeriesStore:
+    """Store rows of data for a graph with amortised O(1) appends.
+
+    Rows are written into a preallocated array. When the array fills up it is
+    either doubled in size (unbounded store) or, if `maxlen` is given, the most
+    recent `maxlen` rows are moved into a fresh array so that old rows are evicted
+    (ring buffer). Rows that have already been written are never modified in place,
+    so the views returned by `data` are consistent snapshots that can be read from
+    another thread without copying.
+
+    The store counts the rows appended since it was last cleared, and its
+    `generation` is incremented by every clear, so a reader can ask for just the rows
+    it hasn't seen yet with `since`. Any change to the store increments its
+    `version`, so readers can cheaply check whether there is anything new at all.
+
+    The minimum and maximum of each column are updated as rows are appended, so
+    `bounds` doesn't need to scan the data. They are only recalculated from the stored
+    rows if an evicted row held one of the extremes.
+    """
+
+    def __init__(self, ncols, maxlen=None, capacity=1024):
+        """Construct series store.
+
+        Parameters
+        ----------
+        ncols : int
+            Number of columns in each row.
+        maxlen : int or None
+            Maximum number of rows to keep. If None, the store grows without bound.
+        capacity : int
+            Initial number of rows to allocate.
+        """
+        self.ncols = ncols
+        self.maxlen = maxlen
+        if maxlen is not None:
+            # twice the window so eviction only copies once every maxlen rows
+            capacity = 2 * maxlen
+        self._capacity = self._initial_capacity = max(int(capacity), 1)
+        self._lock = threading.Lock()
+        self._buf = np.empty((self._capacity, ncols))
+        self._start = 0
+        self._stop = 0
+        self._appended = 0
+        self.generation = 0
+        self.version = 0
+        self.msg = {"clear": True, "id": "-"}
+        self._reset_bounds()
+
+    def __len__(self):
+        """Get number of stored rows."""
+        return self._stop - self._start
+
+    @property
+    def nbytes(self):
+        """Get size of the allocated buffer in bytes."""
+        return self._buf.nbytes
+
+    @property
+    def data(self):
+        """Get a read-only view of the stored rows."""
+        with self._lock:
+            view = self._buf[self._start : self._stop]
+        view.flags.writeable = False
+        return view
+
+    def append(self, row, msg=None):
+        """Append a single row.
+
+        Parameters
+        ----------
+        row : sequence of float
+            Row of data with `ncols` elements.
+        msg : dict
+            Message the row came from.
+        """
+        self.extend(np.asarray(row, dtype=float).reshape(1, self.ncols), msg)
+
+    def extend(self, rows, msg=None):
+        """Append several rows at once.
+
+        Parameters
+        ----------
+        rows : array
+            Array of shape (n, `ncols`).
+        msg : dict
+            Message the rows came from.
+        """
+        with self._lock:
+            self._extend(rows)
+            if msg is not None:
+                self.msg = msg
+            self.version += 1
+
+    def replace(self, rows, msg=None):
+        """Replace all stored rows.
+
+        Readers never see the store cleared but not yet refilled.
+
+        Parameters
+        ----------
+        rows : array
+            Array of shape (n, `ncols`).
+        msg : dict
+            Message the rows came from.
+        """
+        with self._lock:
+            self._clear()
+            self._extend(rows)
+            if msg is not None:
+                self.msg = msg
+            self.version += 1
+
+    def clear(self, msg=None):
+        """Remove all stored rows.
+
+        Parameters
+        ----------
+        msg : dict
+            Message requesting the clear.
+        """
+        with self._lock:
+            self._clear()
+            if msg is not None:
+                self.msg = msg
+            self.version += 1
+
+    @property
+    def bounds(self):
+        """Get the minimum and maximum of each column of the stored rows.
+
+        Returns
+        -------
+        lo : array
+            Minimum of each column, NaN if there are no rows.
+        hi : array
+            Maximum of each column, NaN if there are no rows.
+        """
+        with self._lock:
+            if self._stale_bounds is True:
+                data = self._buf[self._start : self._stop]
+                self._reset_bounds()
+                if len(data) > 0:
+                    self._lo = np.fmin.reduce(data, axis=0)
+                    self._hi = np.fmax.reduce(data, axis=0)
+            if self._stop == self._start:
+                return np.full(self.ncols, np.nan), np.full(self.ncols, np.nan)
+            return self._lo.copy(), self._hi.copy()
+
+    def since(self, generation, count):
+        """Get the rows appended after a reader's last update.
+
+        Parameters
+        ----------
+        generation : int
+            Store generation at the reader's last update.
+        count : int
+            Number of rows appended in that generation at the reader's last update.
+
+        Returns
+        -------
+        generation : int
+            Current store generation.
+        count : int
+            Current number of rows appended in this generation.
+        rows : array
+            Read-only view of the new rows. If the store has been cleared or rows
+            the reader hasn't seen have been evicted, all stored rows are returned.
+        complete : bool
+            True if `rows` holds all stored rows, i.e. the reader must redraw
+            instead of appending `rows` to what it already has.
+        """
+        with self._lock:
+            new = self._appended - count
+            complete = (generation != self.generation) or (
+                new > self._stop - self._start
+            )
+            if complete is True:
+                rows = self._buf[self._start : self._stop]
+            else:
+                rows = self._buf[self._stop - new : self._stop]
+            rows.flags.writeable = False
+            return self.generation, self._appended, rows, complete
+
+    def _extend(self, rows):
+        """Append rows.
+
+        Must be called with the lock held.
+        """
+        rows = np.asarray(rows, dtype=float).reshape(-1, self.ncols)
+        # rows that would be evicted straight away aren't stored, but still count as
+        # appended so readers know they missed them
+        total = len(rows)
+        if self.maxlen is not None and len(rows) > self.maxlen:
+            rows = rows[-self.maxlen :]
+        n = len(rows)
+        if self._stop + n > self._capacity:
+            self._make_room(n)
+        self._buf[self._stop : self._stop + n] = rows
+        self._stop += n
+        self._appended += total
+        if n > 0:
+            self._lo = np.fmin(self._lo, np.fmin.reduce(rows, axis=0))
+            self._hi = np.fmax(self._hi, np.fmax.reduce(rows, axis=0))
+        if self.maxlen is not None:
+            self._evict(self._stop - self.maxlen)
+
+    def _clear(self):
+        """Remove all rows and start a new generation.
+
+        Must be called with the lock held.
+        """
+        # allocate a new buffer so existing views stay valid
+        self._capacity = self._initial_capacity
+        self._buf = np.empty((self._capacity, self.ncols))
+        self._start = 0
+        self._stop = 0
+        self._appended = 0
+        self._reset_bounds()
+        self.generation += 1
+
+    def _reset_bounds(self):
+        """Forget the column bounds.
+
+        Must be called with the lock held.
+        """
+        self._lo = np.full(self.ncols, np.inf)
+        self._hi = np.full(self.ncols, -np.inf)
+        self._stale_bounds = False
+
+    def _evict(self, start):
+        """Drop stored rows before index `start` of the buffer.
+
+        Must be called with the lock held.
+        """
+        if start <= self._start:
+            return
+        evicted = self._buf[self._start : start]
+        if np.any(evicted <= self._lo) or np.any(evicted >= self._hi):
+            # an extreme is being evicted so the bounds must be recalculated
+            self._stale_bounds = True
+        self._start = start
+
+    def _make_room(self, n):
+        """Move stored rows into a new buffer with space for `n` more rows.
+
+        Must be called with the lock held.
+        """
+        if self.maxlen is None:
+            keep = self._buf[self._start : self._stop]
+            while len(keep) + n > self._capacity:
+                self._capacity *= 2
+        else:
+            self._evict(self._stop - (self.maxlen - n))
+            keep = self._buf[self._start : self._stop]
+        buf = np.empty((self._capacity, self.ncols))
+        buf[: len(keep)] = keep
+        self._buf = buf
+        self._start = 0
+        self._stop = len(keep)
+
+
+class KeyedSeriesStore:
+    """Series stores for each device of each stream within a memory budget.
+
+    A SeriesStore is kept for every (stream, device id) key, so the data of any
+    recent device can be looked up without waiting for it to be measured again. When
+    the allocated size of all stores exceeds `budget`, the least recently used stores
+    are evicted, except for the one being written.
+
+    A clear from a device ends its run rather than discarding its data, so the data
+    stay available until the device starts a new run.
+
+    Stores are SeriesStores unless a `factory` makes another kind, such as shared
+    memory stores. Stores with a `close` method are closed when they're evicted.
+    """
+
+    def __init__(self, columns, budget=None, maxlen=None, capacity=1024, factory=None):
+        """Construct keyed series store.
+
+        Parameters
+        ----------
+        columns : dict
+            Number of columns in each row of each stream.
+        budget : int or None
+            Maximum total size of the stores in bytes. If None, stores are never
+            evicted.
+        maxlen : int or None
+            Maximum number of rows kept by each store. If None, stores grow without
+            bound.
+        capacity : int
+            Initial number of rows allocated by each store.
+        factory : callable or None
+            Function making the store of a device from its stream, device id, and
+            number of columns. If None, SeriesStores with `maxlen` and `capacity` are
+            made.
+        """
+        self.columns = columns
+        self.budget = budget
+        self.maxlen = maxlen
+        self.capacity = capacity
+        self.factory = factory
+        self.nbytes = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        # (stream, idn) -> [store, nbytes, run ended], least recently used first
+        self._entries = collections.OrderedDict()
+        # most recently written device of each stream
+        self._latest = {}
+
+    def __len__(self):
+        """Get number of stores."""
+        return len(self._entries)
+
+    def get(self, stream, idn):
+        """Get the store of a device, marking it as recently used.
+
+        Parameters
+        ----------
+        stream : str
+            Stream name.
+        idn : str
+            Device id.
+
+        Returns
+        -------
+        store : SeriesStore or None
+            Store of the device, or None if there isn't one.
+        """
+        with self._lock:
+            entry = self._entries.get((stream, idn))
+            if entry is None:
+                return None
+            self._entries.move_to_end((stream, idn))
+            return entry[0]
+
+    def state(self, stream, idn):
+        """Get the version and length of the store of a device.
+
+        The store is marked as recently used.
+
+        Parameters
+        ----------
+        stream : str
+            Stream name.
+        idn : str
+            Device id.
+
+        Returns
+        -------
+        state : tuple or None
+            The store's `version` and number of rows, or None if the device has no
+            store.
+        """
+        store = self.get(stream, idn)
+        if store is None:
+            return None
+        return store.version, len(store)
+
+    def since(self, stream, idn, generation, count):
+        """Get the rows appended to a device's store after a reader's last update.
+
+        All results are plain values, so they can be sent to another process.
+
+        Parameters
+        ----------
+        stream : str
+            Stream name.
+        idn : str
+            Device id.
+        generation : int
+            Store generation at the reader's last update.
+        count : int
+            Number of rows appended in that generation at the reader's last update.
+
+        Returns
+        -------
+        generation, count, rows, complete
+            See `SeriesStore.since`. If the device has no store, there are no rows.
+        bounds : tuple of array
+            Minimum and maximum of each column, see `SeriesStore.bounds`.
+        msg : dict
+            Last message from the device.
+        maxlen : int or None
+            Maximum number of rows kept by the store, None if it's unbounded.
+        """
+        store = self.get(stream, idn)
+        if store is None:
+            ncols = self.columns[stream]
+            nan = np.full(ncols, np.nan)
+            msg = {"clear": True, "id": idn}
+            rows = np.empty((0, ncols))
+            return generation, count, rows, False, (nan, nan), msg, self.maxlen
+        return store.since(generation, count) + (store.bounds, store.msg, store.maxlen)
+
+    def latest(self, stream):
+        """Get the id of the device that most recently sent data on a stream.
+
+        Returns
+        -------
+        idn : str or None
+            Device id, or None if nothing has been received.
+        """
+        return self._latest.get(stream)
+
+    def devices(self, stream=None):
+        """Get the ids of devices with stores, most recently used first.
+
+        Parameters
+        ----------
+        stream : str or None
+            Only get devices of this stream. If None, get devices of all streams.
+
+        Returns
+        -------
+        ids : list of str
+            Device ids.
+        """
+        with self._lock:
+            keys = list(self._entries)
+        ids = []
+        for key_stream, idn in reversed(keys):
+            if ((stream is None) or (key_stream == stream)) and (idn not in ids):
+                ids.append(idn)
+        return ids
+
+    def extend(self, stream, idn, rows, msg=None):
+        """Append rows to the store of a device, see `SeriesStore.extend`."""
+        store = self._store(stream, idn)
+        store.extend(rows, msg)
+        self._account(stream, idn)
+
+    def replace(self, stream, idn, rows, msg=None):
+        """Replace the rows in the store of a device, see `SeriesStore.replace`."""
+        store = self._store(stream, idn)
+        store.replace(rows, msg)
+        self._account(stream, idn)
+
+    def end_run(self, stream, idn):
+        """End the current run of a device.
+
+        The stored data are kept, and cleared when the device sends new data.
+
+        Parameters
+        ----------
+        stream : str
+            Stream name.
+        idn : str
+            Device id.
+        """
+        with self._lock:
+            entry = self._entries.get((stream, idn))
+            if entry is not None:
+                entry[2] = True
+
+    def close(self):
+        """Close and forget all stores."""
+        with self._lock:
+            for store, _, _ in self._entries.values():
+                _close(store)
+            self._entries.clear()
+            self._latest.clear()
+            self.nbytes = 0
+
+    def _store(self, stream, idn):
+        """Get the store of a device to write to, creating it if necessary."""
+        with self._lock:
+            key = (stream, idn)
+            entry = self._entries.get(key)
+            if entry is None:
+                if self.factory is None:
+                    store = SeriesStore(
+                        self.columns[stream], self.maxlen, self.capacity
+                    )
+                else:
+                    store = self.factory(stream, idn, self.columns[stream])
+                entry = self._entries[key] = [store, 0, False]
+            else:
+                self._entries.move_to_end(key)
+            self._latest[stream] = idn
+            if entry[2] is True:
+                # the device has started a new run
+                entry[0].clear()
+                entry[2] = False
+            return entry[0]
+
+    def _account(self, stream, idn):
+        """Update the total size after a write, evicting stores over the budget."""
+        with self._lock:
+            entry = self._entries.get((stream, idn))
+            if entry is None:
+                return
+            nbytes = entry[0].nbytes
+            self.nbytes += nbytes - entry[1]
+            entry[1] = nbytes
+            if self.budget is None:
+                return
+            while (self.nbytes > self.budget) and (len(self._entries) > 1):
+                key = next(iter(self._entries))
+                if key == (stream, idn):
+                    self._entries.move_to_end(key)
+                    continue
+                store, nbytes, _ = self._entries.pop(key)
+                _close(store)
+                self.nbytes -= nbytes
+                self.evicted += 1
+
+
+def _close(store):
+    """Close a store if it holds resources other than memory."""
+    close = getattr(store, "close", None)
+    if close is not None:
+        close()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""Serve the plotter to many users with several web worker processes.
+
+plotter.py runs the MQTT client and a single development web server in one process.
+For production, this script runs MQTT ingest once, in a dedicated ingest process
+holding the series stores, and serves the Dash app from N web worker processes:
+
+    python serve.py -w 4 --http-port 8050 -t data
+
+The workers share one listening socket, opened before they are started, and each
+serves requests from a thread pool. They read the series state from the ingest
+process over a local IPC connection (a multiprocessing manager), so every worker
+shows the same data and dashboard concurrency scales with the number of cores. The
+browser keeps track of what it has drawn, so consecutive requests from one browser
+can be served by different workers.
+
+With --shared-rows, the ingest process keeps the last rows of each device in shared
+memory ring buffers instead (see sharedstore.py). Workers then only ask the ingest
+process which devices there are, and read rows by mapping the buffers read-only,
+without them being pickled and sent between processes.
+
+Workers that exit are restarted. If the ingest process exits, everything is shut
+down. Processes are started by forking, so this only runs on POSIX systems.
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from multiprocessing.managers import BaseManager
+
+from werkzeug.serving import make_server
+
+import plotter
+from recorder import Recorder
+from sharedstore import SharedStoresReader, new_prefix
+
+# methods of IngestState callable by web workers
+EXPOSED = ("latest", "devices", "state", "since", "ready", "collect_metrics")
+
+
+class IngestState:
+    """Series state and readiness of the ingest process, served to web workers.
+
+    It offers the reading methods of KeyedSeriesStore, so a proxy for it can stand
+    in for `plotter.STORES` in a web worker.
+    """
+
+    def latest(self, stream):
+        """See KeyedSeriesStore.latest."""
+        return plotter.STORES.latest(stream)
+
+    def devices(self, stream=None):
+        """See KeyedSeriesStore.devices."""
+        return plotter.STORES.devices(stream)
+
+    def state(self, stream, idn):
+        """See KeyedSeriesStore.state."""
+        return plotter.STORES.state(stream, idn)
+
+    def since(self, stream, idn, generation, count):
+        """See KeyedSeriesStore.since."""
+        return plotter.STORES.since(stream, idn, generation, count)
+
+    def ready(self):
+        """Check whether the broker has acknowledged the MQTT subscriptions."""
+        return plotter.subscribed.is_set()
+
+    def collect_metrics(self):
+        """Get the metrics of the ingest process and producers."""
+        return plotter.collect_metrics()
+
+
+class StateManager(BaseManager):
+    """Manager serving the ingest state to web workers."""
+
+
+StateManager.register("state", exposed=EXPOSED)
+
+
+def run_ingest(args, authkey, connection):
+    """Receive MQTT data and serve the series state until terminated.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Plotter options.
+    authkey : bytes
+        Key web workers must present to connect.
+    connection : multiprocessing.connection.Connection
+        Pipe the address of the state server is sent to once it's listening.
+    """
+    # exit cleanly when terminated, so recordings are closed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    plotter.configure(args)
+    if args.record is not None:
+        plotter.RECORDER = Recorder(args.record)
+
+    state = IngestState()
+    StateManager.register("state", callable=lambda: state, exposed=EXPOSED)
+    manager = StateManager(address=("127.0.0.1", 0), authkey=authkey)
+    server = manager.get_server()
+    connection.send(server.address)
+    connection.close()
+
+    mqttc = plotter.start_subscriber(args.host, args.t, args.s, args.port)
+    try:
+        server.serve_forever()
+    finally:
+        # stop ingesting before closing what it writes to
+        try:
+            plotter.stop_subscriber(mqttc, args.t)
+        finally:
+            if plotter.RECORDER is not None:
+                plotter.RECORDER.close()
+            plotter.STORES.close()
+
+
+def run_worker(args, authkey, address, sock):
+    """Serve the Dash app from a listening socket until terminated.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Plotter options.
+    authkey : bytes
+        Key of the state server.
+    address : tuple
+        Address of the state server.
+    sock : socket.socket
+        Listening socket shared by all web workers.
+    """
+    plotter.configure(args)
+    plotter.WORKER = multiprocessing.current_process().name
+    manager = StateManager(address=address, authkey=authkey)
+    manager.connect()
+    columns = plotter.STORES.columns
+    plotter.INGEST = plotter.STORES = manager.state()
+    if plotter.SHARED_PREFIX is not None:
+        plotter.STORES = SharedStoresReader(
+            plotter.INGEST, plotter.SHARED_PREFIX, columns
+        )
+    app = plotter.app.server
+    server = make_server(
+        args.http_host, args.http_port, app, threaded=True, fd=sock.fileno()
+    )
+    server.serve_forever()
+
+
+def serve(args):
+    """Start the ingest process and web workers, and supervise them.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Plotter and serving options.
+    """
+    # stop the workers and ingest process when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    context = multiprocessing.get_context("fork")
+    authkey = os.urandom(32)
+    if (args.shared_rows > 0) and (args.shared_prefix is None):
+        # the ingest process and workers must agree on the segment names
+        args.shared_prefix = new_prefix()
+
+    sock = socket.create_server((args.http_host, args.http_port), backlog=128)
+
+    receiver, sender = context.Pipe(duplex=False)
+    ingest = context.Process(
+        target=run_ingest, args=(args, authkey, sender), name="ingest"
+    )
+    ingest.start()
+    address = receiver.recv()
+
+    def start_worker(i):
+        worker = context.Process(
+            target=run_worker, args=(args, authkey, address, sock), name=f"web-{i}"
+        )
+        worker.start()
+        return worker
+
+    workers = [start_worker(i) for i in range(args.w)]
+    print(
+        f"Serving on http://{args.http_host}:{args.http_port} with {args.w} workers,"
+        + f" ingesting from mqtt://{args.host}:{args.port}/{args.t}"
+    )
+    if args.shared_rows > 0:
+        print(f"Sharing stores in memory segments named {args.shared_prefix}*")
+    try:
+        while ingest.is_alive():
+            for i, worker in enumerate(workers):
+                if worker.is_alive() is False:
+                    print(f"Web worker {i} exited with code {worker.exitcode}")
+                    workers[i] = start_worker(i)
+            time.sleep(1)
+        print(f"Ingest process exited with code {ingest.exitcode}")
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for process in workers + [ingest]:
+            process.terminate()
+        for process in workers + [ingest]:
+            process.join()
+        sock.close()
+
+
+if __name__ == "__main__":
+    parser = plotter.make_parser()
+    parser.add_argument(
+        "-w",
+        metavar="w",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of web worker processes. Defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--http-host",
+        type=str,
+        default=plotter.DASHHOST,
+        help="Address to serve the dashboard on.",
+    )
+    parser.add_argument(
+        "--http-port", type=int, default=8050, help="Port to serve the dashboard on."
+    )
+    serve(parser.parse_args())
@@ -0,0 +1,701 @@
+#!/usr/bin/env python
+"""Series stores in shared memory, readable by other processes without copying.
+
+A SharedSeriesStore keeps the rows of one device in a ring buffer in a shared memory
+segment, and has the same methods as a ring-buffered SeriesStore. The process
+receiving the data writes to it. Any number of other processes, such as web workers,
+exporters, and analysis scripts, map the segment read-only with a
+SharedSeriesReader, knowing only its name:
+
+    reader = SharedSeriesReader(segment_name(prefix, "exp1", "dev0"))
+    generation, count, rows, complete = reader.since(-1, 0)
+
+A segment holds a header of int64 fields, the minimum and maximum of each column,
+the last message as JSON, and an array of shape (`maxlen`, columns) with row i of a
+generation in slot i % `maxlen`. The header is protected by a sequence lock: the
+writer makes `seq` odd before a change and even after it, and a reader reads again
+if `seq` was odd or changed while it read. Rows are written in place, and a slot is
+only reused after `maxlen` more rows have been appended, so a reader checks that
+the rows it read weren't overwritten before it finished with them. Snapshots are
+therefore consistent without any locking between processes, on CPUs that don't
+reorder stores, such as x86-64.
+
+`since` copies just the new rows out of shared memory, which is a memory copy rather
+than pickling them and sending them between processes. Readers that process rows in
+place get views with `view`, and then check that they were valid with `intact`.
+
+There is only one writer per segment. Segments are unlinked by the writer's `close`,
+or by the multiprocessing resource tracker if the writer exits without closing them.
+A segment left behind anyway, e.g. if the writer was killed, is replaced by the next
+writer of a segment with the same name.
+
+Print the state of a segment with
+
+    python sharedstore.py prefix exp1 dev0
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    import _posixshmem
+except ImportError:
+    _posixshmem = None
+
+MAGIC = 0x31534853
+
+# indices of the int64 header fields
+_MAGIC, _SEQ, _NCOLS, _MAXLEN, _GENERATION, _APPENDED, _VERSION = range(7)
+_STALE, _CLOSED, _MSG_LENGTH = range(7, 10)
+_HEADER_FIELDS = 16
+
+# space for the last message as JSON
+MSG_BYTES = 1024
+
+# longest time in seconds a reader waits for a write to finish
+SPIN_TIMEOUT = 1.0
+
+
+def _layout(ncols, maxlen):
+    """Get the offsets of the bounds, message, and rows, and the segment size."""
+    bounds = _HEADER_FIELDS * 8
+    msg = bounds + 2 * ncols * 8
+    rows = -(-(msg + MSG_BYTES) // 64) * 64
+    return bounds, msg, rows, rows + maxlen * ncols * 8
+
+
+def new_prefix():
+    """Make a random prefix for the segment names of a writing process.
+
+    Returns
+    -------
+    prefix : str
+        Segment name prefix.
+    """
+    return f"dmt{os.urandom(4).hex()}_"
+
+
+def segment_name(prefix, stream, idn):
+    """Get the name of the segment holding a device's store.
+
+    Names are hashed so they are short and valid on every platform.
+
+    Parameters
+    ----------
+    prefix : str
+        Segment name prefix of the writing process.
+    stream : str
+        Stream name.
+    idn : str
+        Device id.
+
+    Returns
+    -------
+    name : str
+        Segment name.
+    """
+    key = json.dumps([stream, idn]).encode()
+    return prefix + hashlib.blake2b(key, digest_size=8).hexdigest()
+
+
+def shared_factory(prefix, maxlen):
+    """Make a factory of shared stores for KeyedSeriesStore.
+
+    Parameters
+    ----------
+    prefix : str
+        Segment name prefix.
+    maxlen : int
+        Number of rows kept by each store.
+
+    Returns
+    -------
+    factory : callable
+        Function making the SharedSeriesStore of a device from its stream, device
+        id, and number of columns.
+    """
+
+    def factory(stream, idn, ncols):
+        return SharedSeriesStore(segment_name(prefix, stream, idn), ncols, maxlen)
+
+    return factory
+
+
+def _map(name):
+    """Map an existing segment read-only.
+
+    Returns
+    -------
+    buffer : mmap.mmap or memoryview
+        Mapped segment.
+    release : callable
+        Function unmapping the segment.
+    """
+    if _posixshmem is None:
+        # the segment stays writable, and isn't unlinked when this process exits
+        shm = shared_memory.SharedMemory(name)
+        return shm.buf, shm.close
+    fd = _posixshmem.shm_open("/" + name, os.O_RDONLY, mode=0o600)
+    try:
+        buffer = mmap.mmap(fd, os.fstat(fd).st_size, prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+    return buffer, buffer.close
+
+
+class _Segment:
+    """Reading methods shared by the writer and readers of a segment."""
+
+    def __init__(self, buffer, ncols, maxlen):
+        self.ncols = ncols
+        self.maxlen = maxlen
+        self._buffer = buffer
+        bounds, msg, rows, size = _layout(ncols, maxlen)
+        self.nbytes = size
+        self._header = np.ndarray((_HEADER_FIELDS,), np.int64, buffer, 0)
+        self._bounds = np.ndarray((2, ncols), np.float64, buffer, bounds)
+        self._msg = np.ndarray((MSG_BYTES,), np.uint8, buffer, msg)
+        self._rows = np.ndarray((maxlen, ncols), np.float64, buffer, rows)
+        # held while the segment is referred to, so it isn't unmapped by another
+        # thread, and reentrant since reads check the header again before returning
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        """Get number of stored rows."""
+        return self.state()[1]
+
+    @property
+    def generation(self):
+        """Get number of clears."""
+        return int(self._snapshot()[0][_GENERATION])
+
+    @property
+    def version(self):
+        """Get number of changes."""
+        return int(self._snapshot()[0][_VERSION])
+
+    @property
+    def msg(self):
+        """Get the last message."""
+        return json.loads(self._snapshot()[2])
+
+    @property
+    def data(self):
+        """Get a copy of the stored rows."""
+        return self.since(-1, 0)[2]
+
+    @property
+    def bounds(self):
+        """Get the minimum and maximum of each column, see `SeriesStore.bounds`."""
+        return self._read(-1, 0)[4]
+
+    def state(self):
+        """Get the version and number of stored rows at the same time.
+
+        Returns
+        -------
+        version : int
+            Number of changes.
+        length : int
+            Number of stored rows.
+        """
+        header = self._snapshot()[0]
+        return int(header[_VERSION]), int(min(header[_APPENDED], self.maxlen))
+
+    def since(self, generation, count):
+        """Get copies of the rows appended after a reader's last update.
+
+        See `SeriesStore.since`.
+        """
+        return self._read(generation, count)[:4]
+
+    def view(self):
+        """Get read-only views of the stored rows without copying them.
+
+        The rows may be overwritten while they're being used, so check they weren't
+        with `intact` afterwards.
+
+        Returns
+        -------
+        generation : int
+            Store generation.
+        first : int
+            Number of rows appended in the generation before the first stored row.
+        parts : list of array
+            One or two views of consecutive rows, oldest first.
+        """
+        header = self._snapshot()[0]
+        appended = int(header[_APPENDED])
+        first = appended - min(appended, self.maxlen)
+        parts = [self._rows[s] for s in self._slices(first, appended)]
+        for part in parts:
+            part.flags.writeable = False
+        return int(header[_GENERATION]), first, parts
+
+    def intact(self, generation, first):
+        """Check whether rows read from the store haven't been overwritten.
+
+        Parameters
+        ----------
+        generation : int
+            Store generation when the rows were read.
+        first : int
+            Number of rows appended in the generation before the first row read.
+
+        Returns
+        -------
+        intact : bool
+            False if the store has been cleared or the rows have been overwritten.
+        """
+        header = self._snapshot()[0]
+        return bool(
+            (header[_GENERATION] == generation)
+            and (header[_APPENDED] - self.maxlen <= first)
+        )
+
+    def _read(self, generation, count):
+        """Get new rows with the bounds and message consistent with them.
+
+        Returns
+        -------
+        generation, count, rows, complete
+            See `SeriesStore.since`.
+        bounds : tuple of array
+            See `SeriesStore.bounds`.
+        msg : dict
+            Last message.
+        """
+        with self._lock:
+            while True:
+                header, bounds, msg = self._snapshot()
+                current = int(header[_GENERATION])
+                appended = int(header[_APPENDED])
+                stored = min(appended, self.maxlen)
+                new = appended - count
+                complete = (generation != current) or (new > stored)
+                first = appended - stored if complete is True else count
+                parts = [self._rows[s] for s in self._slices(first, appended)]
+                rows = np.concatenate(parts)
+                # first row that must not have been overwritten by the end of the read
+                checked = first
+                if stored == 0:
+                    bounds = np.full((2, self.ncols), np.nan)
+                elif header[_STALE] == 1:
+                    # an evicted row held an extreme, so recalculate from the stored
+                    # rows, in any order
+                    window = rows if complete is True else self._rows[:stored]
+                    bounds = np.stack(
+                        [
+                            np.fmin.reduce(window, axis=0),
+                            np.fmax.reduce(window, axis=0),
+                        ]
+                    )
+                    checked = appended - stored
+                if self.intact(current, checked) is False:
+                    continue
+                rows.flags.writeable = False
+                return (
+                    current,
+                    appended,
+                    rows,
+                    complete,
+                    (bounds[0], bounds[1]),
+                    json.loads(msg),
+                )
+
+    def _snapshot(self):
+        """Read the header, bounds, and message consistently.
+
+        Returns
+        -------
+        header : array
+            Copy of the header fields.
+        bounds : array
+            Copy of the minimum and maximum of each column.
+        msg : bytes
+            Last message as JSON.
+        """
+        with self._lock:
+            header = self._header
+            deadline = None
+            while True:
+                self._check_open()
+                seq = header[_SEQ]
+                if seq % 2 == 0:
+                    values = header.copy()
+                    bounds = self._bounds.copy()
+                    msg = self._msg[: values[_MSG_LENGTH]].tobytes()
+                    if header[_SEQ] == seq:
+                        return values, bounds, msg
+                if deadline is None:
+                    deadline = time.monotonic() + SPIN_TIMEOUT
+                elif time.monotonic() > deadline:
+                    raise TimeoutError("Shared series store is stuck in a write.")
+                time.sleep(0)
+
+    def _check_open(self):
+        """Raise an error if the segment has been closed."""
+
+    def _slices(self, first, stop):
+        """Get the slices of the ring holding rows [first, stop) of a generation."""
+        start = first % self.maxlen
+        n = stop - first
+        if start + n <= self.maxlen:
+            return [slice(start, start + n)]
+        return [slice(start, self.maxlen), slice(0, start + n - self.maxlen)]
+
+    def _release(self):
+        """Drop the arrays mapping the segment, keeping a closed copy of the header.
+
+        The segment can only be unmapped once nothing refers to it.
+        """
+        header = self._header.copy()
+        header[_CLOSED] = 1
+        msg = self._msg.copy()
+        bounds = self._bounds.copy()
+        self._header = header
+        self._msg = msg
+        self._bounds = bounds
+        self._rows = np.zeros((self.maxlen, self.ncols))
+        self._buffer = None
+
+
+class SharedSeriesStore(_Segment):
+    """Ring buffer of rows in a new shared memory segment, see the module docs."""
+
+    def __init__(self, name, ncols, maxlen):
+        """Construct shared series store.
+
+        An existing segment with the same name is unlinked and replaced.
+
+        Parameters
+        ----------
+        name : str
+            Segment name, see `segment_name`.
+        ncols : int
+            Number of columns in each row.
+        maxlen : int
+            Number of rows to keep.
+        """
+        self.name = name
+        size = _layout(ncols, maxlen)[3]
+        try:
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # left by a writer with the same prefix that didn't close it, e.g. after
+            # a crash, so replace it
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+        super().__init__(self._shm.buf, ncols, maxlen)
+        header = self._header
+        header[:] = 0
+        header[_NCOLS] = ncols
+        header[_MAXLEN] = maxlen
+        self._reset_bounds()
+        self._write_msg({"clear": True, "id": "-"})
+        # readers check the magic number, so it's written last
+        header[_MAGIC] = MAGIC
+
+    def append(self, row, msg=None):
+        """Append a single row, see `SeriesStore.append`."""
+        self.extend(np.asarray(row, dtype=float).reshape(1, self.ncols), msg)
+
+    def extend(self, rows, msg=None):
+        """Append several rows at once, see `SeriesStore.extend`."""
+        rows = np.asarray(rows, dtype=float).reshape(-1, self.ncols)
+        with self._lock:
+            self._write(rows=rows, msg=msg)
+
+    def replace(self, rows, msg=None):
+        """Replace all stored rows in a single write, see `SeriesStore.replace`."""
+        rows = np.asarray(rows, dtype=float).reshape(-1, self.ncols)
+        with self._lock:
+            self._write(clear=True, rows=rows, msg=msg)
+
+    def clear(self, msg=None):
+        """Remove all stored rows, see `SeriesStore.clear`."""
+        with self._lock:
+            self._write(clear=True, msg=msg)
+
+    @property
+    def bounds(self):
+        """Get the minimum and maximum of each column, see `SeriesStore.bounds`.
+
+        Bounds that are out of date after an eviction are recalculated and written
+        back, so readers don't have to recalculate them.
+        """
+        with self._lock:
+            header = self._header
+            if header[_STALE] == 1:
+                stored = min(header[_APPENDED], self.maxlen)
+                window = self._rows[:stored]
+                header[_SEQ] += 1
+                self._bounds[0] = np.fmin.reduce(window, axis=0)
+                self._bounds[1] = np.fmax.reduce(window, axis=0)
+                header[_STALE] = 0
+                header[_SEQ] += 1
+            if header[_APPENDED] == 0:
+                return np.full(self.ncols, np.nan), np.full(self.ncols, np.nan)
+            return self._bounds[0].copy(), self._bounds[1].copy()
+
+    def close(self):
+        """Mark the store closed to readers, and unlink its segment.
+
+        Views from `view` must have been dropped.
+        """
+        with self._lock:
+            if self._buffer is None:
+                return
+            self._header[_CLOSED] = 1
+            self._release()
+            self._shm.close()
+            self._shm.unlink()
+
+    def _write(self, clear=False, rows=None, msg=None):
+        """Clear the store and append rows, as one change seen by readers.
+
+        Must be called with the lock held.
+
+        Parameters
+        ----------
+        clear : bool
+            Remove all stored rows first, starting a new generation.
+        rows : array or None
+            Array of shape (n, `ncols`) to append.
+        msg : dict or None
+            Message to store as the last message.
+        """
+        header = self._header
+        header[_SEQ] += 1
+        if clear is True:
+            header[_GENERATION] += 1
+            header[_APPENDED] = 0
+            self._reset_bounds()
+        if (rows is not None) and (len(rows) > 0):
+            # rows that would be evicted straight away aren't stored, but still count
+            # as appended so readers know they missed them
+            total = len(rows)
+            rows = rows[-self.maxlen :]
+            n = len(rows)
+            appended = int(header[_APPENDED])
+            stop = appended + total
+            self._evict(
+                max(appended - self.maxlen, 0), min(stop - self.maxlen, appended)
+            )
+            i = 0
+            for s in self._slices(stop - n, stop):
+                self._rows[s] = rows[i : i + s.stop - s.start]
+                i += s.stop - s.start
+            lo, hi = self._bounds
+            np.fmin(lo, np.fmin.reduce(rows, axis=0), out=lo)
+            np.fmax(hi, np.fmax.reduce(rows, axis=0), out=hi)
+            header[_APPENDED] = stop
+        if msg is not None:
+            self._write_msg(msg)
+        header[_VERSION] += 1
+        header[_SEQ] += 1
+
+    def _evict(self, start, stop):
+        """Mark the bounds stale if rows about to be overwritten held an extreme.
+
+        Rows [start, stop) of the generation are checked. Must be called with the
+        lock held, in a write.
+        """
+        if (stop <= start) or (self._header[_STALE] == 1):
+            return
+        lo, hi = self._bounds
+        for s in self._slices(start, stop):
+            evicted = self._rows[s]
+            if np.any(evicted <= lo) or np.any(evicted >= hi):
+                self._header[_STALE] = 1
+                return
+
+    def _reset_bounds(self):
+        """Forget the column bounds.
+
+        Must be called with the lock held, in a write.
+        """
+        self._bounds[0] = np.inf
+        self._bounds[1] = -np.inf
+        self._header[_STALE] = 0
+
+    def _write_msg(self, msg):
+        """Store the last message as JSON.
+
+        Must be called with the lock held, in a write.
+        """
+        text = json.dumps(msg, default=str).encode()
+        if len(text) > MSG_BYTES:
+            text = json.dumps({"clear": msg.get("clear"), "id": msg.get("id")}).encode()
+        self._msg[: len(text)] = np.frombuffer(text, np.uint8)
+        self._header[_MSG_LENGTH] = len(text)
+
+
+class SharedSeriesReader(_Segment):
+    """Read-only view of a SharedSeriesStore in any process, see the module docs.
+
+    Reading methods raise FileNotFoundError once the store has been closed.
+    """
+
+    def __init__(self, name):
+        """Construct shared series reader.
+
+        Parameters
+        ----------
+        name : str
+            Segment name, see `segment_name`.
+
+        Raises
+        ------
+        FileNotFoundError
+            If there is no segment with this name.
+        ValueError
+            If the segment isn't a shared series store, or isn't ready yet.
+        """
+        self.name = name
+        buffer, self._unmap = _map(name)
+        header = np.ndarray((_HEADER_FIELDS,), np.int64, buffer, 0)
+        if (len(buffer) < _HEADER_FIELDS * 8) or (header[_MAGIC] != MAGIC):
+            del header
+            self._unmap()
+            raise ValueError(f"{name} isn't a shared series store.")
+        super().__init__(buffer, int(header[_NCOLS]), int(header[_MAXLEN]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Unmap the segment.
+
+        Views from `view` must have been dropped.
+        """
+        with self._lock:
+            if self._buffer is None:
+                return
+            self._release()
+            self._unmap()
+
+    def _check_open(self):
+        """Raise FileNotFoundError if the store has been closed."""
+        if self._header[_CLOSED] == 1:
+            raise FileNotFoundError(f"Shared series store {self.name} was closed.")
+
+
+class SharedStoresReader:
+    """Read the shared stores of a KeyedSeriesStore from another process.
+
+    It offers the reading methods of KeyedSeriesStore, so it can stand in for one.
+    Devices are listed by `index`, such as a proxy for the writer's KeyedSeriesStore,
+    while rows are read from shared memory. Reading doesn't mark stores as recently
+    used in the writer.
+    """
+
+    def __init__(self, index, prefix, columns):
+        """Construct shared stores reader.
+
+        Parameters
+        ----------
+        index : object
+            Object with the `latest` and `devices` methods of KeyedSeriesStore.
+        prefix : str
+            Segment name prefix of the writing process.
+        columns : dict
+            Number of columns in each row of each stream.
+        """
+        self.index = index
+        self.prefix = prefix
+        self.columns = columns
+        self._lock = threading.Lock()
+        self._readers = {}
+
+    def latest(self, stream):
+        """See KeyedSeriesStore.latest."""
+        return self.index.latest(stream)
+
+    def devices(self, stream=None):
+        """See KeyedSeriesStore.devices."""
+        return self.index.devices(stream)
+
+    def state(self, stream, idn):
+        """See KeyedSeriesStore.state."""
+        return self._call(stream, idn, SharedSeriesReader.state)
+
+    def since(self, stream, idn, generation, count):
+        """See KeyedSeriesStore.since."""
+
+        def read(reader):
+            return reader._read(generation, count) + (reader.maxlen,)
+
+        result = self._call(stream, idn, read)
+        if result is None:
+            ncols = self.columns[stream]
+            nan = np.full(ncols, np.nan)
+            msg = {"clear": True, "id": idn}
+            rows = np.empty((0, ncols))
+            return generation, count, rows, False, (nan, nan), msg, None
+        return result
+
+    def close(self):
+        """Unmap all segments."""
+        with self._lock:
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+
+    def _call(self, stream, idn, method):
+        """Call a method of a device's reader, attaching to its segment if needed.
+
+        Returns None if the device has no store.
+        """
+        key = (stream, idn)
+        for _ in range(2):
+            with self._lock:
+                reader = self._readers.get(key)
+                if reader is None:
+                    try:
+                        reader = SharedSeriesReader(
+                            segment_name(self.prefix, stream, idn)
+                        )
+                    except (FileNotFoundError, ValueError):
+                        return None
+                    self._readers[key] = reader
+            try:
+                return method(reader)
+            except FileNotFoundError:
+                # the store was evicted, and may have been made again since
+                with self._lock:
+                    if self._readers.get(key) is reader:
+                        del self._readers[key]
+                reader.close()
+        return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("prefix", type=str, help="Segment name prefix.")
+    parser.add_argument("stream", type=str, help="Stream name.")
+    parser.add_argument("id", type=str, help="Device id.")
+    args = parser.parse_args()
+
+    with SharedSeriesReader(segment_name(args.prefix, args.stream, args.id)) as reader:
+        generation, count, rows, complete, (lo, hi), msg = reader._read(-1, 0)
+        print(f"segment     {reader.name} ({reader.nbytes} bytes)")
+        print(f"generation  {generation}")
+        print(f"rows        {len(rows)} of {reader.maxlen}, {count} appended")
+        print(f"minimum     {lo}")
+        print(f"maximum     {hi}")
+        print(f"message     {msg}")
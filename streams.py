@@ -0,0 +1,233 @@
+"""Encoding of experiment data into MQTT payloads."""
+
+import abc
+import json
+import time
+
+import numpy as np
+
+import wire
+
+
+class DataStream(abc.ABC):
+    """Encode data from an experiment into payloads for a queue publisher.
+
+    Subclasses implement `handle_data` for a kind of data. They are combined with a
+    publisher class providing `append_payload`, e.g.
+    ``class VoltageDataHandler(VoltageStream, MQTTQueuePublisher)``.
+    """
+
+    # identifies the kind of data in binary records, set by subclasses
+    stream_id = 0
+
+    def __init__(self, idn="", wire_format="json", **kwargs):
+        """Construct data stream.
+
+        Parameters
+        ----------
+        idn : str
+            Identity string to send with data.
+        wire_format : {"json", "binary"}
+            Format to encode data in.
+        **kwargs
+            Keyword arguments passed to the publisher.
+        """
+        super().__init__(**kwargs)
+        self.idn = idn
+        self.wire_format = wire_format
+        self._seq = 0
+
+    def stamp(self, msg):
+        """Add a sequence number and acquisition time to a JSON message.
+
+        Parameters
+        ----------
+        msg : dict
+            Message to send.
+
+        Returns
+        -------
+        msg : dict
+            The message with "seq" and "time" keys added.
+        """
+        msg["seq"] = self._seq
+        msg["time"] = time.time()
+        self._seq += 1
+        return msg
+
+    def encode_data(self, data, clear=False):
+        """Encode data as a binary record for this stream.
+
+        The record is stamped with a sequence number and the current time.
+
+        Parameters
+        ----------
+        data : array
+            Array of data rows, or a single row.
+        clear : bool
+            Flag requesting that stored data be cleared.
+
+        Returns
+        -------
+        payload : bytes
+            Encoded record.
+        """
+        payload = wire.encode(
+            data, stream=self.stream_id, idn=self.idn, seq=self._seq, clear=clear
+        )
+        self._seq += 1
+        return payload
+
+    def append_clear(self):
+        """Append a request to clear stored data to the queue."""
+        if self.wire_format == "binary":
+            payload = self.encode_data(np.empty((0, 0)), clear=True)
+        else:
+            payload = json.dumps(self.stamp({"clear": True, "id": f"{self.idn}"}))
+        self.append_payload(payload, droppable=False)
+
+    @abc.abstractmethod
+    def handle_data(self, data):
+        """Perform tasks with data.
+
+        Parameters
+        ----------
+        data : list or array
+            Data from an experiment.
+        """
+
+
+class VoltageStream(DataStream):
+    """Encode voltage vs. time data."""
+
+    stream_id = 1
+
+    def handle_data(self, data):
+        """Perform tasks with data.
+
+        Parameters
+        ----------
+        data : list or str
+            List of data from exp_1.
+        """
+        if self.wire_format == "binary":
+            payload = self.encode_data(data[:2])
+        else:
+            payload = {
+                "x1": data[0],
+                "y1": data[1],
+                "clear": False,
+                "id": self.idn,
+            }
+            # turn dict into string that mqtt can send
+            payload = json.dumps(self.stamp(payload))
+        self.append_payload(payload)
+
+
+class IVStream(DataStream):
+    """Encode current vs. voltage data."""
+
+    stream_id = 2
+
+    def handle_data(self, data):
+        """Perform tasks with data.
+
+        Parameters
+        ----------
+        data : array
+            Array of data from exp_2.
+        """
+        if self.wire_format == "binary":
+            # send straight from the array buffer
+            payload = self.encode_data(data)
+        else:
+            payload = {
+                "data": data.tolist(),
+                "clear": False,
+                "id": self.idn,
+            }
+            # turn dict into string that mqtt can send
+            payload = json.dumps(self.stamp(payload))
+        self.append_payload(payload)
+
+
+class MPPTStream(DataStream):
+    """Encode max power point tracking data."""
+
+    stream_id = 3
+
+    def handle_data(self, data):
+        """Perform tasks with data.
+
+        Parameters
+        ----------
+        data : list
+            List of data from exp_3.
+        """
+        if self.wire_format == "binary":
+            payload = self.encode_data(data[:4])
+        else:
+            payload = {
+                "x1": data[0],
+                "y1": data[1],
+                "y2": data[2],
+                "y3": data[3],
+                "clear": False,
+                "id": self.idn,
+            }
+            payload = json.dumps(self.stamp(payload))
+        self.append_payload(payload)
+
+
+class CurrentStream(DataStream):
+    """Encode current vs. time data."""
+
+    stream_id = 4
+
+    def handle_data(self, data):
+        """Perform tasks with data.
+
+        Parameters
+        ----------
+        data : list
+            List of data from exp_4.
+        """
+        if self.wire_format == "binary":
+            payload = self.encode_data(data[:2])
+        else:
+            payload = {
+                "x1": data[0],
+                "y1": data[1],
+                "clear": False,
+                "id": self.idn,
+            }
+            # turn dict into string that mqtt can send
+            payload = json.dumps(self.stamp(payload))
+        self.append_payload(payload)
+
+
+class EQEStream(DataStream):
+    """Encode EQE data."""
+
+    stream_id = 5
+
+    def handle_data(self, data):
+        """Perform tasks with data.
+
+        Parameters
+        ----------
+        data : list
+            List of data from exp_5.
+        """
+        if self.wire_format == "binary":
+            payload = self.encode_data(data[:3])
+        else:
+            payload = {
+                "x1": data[0],
+                "y1": data[1],
+                "y2": data[2],
+                "clear": False,
+                "id": self.idn,
+            }
+            payload = json.dumps(self.stamp(payload))
+        self.append_payload(payload)
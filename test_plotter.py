@@ -0,0 +1,63 @@
+"""Tests of the plotter's MQTT subscriber, run against the local broker in broker.py.
+
+Run with ``python -m pytest test_plotter.py``.
+"""
+
+import json
+import time
+
+import paho.mqtt.client as mqtt
+
+import plotter
+import wire
+from broker import Broker
+
+
+def _wait(condition, timeout=5):
+    """Wait until a condition is true, returning whether it became true in time."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_malformed_message_is_dropped():
+    """A message a handler fails on is dropped without stopping the subscriber."""
+    broker = Broker(port=0)
+    broker.start_thread()
+    topic = "test"
+    subscriber = plotter.start_subscriber(broker.host, topic, port=broker.port)
+    publisher = mqtt.Client()
+    try:
+        assert plotter.subscribed.wait(5)
+        publisher.connect(broker.host, broker.port)
+        publisher.loop_start()
+
+        metrics_topic = f"{topic}/{wire.METRICS_SUBTOPIC}/foo"
+        bad = [
+            ("exp1", json.dumps({"clear": False, "id": "dev0"})),
+            ("exp2", json.dumps({"clear": False, "id": "dev0", "data": [[1]]})),
+            ("exp1", wire.encode([[1.0, 2.0]], idn="dev0")[:-4]),
+        ]
+        publisher.publish(metrics_topic, "[]", qos=1).wait_for_publish()
+        publisher.publish(metrics_topic, b"not json", qos=1).wait_for_publish()
+        for subtopic, payload in bad:
+            publisher.publish(f"{topic}/{subtopic}", payload, qos=1).wait_for_publish()
+        valid = {"clear": False, "id": "dev0", "x1": 1.0, "y1": 2.0}
+        publisher.publish(f"{topic}/exp1", json.dumps(valid), qos=1).wait_for_publish()
+
+        assert _wait(lambda: plotter.STORES.get("exp1", "dev0") is not None)
+        assert plotter.STORES.get("exp1", "dev0").data.tolist() == [[1.0, 2.0]]
+        assert subscriber._thread.is_alive()
+        dropped = plotter.DROPPED.labels("exp1").get()
+        assert dropped + plotter.DROPPED.labels("exp2").get() == len(bad)
+        # malformed metrics are ignored, keeping the previous ones
+        assert plotter.REMOTE_METRICS["foo"][1] == []
+    finally:
+        publisher.loop_stop()
+        publisher.disconnect()
+        plotter.stop_subscriber(subscriber, topic)
+        broker.stop_thread()
+        plotter.STORES.close()
@@ -0,0 +1,75 @@
+"""Tests of the producer's queue publisher.
+
+Run with ``python -m pytest test_producer.py``.
+"""
+
+import threading
+import time
+
+import pytest
+
+import producer
+
+
+class StuckConnection:
+    """Connection to a broker that never acknowledges a message."""
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos, callback):
+        self.published.append(payload)
+
+
+def test_end_q_with_full_window():
+    """Ending the queue doesn't hang when no message is ever acknowledged."""
+    publisher = producer.MQTTQueuePublisher(max_inflight=2)
+    publisher._connection = StuckConnection()
+    publisher.start_q("test/stuck")
+    for i in range(5):
+        publisher.append_payload(b"%d" % i)
+
+    start = time.monotonic()
+    ended = threading.Thread(target=publisher.end_q, args=(0.1,))
+    with pytest.warns(UserWarning):
+        ended.start()
+        ended.join(5)
+    assert not ended.is_alive()
+    assert time.monotonic() - start < 1
+    assert not publisher._t.is_alive()
+    assert publisher._connection.published == [b"0", b"1"]
+
+
+class FailingConnection:
+    """Connection whose publications all fail."""
+
+    host = "localhost"
+    port = 1883
+
+    def __init__(self):
+        self.attempts = 0
+        self.closed = False
+
+    def open(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def publish(self, topic, payload, qos, callback):
+        self.attempts += 1
+        raise OSError("Not connected.")
+
+
+def test_metrics_export_survives_errors(monkeypatch):
+    """Failed publications don't stop the export, and stopping releases the pool."""
+    connection = FailingConnection()
+    monkeypatch.setattr(producer.mqttpool.pool, "factory", lambda h, p: connection)
+    with pytest.warns(UserWarning):
+        producer.start_metrics_export("localhost", "test", interval=0.01)
+        time.sleep(0.1)
+        assert producer._metrics_thread.is_alive()
+        producer.stop_metrics_export(5)
+    assert connection.attempts > 1
+    assert producer._metrics_thread is None
+    assert connection.closed is True
@@ -0,0 +1,198 @@
+"""Tests of the bounded publish queue and its overflow policies.
+
+Run with ``python -m pytest test_publishqueue.py``.
+"""
+
+import queue
+import threading
+
+import pytest
+
+from publishqueue import PublishQueue
+
+# sentinel like the one telling a queue publisher thread to stop
+_STOP = object()
+
+
+def _drain(q):
+    """Get every item in the queue, marking them done."""
+    items = []
+    while len(q) > 0:
+        items.append(q.get(timeout=0))
+        q.task_done()
+    return items
+
+
+def test_invalid_policy():
+    """Unknown overflow policies are rejected."""
+    with pytest.raises(ValueError):
+        PublishQueue(policy="drop_everything")
+
+
+def test_unbounded():
+    """Without bounds items are never discarded."""
+    q = PublishQueue()
+    for i in range(100):
+        assert q.put(b"%d" % i) is True
+    assert _drain(q) == [b"%d" % i for i in range(100)]
+    assert q.dropped == 0
+
+
+def test_block():
+    """A put to a full queue waits until the consumer has made room."""
+    q = PublishQueue(maxsize=2, policy="block")
+    q.put(b"a")
+    q.put(b"b")
+    t = threading.Thread(target=q.put, args=(b"c",))
+    t.start()
+    t.join(0.1)
+    assert t.is_alive()
+    assert len(q) == 2
+
+    assert q.get(timeout=0) == b"a"
+    t.join(5)
+    assert not t.is_alive()
+    assert [q.get(timeout=0), q.get(timeout=0)] == [b"b", b"c"]
+    assert q.dropped == 0
+
+
+def test_drop_oldest():
+    """The oldest items are discarded to make room for new ones."""
+    q = PublishQueue(maxsize=3, policy="drop_oldest")
+    for item in [b"a", b"b", b"c", b"d", b"e"]:
+        assert q.put(item) is True
+    assert _drain(q) == [b"c", b"d", b"e"]
+    assert q.dropped == 2
+    # discarded items don't have to be marked done
+    assert q.flush(0) is True
+
+
+def test_drop_oldest_maxbytes():
+    """Enough old items are discarded for a new item to fit in `maxbytes`."""
+    q = PublishQueue(maxbytes=10, policy="drop_oldest")
+    q.put(b"aaaa")
+    q.put(b"bbbb")
+    q.put(b"cccccc")
+    assert q.nbytes == 10
+    assert q.dropped == 1
+    assert _drain(q) == [b"bbbb", b"cccccc"]
+
+
+def test_drop_newest():
+    """A new item that doesn't fit is discarded."""
+    q = PublishQueue(maxsize=2, policy="drop_newest")
+    assert q.put(b"a") is True
+    assert q.put(b"b") is True
+    assert q.put(b"c") is False
+    assert q.dropped == 1
+    assert _drain(q) == [b"a", b"b"]
+    assert q.flush(0) is True
+
+
+def test_conflate():
+    """A new item replaces the newest queued item of its stream."""
+    q = PublishQueue(maxsize=2, policy="conflate")
+    q.put(b"a1", key="a")
+    q.put(b"b1", key="b")
+    q.put(b"a2", key="a")
+    q.put(b"a3", key="a")
+    q.put(b"b2", key="b")
+    assert q.conflated == 3
+    assert q.dropped == 0
+    assert _drain(q) == [b"a3", b"b2"]
+
+
+def test_conflate_new_key():
+    """Without a queued item of the same stream, the oldest item is discarded."""
+    q = PublishQueue(maxsize=2, policy="conflate")
+    q.put(b"a1", key="a")
+    q.put(b"b1", key="b")
+    q.put(b"c1", key="c")
+    assert q.conflated == 0
+    assert q.dropped == 1
+    assert _drain(q) == [b"b1", b"c1"]
+
+
+def test_conflate_size():
+    """Conflating keeps track of the size of the queued items."""
+    q = PublishQueue(maxbytes=6, policy="conflate")
+    q.put(b"aaa", key="a")
+    q.put(b"bbb", key="b")
+    q.put(b"a", key="a")
+    assert q.nbytes == 4
+
+
+def test_conflate_not_past_clear():
+    """Items aren't conflated into an item of their stream queued before a clear."""
+    q = PublishQueue(maxsize=2, policy="conflate")
+    q.put(b"old", key="a")
+    q.put(b"clear", key="a", droppable=False)
+    q.put(b"new", key="a")
+    assert q.conflated == 0
+    assert _drain(q) == [b"clear", b"new"]
+
+
+def test_conflate_maxbytes():
+    """A bigger replacement that would exceed `maxbytes` discards old items instead."""
+    q = PublishQueue(maxbytes=6, policy="conflate")
+    q.put(b"aa", key="a")
+    q.put(b"bbb", key="b")
+    q.put(b"aaaa", key="a")
+    assert q.nbytes <= 6
+    assert q.conflated == 0
+    assert _drain(q) == [b"aaaa"]
+
+
+@pytest.mark.parametrize("policy", ["block", "drop_oldest", "drop_newest", "conflate"])
+def test_not_droppable(policy):
+    """Items that mustn't be discarded go past the bounds and are never dropped."""
+    q = PublishQueue(maxsize=2, maxbytes=2, policy=policy)
+    q.put(b"a", key="a")
+    q.put(b"b", key="b")
+    assert q.put(b"clear", key="a", droppable=False) is True
+    q.put(_STOP, front=True, droppable=False)
+    assert len(q) == 4
+    assert q.get(timeout=0) is _STOP
+    q.task_done()
+    if policy != "block":
+        # the new item makes room by discarding or replacing a droppable one
+        q.put(b"c", key="a")
+    items = _drain(q)
+    assert b"clear" in items
+    assert q.flush(0) is True
+
+
+def test_drop_oldest_past_not_droppable():
+    """Items that can't be discarded still count towards the bounds."""
+    q = PublishQueue(maxsize=3, policy="drop_oldest")
+    q.put(b"clear", droppable=False)
+    for i in range(7):
+        q.put(b"%d" % i)
+    assert len(q) == 3
+    assert q.dropped == 5
+    assert _drain(q) == [b"clear", b"5", b"6"]
+
+
+def test_get_timeout():
+    """get raises queue.Empty if nothing arrives in time."""
+    q = PublishQueue()
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.01)
+
+
+def test_flush():
+    """flush waits for items to be marked done, not just taken from the queue."""
+    q = PublishQueue()
+    q.put(b"a")
+    q.put(b"b")
+    assert q.flush(0.01) is False
+    q.get(timeout=0)
+    q.get(timeout=0)
+    # a consumer stuck publishing never marks its items done
+    assert q.flush(0.05) is False
+
+    q.task_done()
+    t = threading.Timer(0.05, q.task_done)
+    t.start()
+    assert q.flush(5) is True
+    t.join()
@@ -0,0 +1,226 @@
+"""Tests of the series stores against a brute-force reference.
+
+Run with ``python -m pytest test_series.py``.
+"""
+
+import itertools
+import threading
+
+import numpy as np
+import pytest
+
+from series import SeriesStore
+from sharedstore import SharedSeriesStore, new_prefix
+
+_names = itertools.count()
+
+
+@pytest.fixture(params=["series", "shared"])
+def make_store(request):
+    """Get a function making empty stores of the kind being tested."""
+    stores = []
+
+    def make(ncols, maxlen=None, capacity=1024):
+        if request.param == "series":
+            store = SeriesStore(ncols, maxlen, capacity)
+        elif maxlen is None:
+            pytest.skip("Shared stores are always bounded.")
+        else:
+            name = f"{new_prefix()}_{next(_names)}"
+            store = SharedSeriesStore(name, ncols, maxlen)
+            stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+class Reference:
+    """Rows appended since the last clear, kept in full."""
+
+    def __init__(self, ncols, maxlen=None):
+        self.ncols = ncols
+        self.maxlen = maxlen
+        self.generation = 0
+        self.rows = np.empty((0, ncols))
+
+    def extend(self, rows):
+        self.rows = np.concatenate([self.rows, rows])
+
+    def clear(self):
+        self.generation += 1
+        self.rows = np.empty((0, self.ncols))
+
+    @property
+    def stored(self):
+        if self.maxlen is None:
+            return self.rows
+        return self.rows[len(self.rows) - min(len(self.rows), self.maxlen) :]
+
+    @property
+    def bounds(self):
+        stored = self.stored
+        if len(stored) == 0:
+            return np.full(self.ncols, np.nan), np.full(self.ncols, np.nan)
+        return np.fmin.reduce(stored, axis=0), np.fmax.reduce(stored, axis=0)
+
+
+class Reader:
+    """Copy of a store's rows kept up to date with `since`, like a browser graph."""
+
+    def __init__(self, ncols):
+        self.generation = -1
+        self.count = 0
+        self.rows = np.empty((0, ncols))
+
+    def update(self, store):
+        self.generation, self.count, rows, complete = store.since(
+            self.generation, self.count
+        )
+        if complete is True:
+            self.rows = np.array(rows)
+        else:
+            self.rows = np.concatenate([self.rows, rows])
+
+
+def check(store, reference, reader):
+    """Check a store and an updated reader match the reference."""
+    np.testing.assert_array_equal(store.data, reference.stored)
+    lo, hi = store.bounds
+    ref_lo, ref_hi = reference.bounds
+    np.testing.assert_array_equal(lo, ref_lo)
+    np.testing.assert_array_equal(hi, ref_hi)
+
+    reader.update(store)
+    assert reader.generation == store.generation
+    assert reader.count == len(reference.rows)
+    # the reader may hold older rows than the store, but the latest must match
+    stored = reference.stored
+    np.testing.assert_array_equal(reader.rows[len(reader.rows) - len(stored) :], stored)
+
+
+@pytest.mark.parametrize("maxlen", [None, 7, 64])
+def test_random_appends_and_clears(make_store, maxlen):
+    """Bounds and new rows match the reference through eviction and clears."""
+    rng = np.random.default_rng(0)
+    ncols = 3
+    store = make_store(ncols, maxlen, capacity=4)
+    reference = Reference(ncols, maxlen)
+    reader = Reader(ncols)
+    for i in range(300):
+        if rng.random() < 0.05:
+            store.clear()
+            reference.clear()
+        else:
+            rows = rng.integers(-50, 50, (int(rng.integers(0, 12)), ncols))
+            store.extend(rows)
+            reference.extend(rows)
+        # readers don't always keep up
+        if i % 3 == 0:
+            check(store, reference, reader)
+    check(store, reference, reader)
+
+
+def test_evicted_extremes(make_store):
+    """Bounds are recalculated when the rows holding the extremes are evicted."""
+    store = make_store(2, maxlen=4, capacity=4)
+    reference = Reference(2, maxlen=4)
+    reader = Reader(2)
+    # decreasing maximum and increasing minimum, so every eviction drops an extreme
+    for i in range(20):
+        row = np.array([[100 - i, i]], dtype=float)
+        store.append(row[0])
+        reference.extend(row)
+        check(store, reference, reader)
+
+
+def test_wrap_around(make_store):
+    """Blocks of rows straddling the end of the ring are stored in order."""
+    maxlen = 5
+    store = make_store(1, maxlen)
+    reference = Reference(1, maxlen)
+    reader = Reader(1)
+    start = 0
+    for n in [3, 4, 2, 5, 1, 9, 4]:
+        rows = np.arange(start, start + n, dtype=float).reshape(-1, 1)
+        start += n
+        store.extend(rows)
+        reference.extend(rows)
+        check(store, reference, reader)
+
+
+def test_since_after_clear(make_store):
+    """A reader gets all stored rows after a clear, even if as many were appended."""
+    store = make_store(2, maxlen=8)
+    reference = Reference(2, maxlen=8)
+    reader = Reader(2)
+    rows = np.arange(6, dtype=float).reshape(-1, 2)
+    store.extend(rows)
+    reference.extend(rows)
+    check(store, reference, reader)
+
+    store.clear()
+    reference.clear()
+    store.extend(rows + 10)
+    reference.extend(rows + 10)
+    generation, count, new, complete = store.since(reader.generation, reader.count)
+    assert complete is True
+    assert count == 3
+    np.testing.assert_array_equal(new, rows + 10)
+
+
+def test_since_after_missed_eviction(make_store):
+    """A reader that fell behind by more than the window gets the whole window."""
+    store = make_store(1, maxlen=4)
+    store.extend(np.arange(3, dtype=float).reshape(-1, 1))
+    generation, count, _, _ = store.since(-1, 0)
+    store.extend(np.arange(3, 9, dtype=float).reshape(-1, 1))
+    generation, count, rows, complete = store.since(generation, count)
+    assert complete is True
+    assert count == 9
+    np.testing.assert_array_equal(rows.ravel(), [5, 6, 7, 8])
+
+
+def test_empty_bounds(make_store):
+    """An empty or cleared store has NaN bounds."""
+    store = make_store(2, maxlen=4)
+    assert np.isnan(store.bounds[0]).all() and np.isnan(store.bounds[1]).all()
+    store.extend([[1.0, 2.0]])
+    store.clear()
+    assert np.isnan(store.bounds[0]).all() and np.isnan(store.bounds[1]).all()
+
+
+def test_replace_is_one_change(make_store):
+    """A replacement is seen as a single change, never as an empty store."""
+    store = make_store(1, maxlen=8)
+    store.extend([[1.0], [2.0]])
+    generation, version = store.generation, store.version
+    store.replace([[3.0], [4.0], [5.0]], msg={"clear": False, "id": "dev0"})
+    assert store.generation == generation + 1
+    assert store.version == version + 1
+    assert store.msg["id"] == "dev0"
+    _, count, rows, complete = store.since(generation, 2)
+    assert complete is True
+    assert count == 3
+    np.testing.assert_array_equal(rows.ravel(), [3, 4, 5])
+
+
+def test_replace_seen_by_readers(make_store):
+    """Readers polling during replacements never see a store without rows."""
+    store = make_store(1, maxlen=64)
+    store.extend(np.ones((10, 1)))
+    stop = threading.Event()
+
+    def replace():
+        while not stop.is_set():
+            store.replace(np.ones((10, 1)))
+
+    writer = threading.Thread(target=replace)
+    writer.start()
+    try:
+        for _ in range(2000):
+            assert len(store.since(-1, 0)[2]) == 10
+    finally:
+        stop.set()
+        writer.join()
@@ -0,0 +1,128 @@
+"""Tests of the binary wire format.
+
+Run with ``python -m pytest test_wire.py``.
+"""
+
+import numpy as np
+import pytest
+
+import wire
+
+
+def _encode_v1(data, stream=0, idn="", seq=0, clear=False):
+    """Encode a version 1 record, which has no acquisition time."""
+    data = np.asarray(data, dtype="<f8")
+    rows, cols = data.shape
+    idn = idn.encode()
+    header = wire._HEADERS[1]
+    fields = header.pack(
+        wire.MAGIC, 1, stream, wire.CLEAR if clear else 0, 1, len(idn), seq, rows, cols
+    )
+    pad = b"\0" * (wire._data_offset(len(idn), header) - header.size - len(idn))
+    return b"".join([fields, idn, pad, data.T.tobytes()])
+
+
+@pytest.mark.parametrize("dtype", ["<f8", "<f4"])
+@pytest.mark.parametrize("idn", ["", "a", "dev0", "pixel-12 µ"])
+def test_round_trip(dtype, idn):
+    """Encoded records decode to the same fields with aligned data."""
+    data = np.arange(12, dtype=float).reshape(4, 3) / 7
+    payload = wire.encode(
+        data, stream=3, idn=idn, seq=2**32 + 5, timestamp=12.5, dtype=dtype
+    )
+    assert wire.is_binary(payload)
+    record, end = wire.decode(payload)
+    assert end == len(payload)
+    assert record.stream == 3
+    assert record.idn == idn
+    assert record.seq == 5
+    assert record.clear is False
+    assert record.timestamp == 12.5
+    assert record.data.dtype == np.dtype(dtype)
+    np.testing.assert_array_equal(record.data, data.astype(dtype))
+    # the data start on an 8-byte boundary of the record
+    assert (end - record.data.nbytes) % 8 == 0
+    assert record.data.flags.writeable is False
+
+
+def test_round_trip_single_row_and_clear():
+    """A 1D array is a single row, and the clear flag is kept."""
+    record, _ = wire.decode(wire.encode([1.0, 2.0], idn="x", clear=True))
+    assert record.clear is True
+    np.testing.assert_array_equal(record.data, [[1.0, 2.0]])
+
+
+def test_decode_v1():
+    """Version 1 records decode without an acquisition time."""
+    data = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+    payload = _encode_v1(data, stream=1, idn="dev1", seq=7, clear=True)
+    record, end = wire.decode(payload)
+    assert end == len(payload)
+    assert record == (1, "dev1", 7, True, record.data, None)
+    np.testing.assert_array_equal(record.data, data)
+
+
+def test_iter_records():
+    """Records of either version and data type placed back to back are all decoded."""
+    payloads = [
+        wire.encode([[1.0, 2.0]], idn="a", seq=1),
+        # an odd number of float32 elements leaves the next record misaligned
+        wire.encode([[1.0, 2.0, 3.0]], idn="bb", seq=2, dtype="<f4"),
+        _encode_v1([[4.0, 5.0]], idn="c", seq=3),
+        wire.encode(np.zeros((0, 2)), idn="d", seq=4, clear=True),
+        wire.encode([[6.0, 7.0]], seq=5),
+    ]
+    records = list(wire.iter_records(b"".join(payloads)))
+    assert [r.seq for r in records] == [1, 2, 3, 4, 5]
+    assert [r.idn for r in records] == ["a", "bb", "c", "d", ""]
+    for record, payload in zip(records, payloads):
+        np.testing.assert_array_equal(record.data, wire.decode(payload)[0].data)
+
+
+def test_id_too_long():
+    """Identity strings that don't fit in the header are rejected."""
+    wire.encode([[1.0]], idn="x" * wire.MAX_ID_BYTES)
+    with pytest.raises(ValueError):
+        wire.encode([[1.0]], idn="x" * (wire.MAX_ID_BYTES + 1))
+    # the limit is in encoded bytes, not characters
+    with pytest.raises(ValueError):
+        wire.encode([[1.0]], idn="µ" * 128)
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_truncated(version):
+    """Records cut short anywhere raise ValueError instead of decoding garbage."""
+    if version == 1:
+        payload = _encode_v1([[1.0, 2.0]], idn="dev0")
+    else:
+        payload = wire.encode([[1.0, 2.0]], idn="dev0")
+    for n in range(len(payload)):
+        with pytest.raises(ValueError):
+            wire.decode(payload[:n])
+    # also when the record isn't the first in the payload
+    first = wire.encode([[0.0]])
+    with pytest.raises(ValueError):
+        list(wire.iter_records(first + payload[:-1]))
+
+
+def test_oversized_counts():
+    """A header claiming more data than the payload holds raises ValueError."""
+    payload = bytearray(wire.encode([[1.0, 2.0]], idn="dev0"))
+    # number of rows
+    payload[12:16] = (2**32 - 1).to_bytes(4, "little")
+    with pytest.raises(ValueError):
+        wire.decode(bytes(payload))
+
+
+def test_unsupported_header():
+    """Unknown versions and data types raise ValueError."""
+    payload = bytearray(wire.encode([[1.0]]))
+    payload[3] = wire.VERSION + 1
+    with pytest.raises(ValueError):
+        wire.decode(bytes(payload))
+    payload = bytearray(wire.encode([[1.0]]))
+    payload[6] = 9
+    with pytest.raises(ValueError):
+        wire.decode(bytes(payload))
+    with pytest.raises(ValueError):
+        wire.decode(b'{"clear": true}')
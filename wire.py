@@ -0,0 +1,227 @@
+"""Compact binary wire format for data sent over MQTT.
+
+A payload is one or more records placed back to back. Each record is a fixed,
+little-endian header followed by the device identity string, padding to an 8-byte
+boundary, and the data as raw little-endian columns (column-major):
+
+======  =====  ==============================================
+offset  type   field
+======  =====  ==============================================
+0       3s     magic, b"DMQ"
+3       u8     format version
+4       u8     stream id
+5       u8     flags (bit 0: clear)
+6       u8     dtype code (1: float64, 2: float32)
+7       u8     length of identity string in bytes
+8       u32    sequence number
+12      u32    number of rows
+16      u16    number of columns
+18      f64    acquisition time (seconds since the epoch)
+26      ...    identity string (utf-8), padding, data
+======  =====  ==============================================
+
+Version 1 records, which have no acquisition time, can still be decoded.
+
+Because the data are contiguous, a decoder can wrap them with np.frombuffer without
+creating Python objects for each element. The data start on an 8-byte boundary from
+the start of their record, so they're aligned if the record is. Records aren't
+padded at the end though, so in a payload of several records, a float32 record with
+an odd number of elements leaves the records after it 4 bytes off a boundary, and
+their data may be misaligned. Such data are still decoded correctly, only more
+slowly.
+"""
+
+import collections
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b"DMQ"
+VERSION = 2
+
+# flags
+CLEAR = 0x01
+
+# subtopic where subscribers advertise the formats they can decode
+FORMATS_SUBTOPIC = "formats"
+SUPPORTED_FORMATS = ("binary", "json")
+
+# subtopic where producers publish their metrics, followed by a source name
+METRICS_SUBTOPIC = "metrics"
+
+# subtopic where producers receive commands, followed by the command name
+CONTROL_SUBTOPIC = "control"
+
+# subtopic where producers publish profiles, followed by a source name
+PROFILE_SUBTOPIC = "profile"
+
+# longest identity string in bytes, its length is stored in a u8
+MAX_ID_BYTES = 255
+
+_HEADERS = {1: struct.Struct("<3sBBBBBIIH"), 2: struct.Struct("<3sBBBBBIIHd")}
+_HEADER = _HEADERS[VERSION]
+_DTYPES = {1: np.dtype("<f8"), 2: np.dtype("<f4")}
+_DTYPE_CODES = {dtype: code for code, dtype in _DTYPES.items()}
+
+Record = collections.namedtuple(
+    "Record", ["stream", "idn", "seq", "clear", "data", "timestamp"]
+)
+
+
+def _data_offset(id_length, header=_HEADER):
+    """Get offset of the data from the start of a record."""
+    n = header.size + id_length
+    return n + (-n % 8)
+
+
+def is_binary(payload):
+    """Check whether a payload is in the binary wire format.
+
+    Parameters
+    ----------
+    payload : bytes or str
+        MQTT payload.
+
+    Returns
+    -------
+    binary : bool
+        True if the payload starts with the binary format magic bytes.
+    """
+    return isinstance(payload, (bytes, bytearray, memoryview)) and (
+        bytes(payload[:3]) == MAGIC
+    )
+
+
+def encode(data, stream=0, idn="", seq=0, clear=False, dtype="<f8", timestamp=None):
+    """Encode an array as a binary record.
+
+    Parameters
+    ----------
+    data : array
+        2D array of shape (rows, columns). A 1D array is treated as a single row.
+    stream : int
+        Stream id identifying the kind of data.
+    idn : str
+        Identity string of the device the data came from.
+    seq : int
+        Sequence number of the record in its stream.
+    clear : bool
+        Flag requesting that stored data be cleared.
+    dtype : str or numpy.dtype
+        Type to send the data as, little-endian float64 or float32.
+    timestamp : float or None
+        Time the data was acquired in seconds since the epoch. If None, the current
+        time is used.
+
+    Returns
+    -------
+    payload : bytes
+        Encoded record.
+
+    Raises
+    ------
+    ValueError
+        If the encoded identity string is longer than `MAX_ID_BYTES`.
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    data = np.asarray(data, dtype=dtype)
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    rows, cols = data.shape
+    idn = idn.encode()
+    if len(idn) > MAX_ID_BYTES:
+        raise ValueError(
+            f"Identity string is {len(idn)} bytes long, at most {MAX_ID_BYTES} bytes"
+            + " can be encoded."
+        )
+    if timestamp is None:
+        timestamp = time.time()
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        stream,
+        CLEAR if clear is True else 0,
+        _DTYPE_CODES[dtype],
+        len(idn),
+        seq & 0xFFFFFFFF,
+        rows,
+        cols,
+        timestamp,
+    )
+    pad = b"\0" * (_data_offset(len(idn)) - _HEADER.size - len(idn))
+    # transpose so each column is contiguous
+    return b"".join([header, idn, pad, data.T.tobytes()])
+
+
+def decode(payload, offset=0):
+    """Decode a single record from a payload.
+
+    Parameters
+    ----------
+    payload : bytes
+        Payload holding one or more records.
+    offset : int
+        Position of the record in the payload.
+
+    Returns
+    -------
+    record : Record
+        Decoded record. Its data is a read-only view of `payload` with shape
+        (rows, columns). Its timestamp is None for version 1 records.
+    end : int
+        Position in the payload just after the record.
+
+    Raises
+    ------
+    ValueError
+        If the record isn't in a supported version of the format, or the payload is
+        too short to hold it.
+    """
+    if bytes(payload[offset : offset + 3]) != MAGIC:
+        raise ValueError("Payload is not in the binary wire format.")
+    if len(payload) < offset + 4:
+        raise ValueError("Payload is too short to hold a record header.")
+    version = payload[offset + 3]
+    if version not in _HEADERS:
+        raise ValueError(f"Unsupported wire format version: {version}.")
+    header = _HEADERS[version]
+    if len(payload) < offset + header.size:
+        raise ValueError("Payload is too short to hold a record header.")
+    fields = header.unpack_from(payload, offset)
+    _, _, stream, flags, dtype_code, id_length, seq, rows, cols = fields[:9]
+    timestamp = fields[9] if version >= 2 else None
+    if dtype_code not in _DTYPES:
+        raise ValueError(f"Unsupported data type code: {dtype_code}.")
+    dtype = _DTYPES[dtype_code]
+    start = offset + _data_offset(id_length, header)
+    end = start + rows * cols * dtype.itemsize
+    if len(payload) < end:
+        raise ValueError(
+            f"Payload is too short to hold a record of {rows} rows and {cols}"
+            + f" columns: {len(payload) - offset} bytes from the record's start,"
+            + f" {end - offset} needed."
+        )
+    id_start = offset + header.size
+    idn = bytes(payload[id_start : id_start + id_length]).decode()
+    data = np.frombuffer(payload, dtype, rows * cols, start).reshape(cols, rows).T
+    return Record(stream, idn, seq, bool(flags & CLEAR), data, timestamp), end
+
+
+def iter_records(payload):
+    """Iterate over the records in a payload.
+
+    Parameters
+    ----------
+    payload : bytes
+        Payload holding one or more records.
+
+    Yields
+    ------
+    record : Record
+        Decoded record.
+    """
+    offset = 0
+    while offset < len(payload):
+        record, offset = decode(payload, offset)
+        yield record